@@ -4,10 +4,11 @@ from flask_login import LoginManager
 from flask_migrate import Migrate
 from flask_mail import Mail
 from app.config import config
+from app.routing import RoutingSession
 import os
 
 # Initialize Flask extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login = LoginManager()
 login.login_view = 'auth.login'
 login.login_message = 'Please log in to access this page.'
@@ -28,7 +29,14 @@ def create_app(config_name=None):
     
     # Initialize extensions
     db.init_app(app)
+    from app import database, instrumentation, metrics, routing
+    database.init_app(app)
+    routing.init_app(app)
+    instrumentation.init_app(app)
+    metrics.init_app(app)
     login.init_app(app)
+    from app.passwords import hasher
+    hasher.init_app(app)
     migrate.init_app(app, db)
     mail.init_app(app)
     
@@ -40,6 +48,39 @@ def create_app(config_name=None):
     from app.errors import register_error_handlers
     register_error_handlers(app)
     
+    # Register CLI commands
+    from app.commands import register_commands
+    register_commands(app)
+    
+    # Keep the search index in step with article and course writes
+    from app import search  # noqa: F401
+    
+    # Response and fragment cache, invalidated on model writes
+    from app.cache import cache
+    cache.init_app(app)
+    
+    # Per-worker cache used by the Flask-Login user loader
+    from app import user_cache
+    user_cache.init_app(app)
+    
+    # Bounded worker pool delivering outgoing mail
+    from app.mailer import mail_dispatcher
+    mail_dispatcher.init_app(app)
+    
+    # Buffered lesson heartbeats, flushed in bulk
+    from app.progress import heartbeats
+    heartbeats.init_app(app)
+    
+    # Content-addressed upload storage and the avatar pipeline on top of it
+    from app.storage import storage
+    storage.init_app(app)
+    from app import images
+    images.init_app(app)
+    
+    # Fingerprinted static assets (after `flask assets build`)
+    from app import assets
+    assets.init_app(app)
+    
     # Import blueprints from blueprints folder
     from app.blueprints.main.routes import main_bp
     from app.blueprints.auth.routes import auth_bp
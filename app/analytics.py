@@ -0,0 +1,318 @@
+"""Pre-aggregated analytics for the admin dashboard.
+
+Payments, signups, enrollments, course completions and reviews are rolled up
+into hourly and daily buckets (``revenue_rollup`` and ``activity_rollup``) by
+``flask analytics rollup``, so the dashboard reads a few hundred small rows
+instead of scanning the raw tables.
+
+Each source keeps a watermark. A run finds the hours holding rows created or
+changed since the watermark (less ``ANALYTICS_ROLLUP_OVERLAP`` seconds, for
+transactions that committed late), re-aggregates just those hours from the
+raw rows, then re-aggregates the affected days from the hourly rows. Buckets
+are replaced, not incremented, so reruns are harmless, and a payment whose
+status changes weeks later simply marks its original hour dirty again.
+``--full`` rebuilds everything from history; use it after bulk loads or
+deletes, which leave no changed rows to find.
+
+Buckets are UTC. Completions are counted by ``enrollments.completed_at``,
+so courses completed before it was recorded are not included.
+"""
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from app import db
+from app.models import (ActivityRollup, Course, Payment, Review, RevenueRollup, RollupWatermark, User,
+                        enrollments)
+
+PERIOD_HOUR = 'hour'
+PERIOD_DAY = 'day'
+PERIOD_STEPS = {PERIOD_HOUR: timedelta(hours=1), PERIOD_DAY: timedelta(days=1)}
+
+
+# Start of the hour or day containing `column`, computed in the database. The
+# unit is inlined rather than bound so SELECT and GROUP BY use the same expression.
+def truncate(column, period):
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return db.func.date_trunc(db.literal_column(f"'{period}'"), column, type_=db.DateTime)
+    if dialect == 'sqlite':
+        # Same text layout SQLAlchemy stores datetimes in, so comparisons still work
+        layout = '%Y-%m-%d %H:00:00.000000' if period == PERIOD_HOUR else '%Y-%m-%d 00:00:00.000000'
+        return db.func.strftime(db.literal_column(f"'{layout}'"), column, type_=db.DateTime)
+    raise NotImplementedError(f'No date truncation for {dialect}')
+
+
+def floor(moment, period):
+    if period == PERIOD_HOUR:
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# Merge sorted bucket starts into [start, end) spans of consecutive buckets
+def _spans(buckets, period):
+    step = PERIOD_STEPS[period]
+    spans = []
+    for bucket in buckets:
+        if spans and spans[-1][1] == bucket:
+            spans[-1][1] = bucket + step
+        else:
+            spans.append([bucket, bucket + step])
+    return spans
+
+
+# A raw table rolled up into one of the rollup tables. `aggregate` and
+# `sum_hours` select the rollup's `columns` after `period`, grouped by bucket.
+class RevenueSource:
+    name = 'revenue'
+    rollup = RevenueRollup
+    columns = ('period', 'bucket', 'course_id', 'currency', 'status', 'payments', 'amount')
+
+    def __init__(self):
+        self.time_column = Payment.created_at
+
+    # Status and amount change after creation, so updated rows mark their original hour dirty
+    def changed_since(self, since):
+        return db.or_(Payment.created_at >= since, Payment.updated_at >= since)
+
+    def rollup_filter(self):
+        return ()
+
+    # Hourly rows from the payments
+    def aggregate(self, period, bucket):
+        return db.select(
+            db.literal(period), bucket, Payment.course_id, Payment.currency, Payment.status,
+            db.func.count(Payment.id), db.func.coalesce(db.func.sum(Payment.amount), 0.0),
+        ).group_by(bucket, Payment.course_id, Payment.currency, Payment.status)
+
+    # Daily rows from the hourly ones
+    def sum_hours(self, period, bucket):
+        rollup = self.rollup
+        return db.select(
+            db.literal(period), bucket, rollup.course_id, rollup.currency, rollup.status,
+            db.func.sum(rollup.payments), db.func.sum(rollup.amount),
+        ).group_by(bucket, rollup.course_id, rollup.currency, rollup.status)
+
+
+class ActivitySource:
+    rollup = ActivityRollup
+    columns = ('period', 'bucket', 'metric', 'course_id', 'count')
+
+    def __init__(self, name, time_column, course_column=None):
+        self.name = name
+        self.time_column = time_column
+        self.course_column = course_column
+
+    def changed_since(self, since):
+        return self.time_column >= since
+
+    def rollup_filter(self):
+        return (ActivityRollup.metric == self.name,)
+
+    def aggregate(self, period, bucket):
+        if self.course_column is None:
+            return db.select(db.literal(period), bucket, db.literal(self.name), db.null(),
+                             db.func.count()).group_by(bucket)
+        return db.select(db.literal(period), bucket, db.literal(self.name), self.course_column,
+                         db.func.count()).group_by(bucket, self.course_column)
+
+    def sum_hours(self, period, bucket):
+        rollup = self.rollup
+        return db.select(
+            db.literal(period), bucket, rollup.metric, rollup.course_id, db.func.sum(rollup.count),
+        ).where(rollup.metric == self.name).group_by(bucket, rollup.metric, rollup.course_id)
+
+
+def _sources():
+    return (
+        RevenueSource(),
+        ActivitySource('signups', User.created_at),
+        ActivitySource('enrollments', enrollments.c.enrolled_at, enrollments.c.course_id),
+        ActivitySource('completions', enrollments.c.completed_at, enrollments.c.course_id),
+        ActivitySource('reviews', Review.created_at, Review.course_id),
+    )
+
+
+ACTIVITY_METRICS = ('signups', 'enrollments', 'completions', 'reviews')
+
+
+# Replace the hourly rollup rows of `source` in [start, end) from the raw rows
+# (everything when start is None)
+def _rebuild_hours(source, start=None, end=None):
+    rollup = source.rollup
+    hour = truncate(source.time_column, PERIOD_HOUR)
+    delete = db.delete(rollup).where(rollup.period == PERIOD_HOUR, *source.rollup_filter())
+    query = source.aggregate(PERIOD_HOUR, hour).where(source.time_column.isnot(None))
+    if start is not None:
+        delete = delete.where(rollup.bucket >= start, rollup.bucket < end)
+        query = query.where(source.time_column >= start, source.time_column < end)
+    db.session.execute(delete)
+    db.session.execute(db.insert(rollup).from_select(source.columns, query))
+
+
+# Replace the daily rollup rows of `source` in [start, end) by summing its hourly rows
+def _rebuild_days(source, start=None, end=None):
+    rollup = source.rollup
+    day = truncate(rollup.bucket, PERIOD_DAY)
+    delete = db.delete(rollup).where(rollup.period == PERIOD_DAY, *source.rollup_filter())
+    query = source.sum_hours(PERIOD_DAY, day).where(rollup.period == PERIOD_HOUR)
+    if start is not None:
+        delete = delete.where(rollup.bucket >= start, rollup.bucket < end)
+        query = query.where(rollup.bucket >= start, rollup.bucket < end)
+    db.session.execute(delete)
+    db.session.execute(db.insert(rollup).from_select(source.columns, query))
+
+
+# Hours holding rows of `source` created or changed since `since`
+def _dirty_hours(source, since):
+    hour = truncate(source.time_column, PERIOD_HOUR)
+    return db.session.scalars(
+        db.select(hour).distinct()
+        .where(source.changed_since(since), source.time_column.isnot(None))
+        .order_by(hour)
+    ).all()
+
+
+# Bring one source's rollups up to date. Returns the number of hours rebuilt
+# (None for a full rebuild). The caller commits.
+def refresh_source(source, now, full=False):
+    watermark = db.session.get(RollupWatermark, source.name)
+    if full or watermark is None:
+        _rebuild_hours(source)
+        _rebuild_days(source)
+        hours = None
+    else:
+        since = watermark.processed_until - timedelta(seconds=current_app.config['ANALYTICS_ROLLUP_OVERLAP'])
+        dirty = _dirty_hours(source, since)
+        for start, end in _spans(dirty, PERIOD_HOUR):
+            _rebuild_hours(source, start, end)
+        days = sorted({floor(hour, PERIOD_DAY) for hour in dirty})
+        for start, end in _spans(days, PERIOD_DAY):
+            _rebuild_days(source, start, end)
+        hours = len(dirty)
+
+    if watermark is None:
+        watermark = RollupWatermark(source=source.name, processed_until=now)
+        db.session.add(watermark)
+    watermark.processed_until = now
+    return hours
+
+
+# Refresh every source, one transaction each. Returns {source: hours rebuilt}.
+def refresh_rollups(full=False, sources=None):
+    results = {}
+    for source in _sources():
+        if sources and source.name not in sources:
+            continue
+        # Rows changed while this runs are newer than the watermark and seen next time
+        now = datetime.utcnow()
+        results[source.name] = refresh_source(source, now, full=full)
+        db.session.commit()
+
+    from app.cache import cache
+    cache.invalidate('analytics')
+    return results
+
+
+# Run refresh_rollups every `interval` seconds (ANALYTICS_ROLLUP_INTERVAL by default)
+def run(interval=None, full=False, once=False, report=None):
+    interval = current_app.config['ANALYTICS_ROLLUP_INTERVAL'] if interval is None else interval
+    while True:
+        results = refresh_rollups(full=full)
+        if report:
+            report(results)
+        if once:
+            return results
+        full = False
+        db.session.remove()
+        time.sleep(interval)
+
+
+# Reading
+
+# [start, end) covering the last `buckets` periods up to and including the current one
+def _window(period, buckets, end=None):
+    end = floor(end or datetime.utcnow(), period) + PERIOD_STEPS[period]
+    return end - buckets * PERIOD_STEPS[period], end
+
+
+def _bucket_labels(period, start, end):
+    labels = []
+    bucket = start
+    while bucket < end:
+        labels.append(bucket)
+        bucket += PERIOD_STEPS[period]
+    return labels
+
+
+# Chart-ready series for the last `buckets` hours or days, optionally for one course:
+# {'labels': [...], 'revenue': {currency: [...]}, 'payments': {status: [...]},
+#  'activity': {metric: [...]}, 'totals': {...}}
+def dashboard_series(period=PERIOD_DAY, buckets=30, course_id=None, end=None):
+    start, end = _window(period, buckets, end)
+    labels = _bucket_labels(period, start, end)
+    index = {label: n for n, label in enumerate(labels)}
+
+    def in_window(rollup):
+        criteria = [rollup.period == period, rollup.bucket >= start, rollup.bucket < end]
+        if course_id is not None:
+            criteria.append(rollup.course_id == course_id)
+        return criteria
+
+    revenue, payments = {}, {}
+    rows = db.session.execute(
+        db.select(RevenueRollup.bucket, RevenueRollup.currency, RevenueRollup.status,
+                  db.func.sum(RevenueRollup.payments), db.func.sum(RevenueRollup.amount))
+        .where(*in_window(RevenueRollup))
+        .group_by(RevenueRollup.bucket, RevenueRollup.currency, RevenueRollup.status)
+    )
+    for bucket, currency, status, count, amount in rows:
+        n = index[bucket]
+        payments.setdefault(status or 'unknown', [0] * len(labels))[n] += count
+        if status == Payment.STATUS_COMPLETED:
+            revenue.setdefault(currency or 'USD', [0.0] * len(labels))[n] += amount
+    revenue = {currency: [round(amount, 2) for amount in values] for currency, values in revenue.items()}
+
+    activity = {metric: [0] * len(labels) for metric in ACTIVITY_METRICS}
+    rows = db.session.execute(
+        db.select(ActivityRollup.bucket, ActivityRollup.metric, db.func.sum(ActivityRollup.count))
+        .where(*in_window(ActivityRollup))
+        .group_by(ActivityRollup.bucket, ActivityRollup.metric)
+    )
+    for bucket, metric, count in rows:
+        activity[metric][index[bucket]] = count
+
+    return {
+        'period': period,
+        'labels': [label.isoformat() for label in labels],
+        'revenue': revenue,
+        'payments': payments,
+        'activity': activity,
+        'totals': {
+            'revenue': {currency: round(sum(values), 2) for currency, values in revenue.items()},
+            **{metric: sum(values) for metric, values in activity.items()},
+        },
+    }
+
+
+# Courses with the most completed-payment revenue over the last `days` days:
+# [(course_id, title, currency, payments, amount)]
+def top_courses(days=30, limit=10, end=None):
+    start, end = _window(PERIOD_DAY, days, end)
+    amount = db.func.sum(RevenueRollup.amount)
+    return db.session.execute(
+        db.select(RevenueRollup.course_id, Course.title, RevenueRollup.currency,
+                  db.func.sum(RevenueRollup.payments), amount)
+        .outerjoin(Course, Course.id == RevenueRollup.course_id)
+        .where(RevenueRollup.period == PERIOD_DAY, RevenueRollup.bucket >= start,
+               RevenueRollup.bucket < end, RevenueRollup.status == Payment.STATUS_COMPLETED)
+        .group_by(RevenueRollup.course_id, Course.title, RevenueRollup.currency)
+        .order_by(amount.desc())
+        .limit(limit)
+    ).all()
+
+
+# When each source was last rolled up: {source: datetime}
+def freshness():
+    return dict(db.session.execute(
+        db.select(RollupWatermark.source, RollupWatermark.processed_until)
+    ).all())
@@ -0,0 +1,143 @@
+"""Fingerprinted, precompressed static assets.
+
+``flask assets build`` copies every file under ``app/static`` to
+``app/static/dist`` with a content hash in its name
+(``css/main.css`` -> ``dist/css/main.1a2b3c4d5e6f.css``), writes ``.gz`` and
+(when the optional ``brotli`` package is installed) ``.br`` siblings for
+text assets, and records the mapping in ``dist/manifest.json``.
+
+When a manifest is present, ``url_for('static', filename=...)`` emits the
+hashed name, and the static view serves the smallest precompressed variant
+the client accepts with immutable, far-future cache headers. Without a
+manifest (e.g. in development) static files behave as before.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+from flask import current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.ico', '.map')
+CSS_URL = re.compile(r'url\((["\']?)(?!data:|https?:|//|/)([^"\')?#]+)([^"\')]*)\1\)')
+ONE_YEAR = 31536000
+
+
+def _manifest_path(app):
+    return os.path.join(app.static_folder, DIST_DIR, MANIFEST_NAME)
+
+
+def load_manifest(app):
+    try:
+        with open(_manifest_path(app)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def init_app(app):
+    manifest = load_manifest(app) if app.config.get('ASSETS_USE_MANIFEST', True) else {}
+    app.extensions['assets'] = manifest
+    if not manifest:
+        return
+
+    # url_for('static', filename='css/main.css') -> /static/dist/css/main.<hash>.css
+    @app.url_defaults
+    def _hashed_static_url(endpoint, values):
+        if endpoint == 'static':
+            hashed = manifest.get(values.get('filename'))
+            if hashed:
+                values['filename'] = hashed
+
+    app.view_functions['static'] = serve_static
+
+
+# Static view: hashed files get their precompressed variant and immutable caching
+def serve_static(filename):
+    if not filename.startswith(DIST_DIR + '/'):
+        return current_app.send_static_file(filename)
+
+    folder = current_app.static_folder
+    mimetype = mimetypes.guess_type(filename)[0]
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[encoding] and os.path.isfile(os.path.join(folder, filename + suffix)):
+            response = send_from_directory(folder, filename + suffix, mimetype=mimetype, max_age=ONE_YEAR)
+            response.content_encoding = encoding
+            break
+    else:
+        response = send_from_directory(folder, filename, mimetype=mimetype, max_age=ONE_YEAR)
+    response.cache_control.immutable = True
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _hashed_name(path, content):
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    stem, ext = os.path.splitext(path)
+    return f'{stem}.{digest}{ext}'
+
+
+# Point relative url(...) references in a stylesheet at the hashed files
+def _rewrite_css(source_path, content, manifest):
+    base = os.path.dirname(source_path)
+
+    def replace(match):
+        quote, target, rest = match.groups()
+        resolved = os.path.normpath(os.path.join(base, target)).replace(os.sep, '/')
+        hashed = manifest.get(resolved)
+        if hashed is None:
+            return match.group(0)
+        relative = os.path.relpath(hashed, os.path.join(DIST_DIR, base)).replace(os.sep, '/')
+        return f'url({quote}{relative}{rest}{quote})'
+
+    return CSS_URL.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    if path.endswith(COMPRESSIBLE):
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(content, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(content, quality=11))
+
+
+# Write hashed copies of the static files and a new manifest. Files from
+# earlier builds are kept, so pages cached or rendered by not yet restarted
+# workers can still load the assets they reference. Returns the manifest.
+def build(app):
+    static = app.static_folder
+    dist = os.path.join(static, DIST_DIR)
+
+    sources = []
+    for root, dirs, files in os.walk(static):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != dist]
+        for name in files:
+            full = os.path.join(root, name)
+            sources.append(os.path.relpath(full, static).replace(os.sep, '/'))
+
+    # Stylesheets last, so the files they reference are already hashed
+    manifest = {}
+    for path in sorted(sources, key=lambda p: (p.endswith('.css'), p)):
+        with open(os.path.join(static, path), 'rb') as f:
+            content = f.read()
+        if path.endswith('.css'):
+            content = _rewrite_css(path, content, manifest)
+        hashed = f'{DIST_DIR}/{_hashed_name(path, content)}'
+        _write(os.path.join(static, hashed), content)
+        manifest[path] = hashed
+
+    with open(_manifest_path(app), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
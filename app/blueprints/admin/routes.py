@@ -1,6 +1,9 @@
-from flask import Blueprint, render_template
+from datetime import datetime
+from flask import Blueprint, Response, abort, current_app, jsonify, render_template, request, stream_with_context
 from flask_login import login_required, current_user
 from flask_migrate import current
+from app.cache import cache
+from app.routing import read_only
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -9,5 +12,84 @@ admin_bp = Blueprint('admin', __name__)
 @login_required
 def dashboard():
     if current_user.is_admin():
-        return render_template('admin/dashboard.html')
+        from app.analytics import freshness, top_courses
+        from app.exports import EXPORTS
+        return render_template('admin/dashboard.html', top_courses=top_courses(days=30),
+                               freshness=freshness(), exports=EXPORTS)
     return "Unauthorized", 403
+
+
+# Chart data from the analytics rollups: ?period=hour|day&buckets=N&course_id=N
+@admin_bp.route('/admin/analytics.json')
+@login_required
+@cache.cached(tags=('analytics',))
+def analytics_data():
+    if not current_user.is_admin():
+        return "Unauthorized", 403
+    from app.analytics import PERIOD_DAY, PERIOD_STEPS, dashboard_series
+    period = request.args.get('period', PERIOD_DAY)
+    if period not in PERIOD_STEPS:
+        return jsonify(error='period must be hour or day'), 400
+    buckets = min(max(request.args.get('buckets', 30, type=int), 1), 366)
+    return jsonify(dashboard_series(period, buckets, course_id=request.args.get('course_id', type=int)))
+
+
+def _date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        abort(400)
+
+
+# Streamed report download: ?format=csv|jsonl&gzip=1&since=YYYY-MM-DD&until=YYYY-MM-DD
+@admin_bp.route('/admin/exports/<name>')
+@login_required
+@read_only
+def export(name):
+    if not current_user.is_admin():
+        return "Unauthorized", 403
+    from app.exports import EXPORTS, FORMATS, filename, stream_export
+    report = EXPORTS.get(name)
+    fmt = request.args.get('format', 'csv')
+    if report is None or fmt not in FORMATS:
+        abort(404)
+    compress = request.args.get('gzip', '').lower() in ['true', 'on', '1']
+    chunks = stream_export(report, fmt, since=_date_arg('since'), until=_date_arg('until'),
+                           compress=compress, chunk_size=current_app.config['EXPORT_CHUNK_SIZE'])
+    return Response(stream_with_context(chunks),
+                    mimetype='application/gzip' if compress else FORMATS[fmt][0],
+                    headers={
+                        'Content-Disposition': f'attachment; filename="{filename(report, fmt, compress)}"',
+                        'Cache-Control': 'no-store',
+                        # Let nginx pass chunks through instead of buffering the whole file
+                        'X-Accel-Buffering': 'no',
+                    })
+
+
+# Connection pool occupancy and counters for the worker serving the request
+@admin_bp.route('/admin/db-pool')
+@login_required
+def db_pool():
+    if not current_user.is_admin():
+        return "Unauthorized", 403
+    from app.database import pool_stats
+    return jsonify(pool_stats(current_app))
+
+
+# Mail queue and send counters of the worker serving the request, and the
+# outbox backlog by status
+@admin_bp.route('/admin/mail')
+@login_required
+def mail_stats():
+    if not current_user.is_admin():
+        return "Unauthorized", 403
+    from app import db
+    from app.mailer import mail_dispatcher
+    from app.models import OutboundEmail
+    outbox = dict(db.session.execute(
+        db.select(OutboundEmail.status, db.func.count(OutboundEmail.id)).group_by(OutboundEmail.status)
+    ).all())
+    return jsonify(dispatcher=mail_dispatcher.stats_snapshot(), outbox=outbox)
@@ -1,26 +1,45 @@
-from flask import Blueprint, render_template, request
+from flask import Blueprint, render_template, request, current_app
+from sqlalchemy.orm import joinedload
+from app import db
+from app.cache import cache
 from app.models import Article
+from app.pagination import paginate_keyset
+from app.search import search as search_index
 
 articles_bp = Blueprint('articles', __name__)
 
 
 # Existing route for listing articles
 @articles_bp.route('/articles')
+@cache.cached(tags=('articles',))
 def list_articles():
-    articles = Article.query.all()  # Fetch all articles by default
+    page = paginate_keyset(Article.query.options(joinedload(Article.author)),
+                           (Article.created_at, Article.id),
+                           cursor=request.args.get('cursor'),
+                           per_page=current_app.config['ARTICLES_PER_PAGE'],
+                           descending=True)
     categories = []  # Fetch categories for filtering
-    return render_template('articles/article_list.html', articles=articles, categories=categories)
+    return render_template('articles/article_list.html', articles=page.items, page=page, categories=categories)
+
+
+@articles_bp.route('/articles/<int:id>')
+def article_detail(id):
+    article = db.get_or_404(Article, id)
+    return render_template('articles/article_detail.html', article=article)
 
 
 # Route for search functionality
 @articles_bp.route('/articles/search')
 def search():
     query = request.args.get('q', '').strip()  # Get the search query from the URL parameters
+    results = None
+    articles = []  # Return no articles if no search query is provided
     if query:
-        articles = Article.query.filter(Article.title.ilike(f'%{query}%') |
-                                        Article.summary.ilike(f'%{query}%')).all()
-    else:
-        articles = []  # Return no articles if no search query is provided
+        results = search_index(query, doc_types=('article',),
+                               page=request.args.get('page', 1, type=int),
+                               per_page=current_app.config['ARTICLES_PER_PAGE'])
+        articles = results.objects
 
     categories = []  # Fetch categories for filtering
-    return render_template('articles/article_list.html', articles=articles, categories=categories, query=query)
+    return render_template('articles/article_list.html', articles=articles, categories=categories,
+                           query=query, results=results)
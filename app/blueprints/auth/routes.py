@@ -1,10 +1,10 @@
-import os
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, current_user, login_required
-from werkzeug.utils import secure_filename
-from datetime import datetime
 from app import db
 from app.models import User
+from app.user_cache import invalidate_user
+from app.images import InvalidImageError, save_avatar
+from app.passwords import HasherBusyError
 from app.email import send_password_reset_email, send_confirmation_email
 from app.blueprints.auth.forms import (
     LoginForm, RegistrationForm, ResetPasswordRequestForm,
@@ -22,10 +22,20 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
-        if user is None or not user.check_password(form.password.data):
+        try:
+            valid = user is not None and user.check_password(form.password.data)
+        except HasherBusyError:
+            flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'warning')
+            return render_template('auth/login.html', title='Sign In', form=form), 503
+        if not valid:
             flash('Invalid email or password', 'danger')
             return redirect(url_for('auth.login'))
         
+        # check_password upgraded a hash made with outdated parameters
+        if db.session.is_modified(user):
+            db.session.commit()
+            invalidate_user(user.id)
+        
         login_user(user, remember=form.remember_me.data)
         next_page = request.args.get('next')
         if not next_page or not next_page.startswith('/'):
@@ -59,10 +69,10 @@ def register():
         )
         user.set_password(form.password.data)
         db.session.add(user)
-        db.session.commit()
         
-        # Send confirmation email
+        # Queue the confirmation email in the same transaction as the user
         send_confirmation_email(user)
+        db.session.commit()
         
         flash('Registration successful! Please check your email to confirm your account.', 'success')
         return redirect(url_for('auth.login'))
@@ -82,6 +92,7 @@ def confirm_email(token):
     
     user.confirm_email()
     db.session.commit()
+    invalidate_user(user.id)
     flash('Your email has been confirmed. You can now log in.', 'success')
     return redirect(url_for('auth.login'))
 
@@ -96,6 +107,7 @@ def reset_password_request():
         user = User.query.filter_by(email=form.email.data).first()
         if user:
             send_password_reset_email(user)
+            db.session.commit()
         flash('Check your email for instructions to reset your password.', 'info')
         return redirect(url_for('auth.login'))
     
@@ -116,6 +128,7 @@ def reset_password(token):
     if form.validate_on_submit():
         user.set_password(form.password.data)
         db.session.commit()
+        invalidate_user(user.id)
         flash('Your password has been reset.', 'success')
         return redirect(url_for('auth.login'))
     
@@ -127,12 +140,18 @@ def reset_password(token):
 def change_password():
     form = ChangePasswordForm()
     if form.validate_on_submit():
-        if not current_user.check_password(form.current_password.data):
+        try:
+            valid = current_user.check_password(form.current_password.data)
+        except HasherBusyError:
+            flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'warning')
+            return render_template('auth/change_password.html', title='Change Password', form=form), 503
+        if not valid:
             flash('Current password is incorrect.', 'danger')
             return redirect(url_for('auth.change_password'))
         
         current_user.set_password(form.new_password.data)
         db.session.commit()
+        invalidate_user(current_user.id)
         flash('Your password has been updated.', 'success')
         return redirect(url_for('main.index'))
     
@@ -144,6 +163,15 @@ def change_password():
 def profile():
     form = EditProfileForm(current_user.username, current_user.email)
     if form.validate_on_submit():
+        # Store the avatar under its content hash; resized variants are rendered in the background
+        if form.avatar.data:
+            try:
+                avatar = save_avatar(form.avatar.data)
+            except InvalidImageError as e:
+                form.avatar.errors.append(str(e))
+                return render_template('auth/profile.html', title='Profile', form=form)
+            current_user.avatar = avatar
+        
         current_user.username = form.username.data
         current_user.email = form.email.data
         current_user.first_name = form.first_name.data
@@ -155,25 +183,8 @@ def profile():
         current_user.linkedin = form.linkedin.data
         current_user.github = form.github.data
         
-        # Handle avatar upload
-        if form.avatar.data:
-            filename = secure_filename(form.avatar.data.filename)
-            # Create a unique filename to avoid collisions
-            unique_filename = f"{current_user.id}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{filename}"
-            avatar_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'avatars')
-            
-            # Create avatars directory if it doesn't exist
-            if not os.path.exists(avatar_path):
-                os.makedirs(avatar_path)
-            
-            # Save the file
-            file_path = os.path.join(avatar_path, unique_filename)
-            form.avatar.data.save(file_path)
-            
-            # Update user's avatar field with the relative path
-            current_user.avatar = os.path.join('avatars', unique_filename)
-        
         db.session.commit()
+        invalidate_user(current_user.id)
         flash('Your profile has been updated.', 'success')
         return redirect(url_for('auth.profile'))
     elif request.method == 'GET':
@@ -199,5 +210,6 @@ def resend_confirmation():
         return redirect(url_for('main.index'))
     
     send_confirmation_email(current_user)
+    db.session.commit()
     flash('A new confirmation email has been sent.', 'info')
     return redirect(url_for('main.index'))
@@ -0,0 +1,16 @@
+from flask_wtf import FlaskForm
+from wtforms import SelectField, SubmitField, TextAreaField
+from wtforms.validators import DataRequired, Length
+
+
+# CSRF token only: the lesson comes from the URL
+class LessonProgressForm(FlaskForm):
+    submit = SubmitField('Mark complete')
+
+
+class ReviewForm(FlaskForm):
+    rating = SelectField('Rating', coerce=int, validators=[DataRequired()],
+                         choices=[(5, '5 - Excellent'), (4, '4 - Very Good'), (3, '3 - Good'),
+                                  (2, '2 - Fair'), (1, '1 - Poor')])
+    text = TextAreaField('Review', validators=[DataRequired(), Length(max=2000)])
+    submit = SubmitField('Submit Review')
@@ -1,14 +1,126 @@
-from flask import Blueprint, render_template
-from app.models import Course
+from flask import Blueprint, render_template, request, current_app, redirect, url_for, flash, abort
+from flask_login import current_user, login_required
+from app import db
+from app.blueprints.courses.forms import LessonProgressForm, ReviewForm
+from app.cache import cache, user_tags
+from app.catalog import build_course_cards, course_card_query, filter_by_syllabus, load_course_detail, load_course_reviews
+from app.models import Course, CourseLesson, CourseModule, Review
+from app.pagination import paginate_keyset
+from app.progress import completed_lesson_ids, complete_lesson, course_progress, heartbeats
+from app.search import search as search_index
 
 courses_bp = Blueprint('courses', __name__)
 
+
+# Course ids the current user is enrolled in, for "Enrolled" badges (one query)
+def _enrolled_ids():
+    if current_user.is_authenticated:
+        return current_user.enrolled_course_ids()
+    return set()
+
+
 @courses_bp.route('/courses')
+@cache.cached(tags=lambda: ('courses', *user_tags()))
 def list_courses():
-    courses = Course.query.all()
-    return render_template('courses/course_list.html', courses=courses)
+    filters = {
+        'max_hours': request.args.get('max_hours', type=float),
+        'min_lessons': request.args.get('min_lessons', type=int),
+    }
+    page = paginate_keyset(filter_by_syllabus(course_card_query(), **filters),
+                           (Course.created_at, Course.id),
+                           cursor=request.args.get('cursor'),
+                           per_page=current_app.config['COURSES_PER_PAGE'],
+                           descending=True)
+    page.items = build_course_cards(page.items)
+    return render_template('courses/course_list.html', courses=page.items, page=page,
+                           filters={name: value for name, value in filters.items() if value is not None},
+                           enrolled_ids=_enrolled_ids())
+
+@courses_bp.route('/courses/search')
+def search():
+    query = request.args.get('q', '').strip()
+    results = None
+    courses = []
+    if query:
+        results = search_index(query, doc_types=('course',),
+                               page=request.args.get('page', 1, type=int),
+                               per_page=current_app.config['COURSES_PER_PAGE'])
+        courses = build_course_cards(results.objects)
+    return render_template('courses/course_list.html', courses=courses, query=query, results=results,
+                           enrolled_ids=_enrolled_ids())
 
 @courses_bp.route('/courses/<int:id>')
 def course_detail(id):
-    course = Course.query.get_or_404(id)
-    return render_template('courses/course_detail.html', course=course)
\ No newline at end of file
+    course = load_course_detail(id)
+    reviews = load_course_reviews(course.id, cursor=request.args.get('reviews'),
+                                  per_page=current_app.config['REVIEWS_PER_PAGE'])
+    enrolled = course.id in _enrolled_ids()
+    progress, completed_ids = None, set()
+    if enrolled:
+        progress = course_progress(current_user.id, [course.id]).get(course.id)
+        completed_ids = completed_lesson_ids(current_user.id, course.id)
+    return render_template('courses/course_detail.html', course=course, reviews=reviews,
+                           enrolled=enrolled, progress=progress, completed_ids=completed_ids,
+                           progress_form=LessonProgressForm(), review_form=ReviewForm())
+
+
+# Enrolled users review a course once; submitting again replaces their review
+@courses_bp.route('/courses/<int:id>/reviews', methods=['POST'])
+@login_required
+def add_review(id):
+    course = db.get_or_404(Course, id)
+    if course.id not in current_user.enrolled_course_ids():
+        abort(403)
+    form = ReviewForm()
+    if not form.validate_on_submit():
+        flash('Please choose a rating and write your review.', 'danger')
+        return redirect(url_for('courses.course_detail', id=course.id, _anchor='reviews'))
+    review = Review.query.filter_by(user_id=current_user.id, course_id=course.id).first()
+    if review is None:
+        review = Review(user_id=current_user.id, course_id=course.id)
+        db.session.add(review)
+    review.rating = float(form.rating.data)
+    review.text = form.text.data
+    db.session.commit()
+    flash('Thank you for your review!', 'success')
+    return redirect(url_for('courses.course_detail', id=course.id, _anchor='reviews'))
+
+
+# Course of a lesson the current user is enrolled in (404/403 otherwise)
+def _enrolled_lesson_course(lesson_id):
+    course_id = db.session.scalar(
+        db.select(CourseModule.course_id)
+        .join(CourseLesson, CourseLesson.module_id == CourseModule.id)
+        .where(CourseLesson.id == lesson_id)
+    )
+    if course_id is None:
+        abort(404)
+    if course_id not in current_user.enrolled_course_ids():
+        abort(403)
+    return course_id
+
+
+# Sent periodically while a lesson is open; buffered, not written per request
+@courses_bp.route('/lessons/<int:lesson_id>/heartbeat', methods=['POST'])
+@login_required
+def lesson_heartbeat(lesson_id):
+    if not LessonProgressForm().validate_on_submit():
+        abort(400)
+    _enrolled_lesson_course(lesson_id)
+    heartbeats.record(current_user.id, lesson_id)
+    return '', 204
+
+
+@courses_bp.route('/lessons/<int:lesson_id>/complete', methods=['POST'])
+@login_required
+def complete(lesson_id):
+    if not LessonProgressForm().validate_on_submit():
+        abort(400)
+    course_id = _enrolled_lesson_course(lesson_id)
+    progress = complete_lesson(current_user.id, lesson_id)
+    db.session.commit()
+    if progress.is_complete:
+        flash('Congratulations, you have completed this course!', 'success')
+    else:
+        flash(f'Lesson completed. You are {progress.percent}% through the course.', 'success')
+    return redirect(url_for('courses.course_detail', id=course_id))
@@ -1,12 +1,17 @@
-from flask import Blueprint, render_template, redirect, url_for
+from flask import Blueprint, render_template, redirect, url_for, request, current_app
+from app.cache import cache
 from app.models import Event
+from app.pagination import paginate_keyset
 
 events_bp = Blueprint('events', __name__)
 
 @events_bp.route('/events')
+@cache.cached(tags=('events',))
 def list_events():
-    events = Event.query.all()
-    return render_template('events/event_list.html', events=events)
+    page = paginate_keyset(Event.query, (Event.start_date, Event.id),
+                           cursor=request.args.get('cursor'),
+                           per_page=current_app.config['EVENTS_PER_PAGE'])
+    return render_template('events/event_list.html', events=page.items, page=page)
 
 
 @events_bp.route('/events/<int:id>')
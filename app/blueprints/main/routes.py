@@ -1,15 +1,26 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, current_app, render_template, send_from_directory
 from datetime import datetime
+from app.cache import cache, user_tags
+from app.storage import resolve_upload
 from app.models import Announcement, Course, Article, Event
 
 main_bp = Blueprint('main', __name__)
 
 @main_bp.route('/')
+@cache.cached(tags=lambda: ('home', *user_tags()))
 def index():
-    announcements = Announcement.query.order_by(Announcement.created_at.desc()).limit(3).all()
-    featured_courses = Course.query.order_by(Course.created_at.desc()).limit(3).all()
-    latest_articles = Article.query.filter_by(published=True).order_by(Article.created_at.desc()).limit(3).all()
-    upcoming_events = Event.query.filter(Event.start_date >= datetime.utcnow()).order_by(Event.start_date).limit(3).all()
+    # Loaded lazily by the template, so cached fragments skip the queries entirely
+    def announcements():
+        return Announcement.query.order_by(Announcement.created_at.desc()).limit(3).all()
+
+    def featured_courses():
+        return Course.query.order_by(Course.created_at.desc()).limit(3).all()
+
+    def latest_articles():
+        return Article.query.filter_by(published=True).order_by(Article.created_at.desc()).limit(3).all()
+
+    def upcoming_events():
+        return Event.query.filter(Event.start_date >= datetime.utcnow()).order_by(Event.start_date).limit(3).all()
     
     return render_template('index.html', 
                           title='ScrumJET',
@@ -19,13 +30,33 @@ def index():
                           upcoming_events=upcoming_events)
 
 @main_bp.route('/about')
+@cache.cached(timeout=3600)
 def about():
     return render_template('about.html', title='About')
 
 @main_bp.route('/contact')
+@cache.cached(timeout=3600)
 def contact():
     return render_template('contact.html', title='Contact')
 
 @main_bp.route('/faq')
+@cache.cached(timeout=3600, tags=('faq',))
 def faq():
     return render_template('faq.html', title='FAQ')
+
+
+# User uploads. Content-addressed blobs never change, so browsers may cache
+# them indefinitely. The stand-in original served while a variant is still
+# being rendered must not be cached at all.
+@main_bp.route('/uploads/<path:filename>')
+def uploaded_file(filename):
+    path, mimetype, immutable = resolve_upload(filename)
+    if immutable:
+        max_age = 31536000
+    else:
+        max_age = 3600 if path == filename else 0
+    response = send_from_directory(current_app.config['UPLOAD_FOLDER'], path,
+                                   mimetype=mimetype, max_age=max_age)
+    if immutable:
+        response.cache_control.immutable = True
+    return response
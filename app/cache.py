@@ -0,0 +1,316 @@
+"""Response and template fragment caching for public pages.
+
+Backends are selected with ``CACHE_TYPE``:
+
+* ``lru`` - in-process LRU with per-entry TTL (one copy per worker)
+* ``filesystem`` - pickled entries under ``CACHE_DIR``, shared by every
+  gunicorn worker on the host. The directory is created with mode 0700, and
+  one owned by another user or open to other users is refused.
+* ``null`` - caching disabled
+
+Entries can carry tags. Invalidating a tag bumps a version number stored in
+the backend and mixed into the keys of everything cached under that tag, so
+stale entries simply stop being reachable and age out. Committed writes to
+the models in ``MODEL_TAGS`` invalidate their tags automatically.
+"""
+import hashlib
+import os
+import pickle
+import stat
+import tempfile
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from flask import current_app, has_app_context, make_response, request, session
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy import event
+from app import db
+from app.models import (
+    Announcement, Article, ArticleCategory, Category, Course, CourseLesson,
+    CourseModule, Event, FAQ, Review, User,
+)
+
+
+# Tags of pages personalised for the current user (e.g. enrollment badges)
+def user_tags():
+    if current_user.is_authenticated:
+        return (f'user:{current_user.get_id()}',)
+    return ()
+
+
+# Tags invalidated when rows of these models are committed. A callable
+# receives the changed instance and returns its tags.
+MODEL_TAGS = {
+    Announcement: ('home',),
+    Article: ('articles', 'home'),
+    ArticleCategory: ('articles',),
+    Category: ('courses',),
+    Course: ('courses', 'home'),
+    CourseModule: ('courses',),
+    CourseLesson: ('courses',),
+    Event: ('events', 'home'),
+    FAQ: ('faq',),
+    Review: ('courses',),
+    User: lambda user: (f'user:{user.id}',),
+}
+
+
+class NullCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache:
+    def __init__(self, threshold=500, default_timeout=300):
+        self.threshold = threshold
+        self.default_timeout = default_timeout
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at and expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    # A timeout of 0 keeps the entry until it is evicted
+    def set(self, key, value, timeout=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        expires_at = time.time() + timeout if timeout else 0
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.threshold:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileSystemCache:
+    def __init__(self, directory, threshold=5000, default_timeout=300):
+        self.directory = directory
+        self.threshold = threshold
+        self.default_timeout = default_timeout
+        # Entries are unpickled, so only this user may be able to write them.
+        # The directory is listed once every `_prune_interval` writes, not on each.
+        self._prune_interval = max(1, threshold // 20)
+        self._writes = 0
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._check_directory()
+
+    # Refuse a directory someone else could have planted or can write into
+    def _check_directory(self):
+        info = os.lstat(self.directory)
+        if not stat.S_ISDIR(info.st_mode):
+            raise RuntimeError(f'Cache directory {self.directory} is not a directory')
+        if info.st_uid != os.getuid():
+            raise RuntimeError(f'Cache directory {self.directory} is owned by another user')
+        if info.st_mode & 0o077:
+            raise RuntimeError(f'Cache directory {self.directory} is accessible to other users '
+                               f'(mode {stat.S_IMODE(info.st_mode):o}); it must be 0700')
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires_at, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires_at and expires_at < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    # Written to a temporary file and renamed so readers never see partial entries
+    def set(self, key, value, timeout=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        expires_at = time.time() + timeout if timeout else 0
+        self._writes += 1
+        if self._writes % self._prune_interval == 0:
+            self._prune()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((expires_at, value), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    # Drop the oldest entries once the directory grows past the threshold
+    def _prune(self):
+        try:
+            entries = os.listdir(self.directory)
+        except OSError:
+            return
+        if len(entries) < self.threshold:
+            return
+        paths = [os.path.join(self.directory, name) for name in entries]
+        paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+        for path in paths[:len(paths) - self.threshold // 2]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class Cache:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        cache_type = app.config.get('CACHE_TYPE', 'lru')
+        timeout = app.config.get('CACHE_DEFAULT_TIMEOUT', 300)
+        if cache_type == 'filesystem':
+            backend = FileSystemCache(app.config['CACHE_DIR'],
+                                      threshold=app.config.get('CACHE_THRESHOLD', 5000),
+                                      default_timeout=timeout)
+        elif cache_type == 'lru':
+            backend = LRUCache(threshold=app.config.get('CACHE_THRESHOLD', 500),
+                               default_timeout=timeout)
+        elif cache_type == 'null':
+            backend = NullCache()
+        else:
+            raise ValueError(f'Unknown CACHE_TYPE {cache_type!r}')
+        app.extensions['cache'] = backend
+        app.jinja_env.globals['cache_fragment'] = self.fragment
+
+    @property
+    def backend(self):
+        return current_app.extensions['cache']
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.backend.set(key, value, timeout)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def _tag_version(self, tag):
+        version = self.backend.get(f'tag:{tag}')
+        if version is None:
+            version = self._new_version()
+            self.backend.set(f'tag:{tag}', version, 0)
+        return version
+
+    @staticmethod
+    def _new_version():
+        return f'{time.time_ns():x}'
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            self.backend.set(f'tag:{tag}', self._new_version(), 0)
+
+    # Cache key scoped by the current versions of its tags and, optionally, the user
+    def make_key(self, name, tags=(), vary_on_user=True):
+        parts = [name]
+        parts.extend(f'{tag}={self._tag_version(tag)}' for tag in sorted(tags))
+        if vary_on_user:
+            parts.append(f'user={current_user.get_id()}' if current_user.is_authenticated else 'anon')
+        return '|'.join(parts)
+
+    # View decorator caching GET responses, keyed by path, query string and login state.
+    # `tags` may be a callable evaluated per request.
+    def cached(self, timeout=None, tags=(), vary_on_user=True):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                # Pending flash messages must be rendered, so skip the cache entirely
+                if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                    return view(*args, **kwargs)
+
+                key = self.make_key(f'view:{request.full_path}',
+                                    tags() if callable(tags) else tags, vary_on_user)
+                entry = self.get(key)
+                if entry is not None:
+                    body, status, headers = entry
+                    response = make_response(body, status, headers)
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    headers = [(name, value) for name, value in response.headers
+                               if name.lower() != 'set-cookie']
+                    self.set(key, (response.get_data(), response.status_code, headers), timeout)
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+    # Template helper: {% call cache_fragment('home:announcements', tags=['home']) %}...{% endcall %}
+    def fragment(self, name, timeout=None, tags=(), vary_on_user=False, caller=None):
+        key = self.make_key(f'fragment:{name}', tags, vary_on_user)
+        html = self.get(key)
+        if html is None:
+            html = str(caller())
+            self.set(key, html, timeout)
+        return Markup(html)
+
+
+cache = Cache()
+
+
+# Collect tags touched by a flush; they are invalidated once the commit succeeds
+@event.listens_for(db.session, 'after_flush')
+def _collect_cache_tags(session, flush_context):
+    tags = session.info.setdefault('cache_tags', set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        obj_tags = MODEL_TAGS.get(type(obj), ())
+        tags.update(obj_tags(obj) if callable(obj_tags) else obj_tags)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_cache_tags(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags and has_app_context() and 'cache' in current_app.extensions:
+        cache.invalidate(*tags)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_cache_tags(session):
+    session.info.pop('cache_tags', None)
@@ -0,0 +1,140 @@
+"""Batch loading of course catalog pages into plain view objects.
+
+Every loader runs a fixed number of queries regardless of how many courses,
+modules, lessons or reviews are involved, and hands templates simple objects
+so rendering can never fall back to a lazy relationship query.
+"""
+from collections import defaultdict
+from flask import abort
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import Course, CourseModule, CourseLesson, Review
+from app.pagination import paginate_keyset
+
+
+# Summary of a course as shown on catalog cards
+class CourseCard:
+    def __init__(self, course, module_count=0):
+        self.id = course.id
+        self.title = course.title
+        self.summary = course.summary
+        self.image = course.image
+        self.price = course.price or 0
+        self.duration = course.duration
+        self.level = course.level
+        self.category_name = course.category.name if course.category else None
+        self.created_at = course.created_at
+        self.module_count = module_count
+        self.lesson_count = course.total_lessons
+        self.lesson_hours = course.lesson_hours
+        self.rating_count = course.rating_count or 0
+        self.average_rating = course.average_rating
+        self.rating_histogram = course.rating_histogram
+
+    def __repr__(self):
+        return f'<CourseCard {self.id}>'
+
+
+# Full course page: card fields plus description, instructor and syllabus
+class CourseDetail(CourseCard):
+    def __init__(self, course, modules):
+        super().__init__(course, module_count=len(modules))
+        self.description = course.description
+        self.instructor_name = course.creator.full_name if course.creator else None
+        self.last_updated = course.updated_at or course.created_at
+        self.modules = modules
+
+
+class ModuleView:
+    def __init__(self, module, lessons):
+        self.id = module.id
+        self.title = module.title
+        self.description = module.description
+        self.order = module.order
+        self.lessons = lessons
+
+
+class LessonView:
+    def __init__(self, lesson):
+        self.id = lesson.id
+        self.title = lesson.title
+        self.order = lesson.order
+        self.duration = lesson.duration
+
+
+class ReviewView:
+    def __init__(self, review):
+        self.id = review.id
+        self.rating = review.rating or 0
+        self.text = review.text
+        self.created_at = review.created_at
+        self.author_name = review.user.full_name if review.user else 'Anonymous'
+
+
+# Module counts for many courses in a single grouped query (lesson totals are stored on the course)
+def _module_counts(course_ids):
+    if not course_ids:
+        return {}
+    rows = db.session.execute(
+        db.select(CourseModule.course_id, db.func.count(CourseModule.id))
+        .where(CourseModule.course_id.in_(course_ids))
+        .group_by(CourseModule.course_id)
+    )
+    return dict(rows.all())
+
+
+# Build catalog cards for already loaded courses (1 extra query for the counts)
+def build_course_cards(courses):
+    counts = _module_counts([course.id for course in courses])
+    return [CourseCard(course, counts.get(course.id, 0)) for course in courses]
+
+
+# Narrow a course query by the stored syllabus totals, e.g. max_hours=5 or min_lessons=20
+def filter_by_syllabus(query, max_hours=None, min_lessons=None):
+    if max_hours is not None:
+        query = query.filter(Course.lesson_hours <= max_hours)
+    if min_lessons is not None:
+        query = query.filter(Course.total_lessons >= min_lessons)
+    return query
+
+
+# Query for catalog courses with everything a card needs eagerly loaded
+def course_card_query():
+    return Course.query.options(joinedload(Course.category))
+
+
+# Build the course page view with its ordered syllabus (3 queries in total)
+def load_course_detail(course_id):
+    course = db.session.execute(
+        db.select(Course)
+        .options(joinedload(Course.category), joinedload(Course.creator))
+        .where(Course.id == course_id)
+    ).scalar_one_or_none()
+    if course is None:
+        abort(404)
+
+    modules = db.session.execute(
+        db.select(CourseModule)
+        .where(CourseModule.course_id == course.id)
+        .order_by(CourseModule.order, CourseModule.id)
+    ).scalars().all()
+
+    lessons = defaultdict(list)
+    if modules:
+        rows = db.session.execute(
+            db.select(CourseLesson)
+            .where(CourseLesson.module_id.in_([module.id for module in modules]))
+            .order_by(CourseLesson.module_id, CourseLesson.order, CourseLesson.id)
+        ).scalars()
+        for lesson in rows:
+            lessons[lesson.module_id].append(LessonView(lesson))
+
+    return CourseDetail(course, [ModuleView(module, lessons[module.id]) for module in modules])
+
+
+# Load one keyset page of a course's reviews with their authors in one query
+def load_course_reviews(course_id, cursor=None, per_page=10):
+    query = Review.query.options(joinedload(Review.user)).filter(Review.course_id == course_id)
+    page = paginate_keyset(query, (Review.created_at, Review.id), cursor=cursor,
+                           per_page=per_page, descending=True)
+    return page.map(ReviewView)
@@ -0,0 +1,259 @@
+"""Bulk certificate issuance.
+
+``issue_certificates`` certifies everyone enrolled in a course (by default
+only those who completed it) who has no certificate for it yet, in four steps:
+
+1. Numbers (``SJ-2026-000123``) are allocated as one block from the
+   per-year ``CertificateCounter`` row, in a short transaction of their own.
+   Concurrent runs get disjoint blocks. A run that fails later leaves a gap
+   in the sequence but never a duplicate.
+2. Verification codes are random (60 bits, Crockford base32). Codes already
+   in use are found with one query per chunk and drawn again.
+3. Documents are rendered in a process pool (``CERTIFICATE_WORKERS``). Each
+   worker decodes the background once (``CERTIFICATE_TEMPLATE``, or a drawn
+   border) and keeps it for every later certificate it renders. It writes the
+   PDF into upload storage under its content hash, with a half-size PNG
+   preview next to it (``<key>-preview.png``).
+4. Blob rows and certificates are written in one transaction, so a run
+   either records every certificate or none. If it fails at this point,
+   the files it already rendered remain in storage, unreferenced.
+"""
+import hashlib
+import io
+import os
+import secrets
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from flask import current_app
+from PIL import Image, ImageDraw, ImageFont
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Certificate, CertificateCounter, StoredBlob, User, enrollments
+from app.storage import storage
+
+PAGE_SIZE = (1754, 1240)  # A4 landscape at 150 dpi
+PREVIEW_SUFFIX = 'preview.png'
+CODE_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'  # Crockford base32: no I, L, O or U
+CODE_LENGTH = 12
+LOOKUP_CHUNK = 500
+
+INK = (33, 37, 41)
+MUTED = (108, 117, 125)
+ACCENT = (13, 110, 253)
+
+_executor = None
+_executor_pid = None
+
+# Per worker process: decoded backgrounds and loaded fonts
+_backgrounds = {}
+_fonts = {}
+
+
+# One pool per process, created on first use (after gunicorn has forked)
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ProcessPoolExecutor(max_workers=current_app.config['CERTIFICATE_WORKERS'])
+        _executor_pid = os.getpid()
+    return _executor
+
+
+# Reserve `count` consecutive serials for `year`; returns their certificate numbers
+def allocate_numbers(count, year, prefix='SJ'):
+    table = CertificateCounter.__table__
+    bump = (
+        table.update()
+        .where(table.c.year == year)
+        .values(last_serial=table.c.last_serial + count)
+        .returning(table.c.last_serial)
+    )
+    last = db.session.execute(bump).scalar()
+    if last is None:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(year=year, last_serial=count))
+            last = count
+        except IntegrityError:
+            # Another run started the year meanwhile
+            last = db.session.execute(bump).scalar_one()
+    return [f'{prefix}-{year}-{serial:06d}' for serial in range(last - count + 1, last + 1)]
+
+
+def _random_code():
+    code = ''.join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+    return '-'.join(code[i:i + 4] for i in range(0, CODE_LENGTH, 4))
+
+
+# `count` distinct verification codes not used by any certificate yet
+def generate_codes(count):
+    codes = set()
+    while len(codes) < count:
+        candidates = list({_random_code() for _ in range(count - len(codes))} - codes)
+        taken = set()
+        for i in range(0, len(candidates), LOOKUP_CHUNK):
+            taken.update(db.session.scalars(
+                db.select(Certificate.verification_code)
+                .where(Certificate.verification_code.in_(candidates[i:i + LOOKUP_CHUNK]))
+            ))
+        codes.update(code for code in candidates if code not in taken)
+    return list(codes)
+
+
+def _font(path, size):
+    key = (path, size)
+    if key not in _fonts:
+        try:
+            _fonts[key] = ImageFont.truetype(path or 'DejaVuSans.ttf', size)
+        except OSError:
+            _fonts[key] = ImageFont.load_default(size)
+    return _fonts[key]
+
+
+# Largest font up to `size` at which `text` fits in `width` pixels
+def _fitted_font(draw, text, path, size, width):
+    font = _font(path, size)
+    while size > 12 and draw.textlength(text, font=font) > width:
+        size -= 4
+        font = _font(path, size)
+    return font
+
+
+def _default_background(font_path):
+    page = Image.new('RGB', PAGE_SIZE, 'white')
+    draw = ImageDraw.Draw(page)
+    width, height = PAGE_SIZE
+    draw.rectangle((40, 40, width - 41, height - 41), outline=ACCENT, width=12)
+    draw.rectangle((70, 70, width - 71, height - 71), outline=MUTED, width=2)
+    draw.text((width / 2, height * 0.18), 'ScrumJET', font=_font(font_path, 48),
+              fill=ACCENT, anchor='mm')
+    draw.text((width / 2, height * 0.28), 'Certificate of Completion', font=_font(font_path, 84),
+              fill=INK, anchor='mm')
+    draw.text((width / 2, height * 0.38), 'This certifies that', font=_font(font_path, 32),
+              fill=MUTED, anchor='mm')
+    draw.text((width / 2, height * 0.56), 'has successfully completed', font=_font(font_path, 32),
+              fill=MUTED, anchor='mm')
+    return page
+
+
+# The page everything is drawn on, decoded or drawn once per worker process
+def _background(template, font_path):
+    key = (template, font_path)
+    if key not in _backgrounds:
+        if template:
+            with Image.open(template) as image:
+                _backgrounds[key] = image.convert('RGB')
+        else:
+            _backgrounds[key] = _default_background(font_path)
+    return _backgrounds[key]
+
+
+def _put(backend, key, data, suffix, content_type):
+    fd, tmp_path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        backend.put(key, tmp_path, content_type)
+    finally:
+        os.remove(tmp_path)
+
+
+# Runs in a pool worker: render one certificate, store the PDF as a blob and
+# a half-size PNG preview next to it. Returns (blob key, PDF size).
+def render_certificate(backend, template, font_path, fields):
+    page = _background(template, font_path).copy()
+    draw = ImageDraw.Draw(page)
+    width, height = page.size
+    scale = height / PAGE_SIZE[1]
+
+    def line(y, text, size, fill):
+        font = _fitted_font(draw, text, font_path, round(size * scale), width * 0.8)
+        draw.text((width / 2, height * y), text, font=font, fill=fill, anchor='mm')
+
+    line(0.47, fields['name'], 80, INK)
+    line(0.65, fields['course'], 56, ACCENT)
+    line(0.74, fields['date'], 32, MUTED)
+    small = _font(font_path, round(24 * scale))
+    draw.text((width * 0.08, height * 0.88), f"Certificate no. {fields['number']}",
+              font=small, fill=MUTED, anchor='lm')
+    draw.text((width * 0.92, height * 0.88), f"Verification code {fields['code']}",
+              font=small, fill=MUTED, anchor='rm')
+
+    pdf = io.BytesIO()
+    page.save(pdf, 'PDF', resolution=150 * scale, title=f"Certificate {fields['number']}")
+    pdf = pdf.getvalue()
+    key = hashlib.sha256(pdf).hexdigest()
+    _put(backend, key, pdf, '.pdf', 'application/pdf')
+
+    preview = io.BytesIO()
+    page.reduce(2).save(preview, 'PNG')
+    _put(backend, f'{key}-{PREVIEW_SUFFIX}', preview.getvalue(), '.png', 'image/png')
+    return key, len(pdf)
+
+
+# (user id, first name, last name) of enrolled users of the course without a certificate for it
+def _recipients(course, user_ids=None, completed_only=True):
+    query = (
+        db.select(User.id, User.first_name, User.last_name)
+        .join(enrollments, enrollments.c.user_id == User.id)
+        .where(enrollments.c.course_id == course.id)
+        .where(~db.select(Certificate.id)
+               .where(Certificate.user_id == User.id, Certificate.course_id == course.id)
+               .exists())
+        .order_by(User.last_name, User.first_name, User.id)
+    )
+    if completed_only:
+        query = query.where(enrollments.c.completed.is_(True))
+    if user_ids is not None:
+        query = query.where(User.id.in_(user_ids))
+    return db.session.execute(query).all()
+
+
+# Issue certificates for a course to everyone enrolled who has completed it
+# (or, with completed_only=False, everyone enrolled), optionally only `user_ids`.
+# Users who already hold a certificate for the course are skipped. Returns the
+# new certificates, committed.
+def issue_certificates(course, user_ids=None, completed_only=True, issued_at=None):
+    recipients = _recipients(course, user_ids, completed_only)
+    if not recipients:
+        return []
+    config = current_app.config
+    issued_at = issued_at or datetime.utcnow()
+
+    numbers = allocate_numbers(len(recipients), issued_at.year, config['CERTIFICATE_NUMBER_PREFIX'])
+    db.session.commit()
+    codes = generate_codes(len(recipients))
+
+    issued_on = f'{issued_at:%B} {issued_at.day}, {issued_at.year}'
+    jobs = [
+        {'name': f'{first_name} {last_name}', 'course': course.title, 'date': issued_on,
+         'number': number, 'code': code}
+        for (_, first_name, last_name), number, code in zip(recipients, numbers, codes)
+    ]
+    executor = _get_executor()
+    chunksize = max(1, len(jobs) // (config['CERTIFICATE_WORKERS'] * 4))
+    count = len(jobs)
+    documents = list(executor.map(
+        render_certificate, [storage.backend] * count, [config['CERTIFICATE_TEMPLATE']] * count,
+        [config['CERTIFICATE_FONT']] * count, jobs, chunksize=chunksize,
+    ))
+
+    try:
+        keys = dict(documents)
+        stored = set(db.session.scalars(db.select(StoredBlob.key).where(StoredBlob.key.in_(keys))))
+        db.session.add_all(StoredBlob(key=key, size=size, content_type='application/pdf')
+                           for key, size in keys.items() if key not in stored)
+        db.session.flush()
+        certificates = [
+            Certificate(user_id=user_id, course_id=course.id, issued_date=issued_at,
+                        certificate_number=job['number'], verification_code=job['code'],
+                        document=key)
+            for (user_id, _, _), job, (key, _) in zip(recipients, jobs, documents)
+        ]
+        db.session.add_all(certificates)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return certificates
+
@@ -0,0 +1,126 @@
+import click
+from flask.cli import AppGroup
+
+
+search_cli = AppGroup('search', help='Full-text search index commands.')
+
+
+@search_cli.command('reindex')
+def search_reindex():
+    """Rebuild the search documents for all articles and courses."""
+    from app.search import reindex
+    indexed = reindex()
+    click.echo(f'Indexed {indexed} documents.')
+
+
+mail_cli = AppGroup('mail', help='Outbound email commands.')
+
+
+@mail_cli.command('drain')
+@click.option('--batch-size', type=int, default=None, help='Emails claimed per batch.')
+@click.option('--interval', type=float, default=None, help='Seconds to wait when the outbox is empty.')
+@click.option('--once', is_flag=True, help='Exit once the outbox is empty instead of polling.')
+def mail_drain(batch_size, interval, once):
+    """Send queued emails from the outbox."""
+    from app.outbox import drain
+
+    def report(counts):
+        click.echo(f"Sent {counts['sent']}, retrying {counts['retried']}, failed {counts['failed']}.")
+
+    totals = drain(batch_size=batch_size, interval=interval, once=once, report=report)
+    click.echo(f"Outbox empty: sent {totals['sent']}, retrying {totals['retried']}, failed {totals['failed']}.")
+
+
+@mail_cli.command('announce')
+@click.argument('course_id', type=int)
+@click.option('--subject', required=True, help='Announcement subject.')
+@click.option('--message', 'message_file', type=click.File(), default='-',
+              help='File containing the announcement text (default: stdin).')
+def mail_announce(course_id, subject, message_file):
+    """Email an announcement to everyone enrolled in a course."""
+    from app import db
+    from app.email import mail_request_context, send_course_announcement
+    from app.mailer import mail_dispatcher
+    from app.models import Course
+
+    course = db.session.get(Course, course_id)
+    if course is None:
+        raise click.BadParameter(f'No course with id {course_id}.', param_hint='course_id')
+    message = message_file.read().strip()
+    with mail_request_context():
+        count = send_course_announcement(course, subject, message)
+    mail_dispatcher.join()
+    click.echo(f'Sent {count} announcement emails.')
+
+
+storage_cli = AppGroup('storage', help='Upload storage commands.')
+
+
+@storage_cli.command('gc')
+@click.option('--grace', type=int, default=None,
+              help='Keep unreferenced blobs younger than this many seconds.')
+def storage_gc(grace):
+    """Delete stored files that are no longer referenced."""
+    from app.storage import collect_garbage
+    removed = collect_garbage(grace=grace)
+    click.echo(f'Removed {removed} unreferenced blobs.')
+
+
+assets_cli = AppGroup('assets', help='Static asset commands.')
+
+
+@assets_cli.command('build')
+def assets_build():
+    """Fingerprint and precompress static files into static/dist."""
+    from flask import current_app
+    from app.assets import build
+    manifest = build(current_app)
+    click.echo(f'Built {len(manifest)} assets.')
+
+
+analytics_cli = AppGroup('analytics', help='Admin analytics commands.')
+
+
+@analytics_cli.command('rollup')
+@click.option('--full', is_flag=True, help='Rebuild all rollups from history first.')
+@click.option('--interval', type=float, default=None, help='Seconds between runs.')
+@click.option('--once', is_flag=True, help='Run once and exit instead of repeating.')
+def analytics_rollup(full, interval, once):
+    """Update the hourly and daily analytics rollups."""
+    from app.analytics import run
+
+    def report(results):
+        click.echo(', '.join(f'{source}: {"rebuilt" if hours is None else f"{hours} hours"}'
+                             for source, hours in results.items()))
+
+    run(interval=interval, full=full, once=once, report=report)
+
+
+certificates_cli = AppGroup('certificates', help='Course certificate commands.')
+
+
+@certificates_cli.command('issue')
+@click.argument('course_id', type=int)
+@click.option('--user', 'user_ids', type=int, multiple=True,
+              help='Only this user id (repeatable; default: everyone eligible).')
+@click.option('--all-enrolled', is_flag=True, help='Include enrolled users who have not completed the course.')
+def certificates_issue(course_id, user_ids, all_enrolled):
+    """Issue certificates for a course to everyone who completed it."""
+    from app import db
+    from app.certificates import issue_certificates
+    from app.models import Course
+
+    course = db.session.get(Course, course_id)
+    if course is None:
+        raise click.BadParameter(f'No course with id {course_id}.', param_hint='course_id')
+    certificates = issue_certificates(course, user_ids=user_ids or None, completed_only=not all_enrolled)
+    click.echo(f'Issued {len(certificates)} certificates.')
+
+
+def register_commands(app):
+    app.cli.add_command(search_cli)
+    app.cli.add_command(mail_cli)
+    app.cli.add_command(storage_cli)
+    app.cli.add_command(assets_cli)
+    app.cli.add_command(analytics_cli)
+    app.cli.add_command(certificates_cli)
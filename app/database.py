@@ -0,0 +1,99 @@
+"""Engine configuration, fork safety and connection pool statistics.
+
+``Config.init_app`` builds ``SQLALCHEMY_ENGINE_OPTIONS`` from the ``DB_*``
+settings (see ``engine_options``). In PgBouncer mode SQLAlchemy does no pooling
+of its own (``NullPool``) and the statement timeout is applied with
+``SET LOCAL`` at the start of every transaction, because with transaction
+pooling a session-level setting would land on whichever server connection
+PgBouncer happens to hand out.
+"""
+import os
+import threading
+import weakref
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool
+from app import db
+
+# Engines of every app in this process, with their pool statistics
+_engines = weakref.WeakKeyDictionary()
+
+
+# SQLAlchemy engine options for `uri` from the DB_* settings in `config`
+def engine_options(uri, config):
+    if uri.startswith('sqlite'):
+        return {}
+
+    options = {'pool_pre_ping': config['DB_POOL_PRE_PING']}
+    timeout = config['DB_STATEMENT_TIMEOUT']
+    if config['DB_PGBOUNCER']:
+        options['poolclass'] = NullPool
+    else:
+        options.update(
+            pool_size=config['DB_POOL_SIZE'],
+            max_overflow=config['DB_MAX_OVERFLOW'],
+            pool_timeout=config['DB_POOL_TIMEOUT'],
+            pool_recycle=config['DB_POOL_RECYCLE'],
+            pool_use_lifo=True,
+        )
+        if timeout:
+            options['connect_args'] = {'options': f'-c statement_timeout={timeout}'}
+    return options
+
+
+class PoolStats:
+    FIELDS = ('connects', 'checkouts', 'checkins', 'invalidations', 'resets_after_fork')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def incr(self, field):
+        with self._lock:
+            self._counts[field] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+def init_app(app):
+    stats = PoolStats()
+    app.extensions['db_pool_stats'] = stats
+    with app.app_context():
+        engine = db.engine
+
+    event.listen(engine.pool, 'connect', lambda *args: stats.incr('connects'))
+    event.listen(engine.pool, 'checkout', lambda *args: stats.incr('checkouts'))
+    event.listen(engine.pool, 'checkin', lambda *args: stats.incr('checkins'))
+    event.listen(engine.pool, 'invalidate', lambda *args: stats.incr('invalidations'))
+
+    timeout = app.config['DB_STATEMENT_TIMEOUT']
+    if app.config['DB_PGBOUNCER'] and timeout and engine.dialect.name == 'postgresql':
+        @event.listens_for(engine, 'begin')
+        def _set_statement_timeout(connection):
+            connection.exec_driver_sql(f'SET LOCAL statement_timeout = {int(timeout)}')
+
+    _engines[engine] = stats
+
+
+# Connections inherited from a parent process (gunicorn --preload, multiprocessing)
+# share sockets with it; the child drops them and opens its own
+def _reset_after_fork():
+    for engine, stats in list(_engines.items()):
+        engine.dispose(close=False)
+        stats.incr('resets_after_fork')
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# Current pool occupancy plus lifetime counters for this process
+def pool_stats(app):
+    pool = db.engine.pool
+    stats = {'pool': type(pool).__name__, 'pid': os.getpid()}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        method = getattr(pool, name, None)
+        if method is not None:
+            stats[name] = method()
+    stats.update(app.extensions['db_pool_stats'].snapshot())
+    return stats
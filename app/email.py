@@ -1,42 +1,115 @@
-from threading import Thread
-from flask import current_app, render_template
+from datetime import datetime
+from flask import current_app, url_for
 from flask_mail import Message
-from app import mail
+from app import db
+from app.mailer import mail_dispatcher
+from app.models import OutboundEmail, User, enrollments
 
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
-
-
-def send_email(subject, recipients, text_body, html_body, sender=None, attachments=None):
-    app = current_app._get_current_object()
-    msg = Message(subject, recipients=recipients, sender=sender or app.config['MAIL_DEFAULT_SENDER'])
+def build_message(subject, recipients, text_body, html_body, sender=None, attachments=None):
+    msg = Message(subject, recipients=recipients, sender=sender or current_app.config['MAIL_DEFAULT_SENDER'])
     msg.body = text_body
     msg.html = html_body
-    
+
     if attachments:
         for attachment in attachments:
             msg.attach(*attachment)
-    
-    Thread(target=send_async_email, args=(app, msg)).start()
+    return msg
 
 
-def send_password_reset_email(user):
-    token = user.get_reset_password_token()
-    send_email(
-        subject='[ScrumJET] Reset Your Password',
-        recipients=[user.email],
-        text_body=render_template('email/reset_password.txt', user=user, token=token),
-        html_body=render_template('email/reset_password.html', user=user, token=token)
+# Request context for rendering mail outside a request, so external links
+# point at MAIL_BASE_URL
+def mail_request_context():
+    return current_app.test_request_context(base_url=current_app.config['MAIL_BASE_URL'])
+
+
+# The compiled email/<name>.txt and email/<name>.html templates. The shared
+# context (template context processors included) is built once, so each
+# render() is only the template code itself.
+class EmailTemplate:
+    def __init__(self, name, **shared):
+        env = current_app.jinja_env
+        self.text = env.get_template(f'email/{name}.txt')
+        self.html = env.get_template(f'email/{name}.html')
+        self.shared = {'now': datetime.utcnow(), **shared}
+        current_app.update_template_context(self.shared)
+
+    def render(self, **context):
+        context = {**self.shared, **context}
+        return self.text.render(context), self.html.render(context)
+
+
+# Yield one personalised message per recipient, rendered from a single
+# EmailTemplate. `recipients` is any iterable of objects or rows with `email`
+# and the fields the template uses as `user`; nothing is held beyond the
+# current message.
+def render_bulk(name, subject, recipients, sender=None, **shared):
+    template = EmailTemplate(name, **shared)
+    for recipient in recipients:
+        text_body, html_body = template.render(user=recipient)
+        yield build_message(subject, [recipient.email], text_body, html_body, sender)
+
+
+# Enrolled users of a course as plain rows, fetched `chunk_size` at a time
+def stream_enrolled_users(course_id, chunk_size=1000):
+    result = db.session.execute(
+        db.select(User.id, User.email, User.first_name, User.last_name)
+        .join(enrollments, enrollments.c.user_id == User.id)
+        .where(enrollments.c.course_id == course_id)
+        .order_by(User.id)
+        .execution_options(yield_per=chunk_size)
     )
+    yield from result
+
+
+# Mail an announcement to everyone enrolled in `course`. Messages are handed to
+# the bounded mail queue as they are rendered, blocking while it is full, so
+# memory stays flat however many students are enrolled.
+def send_course_announcement(course, subject, message):
+    messages = render_bulk(
+        'course_announcement', f'[ScrumJET] {course.title}: {subject}',
+        stream_enrolled_users(course.id, current_app.config['MAIL_BULK_CHUNK_SIZE']),
+        course_title=course.title, message=message,
+        course_url=url_for('courses.course_detail', id=course.id, _external=True),
+    )
+    count = 0
+    for msg in messages:
+        mail_dispatcher.submit(msg, wait=True)
+        count += 1
+    return count
+
+
+# Queue an email in the outbox; it is sent by `flask mail drain` once the
+# caller's transaction commits
+def queue_email(template, user=None, recipient=None, **params):
+    email = OutboundEmail(template=template, user=user,
+                          recipient=recipient or user.email, params=params or None)
+    db.session.add(email)
+    return email
+
+
+def render_password_reset_email(email):
+    token = email.user.get_reset_password_token()
+    return ('[ScrumJET] Reset Your Password',
+            *EmailTemplate('reset_password').render(user=email.user, token=token))
+
+
+def render_confirmation_email(email):
+    token = email.user.get_confirmation_token()
+    return ('[ScrumJET] Confirm Your Email',
+            *EmailTemplate('confirm_email').render(user=email.user, token=token))
+
+
+# Outbox templates: each renders a queued OutboundEmail into (subject, text, html)
+OUTBOX_TEMPLATES = {
+    'reset_password': render_password_reset_email,
+    'confirm_email': render_confirmation_email,
+}
+
+
+def send_password_reset_email(user):
+    return queue_email('reset_password', user)
 
 
 def send_confirmation_email(user):
-    token = user.get_confirmation_token()
-    send_email(
-        subject='[ScrumJET] Confirm Your Email',
-        recipients=[user.email],
-        text_body=render_template('email/confirm_email.txt', user=user, token=token),
-        html_body=render_template('email/confirm_email.html', user=user, token=token)
-    )
\ No newline at end of file
+    return queue_email('confirm_email', user)
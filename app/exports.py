@@ -0,0 +1,144 @@
+"""Streaming CSV and JSON Lines exports for admin reports.
+
+Rows are read with ``yield_per`` (a server-side cursor on PostgreSQL), encoded
+``EXPORT_CHUNK_SIZE`` rows at a time and, optionally, gzip-compressed as they
+go, so a worker holds one chunk in memory however large the table is. The
+response body is a generator: when the client disconnects the server closes
+it, which closes the cursor and ends the query.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from app import db
+from app.models import Certificate, Course, Payment, User, enrollments
+
+
+class Export:
+    def __init__(self, name, columns, query, time_column):
+        self.name = name
+        self.columns = columns
+        self._query = query
+        self.time_column = time_column
+
+    # SELECT of the export's columns, optionally limited to rows created in [since, until)
+    def query(self, since=None, until=None):
+        stmt = self._query()
+        if since is not None:
+            stmt = stmt.where(self.time_column >= since)
+        if until is not None:
+            stmt = stmt.where(self.time_column < until)
+        return stmt
+
+
+EXPORTS = {export.name: export for export in (
+    Export(
+        'users',
+        ('id', 'username', 'email', 'first_name', 'last_name', 'role', 'email_confirmed', 'created_at'),
+        lambda: db.select(User.id, User.username, User.email, User.first_name, User.last_name,
+                          User.role, User.email_confirmed, User.created_at).order_by(User.id),
+        User.created_at,
+    ),
+    Export(
+        'enrollments',
+        ('user_id', 'email', 'course_id', 'course_title', 'enrolled_at', 'completed', 'completed_at'),
+        lambda: db.select(enrollments.c.user_id, User.email, enrollments.c.course_id, Course.title,
+                          enrollments.c.enrolled_at, enrollments.c.completed, enrollments.c.completed_at)
+        .join(User, User.id == enrollments.c.user_id)
+        .join(Course, Course.id == enrollments.c.course_id)
+        .order_by(enrollments.c.user_id, enrollments.c.course_id),
+        enrollments.c.enrolled_at,
+    ),
+    Export(
+        'payments',
+        ('id', 'user_id', 'course_id', 'amount', 'currency', 'status', 'payment_method',
+         'transaction_id', 'created_at', 'updated_at'),
+        lambda: db.select(Payment.id, Payment.user_id, Payment.course_id, Payment.amount, Payment.currency,
+                          Payment.status, Payment.payment_method, Payment.transaction_id,
+                          Payment.created_at, Payment.updated_at).order_by(Payment.id),
+        Payment.created_at,
+    ),
+    Export(
+        'certificates',
+        ('id', 'user_id', 'course_id', 'certificate_number', 'issued_date'),
+        lambda: db.select(Certificate.id, Certificate.user_id, Certificate.course_id,
+                          Certificate.certificate_number, Certificate.issued_date).order_by(Certificate.id),
+        Certificate.issued_date,
+    ),
+)}
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+# Text starting like a formula is prefixed so spreadsheets show it instead of evaluating it
+def _csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(('=', '+', '-', '@')):
+        return "'" + value
+    return value
+
+
+# Encoded chunks of `rows`, `chunk_size` rows each; CSV starts with a header line
+def encode(rows, columns, fmt, chunk_size):
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+
+        def write(row):
+            writer.writerow([_csv_value(value) for value in row])
+    else:
+        def write(row):
+            buffer.write(json.dumps(dict(zip(columns, row)), default=_json_default))
+            buffer.write('\n')
+
+    count = 0
+    for row in rows:
+        write(row)
+        count += 1
+        if count % chunk_size == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+# Gzip a stream of byte chunks as it is produced
+def gzip_chunks(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# Byte chunks of an export. Must be consumed inside an app context (the view
+# wraps it in stream_with_context); closing the generator closes the cursor.
+def stream_export(export, fmt='csv', since=None, until=None, compress=False, chunk_size=1000):
+    result = db.session.execute(export.query(since, until).execution_options(yield_per=chunk_size))
+    try:
+        chunks = encode(result, export.columns, fmt, chunk_size)
+        if compress:
+            chunks = gzip_chunks(chunks)
+        yield from chunks
+    finally:
+        result.close()
+        db.session.rollback()
+
+
+def filename(export, fmt, compress=False):
+    name = f'{export.name}-{datetime.utcnow():%Y%m%d-%H%M%S}.{FORMATS[fmt][1]}'
+    return name + '.gz' if compress else name
@@ -0,0 +1,102 @@
+"""Upload pipeline for avatar images.
+
+The upload is streamed into content-addressed storage (see ``app.storage``)
+after a header check, so identical images are stored once. Resizing happens
+in a process pool off the request path: every size in ``AVATAR_SIZES`` is
+written as WebP and JPEG next to the original (``<key>-<size>.<ext>``).
+Variant names change whenever the content does, so they are served with
+far-future cache headers.
+"""
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app, url_for
+from PIL import Image, ImageOps, UnidentifiedImageError
+from app.storage import is_blob_key, storage
+
+AVATAR_SIZES = {'sm': 64, 'md': 160, 'lg': 320}
+AVATAR_FORMATS = {'webp': ('WEBP', 'image/webp'), 'jpg': ('JPEG', 'image/jpeg')}
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+
+
+def init_app(app):
+    app.jinja_env.globals['avatar_url'] = avatar_url
+
+
+class InvalidImageError(ValueError):
+    pass
+
+
+# One pool per process, created on first use (after gunicorn has forked)
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ProcessPoolExecutor(max_workers=current_app.config['IMAGE_WORKERS'])
+        _executor_pid = os.getpid()
+    return _executor
+
+
+# Check a spooled upload is an image without decoding it; returns its MIME type
+def verify_image(path):
+    try:
+        with Image.open(path) as image:
+            image.verify()
+            return Image.MIME.get(image.format)
+    except (UnidentifiedImageError, OSError, SyntaxError) as err:
+        raise InvalidImageError('The uploaded file is not a valid image.') from err
+
+
+# Runs in a pool worker: write every size/format variant of one stored image
+def render_variants(backend, key, sizes, formats):
+    source_path, is_temporary = backend.fetch(key)
+    written = []
+    try:
+        with Image.open(source_path) as image:
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            for size_name, size in sizes.items():
+                variant = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+                for ext, (pil_format, content_type) in formats.items():
+                    fd, tmp_path = tempfile.mkstemp(suffix=f'.{ext}')
+                    os.close(fd)
+                    try:
+                        variant.save(tmp_path, pil_format, quality=85, optimize=True)
+                        backend.put(f'{key}-{size_name}.{ext}', tmp_path, content_type)
+                    finally:
+                        os.remove(tmp_path)
+                    written.append(f'{size_name}.{ext}')
+    finally:
+        if is_temporary:
+            os.remove(source_path)
+    return written
+
+
+# Pool callbacks run outside the app context, so this logs via the module logger
+def _log_failure(future):
+    error = future.exception()
+    if error is not None:
+        logger.error('Avatar processing failed: %s', error)
+
+
+# Store an avatar upload and queue its variants. Returns the blob key for
+# User.avatar. Raises InvalidImageError if the file is not a readable image.
+def save_avatar(file_storage):
+    key = storage.store(file_storage.stream, validate=verify_image)
+    future = _get_executor().submit(render_variants, storage.backend, key,
+                                    AVATAR_SIZES, AVATAR_FORMATS)
+    future.add_done_callback(_log_failure)
+    return key
+
+
+# URL of one variant of `avatar` (a User.avatar value), e.g. avatar_url(user.avatar, 'sm')
+def avatar_url(avatar, size='md', ext='webp'):
+    if not avatar:
+        return url_for('static', filename='images/default-avatar.png')
+    if not is_blob_key(avatar):
+        # Uploaded before content-addressed storage: no variants
+        return url_for('main.uploaded_file', filename=avatar)
+    return storage.url(avatar, f'{size}.{ext}')
@@ -0,0 +1,165 @@
+"""Per-request SQL instrumentation.
+
+Every statement run on the primary or a replica engine is counted and timed
+against the current request. Statements are grouped by shape (the SQL with
+literals and ``IN`` lists collapsed), and a SELECT shape repeated at least
+``SQL_N_PLUS_ONE_THRESHOLD`` times in one request is reported as a likely
+N+1 query - typically a ``lazy='dynamic'`` relationship or a lazy load used
+inside a loop in a template.
+
+With ``SQL_STATS_HEADERS`` (on in development) the totals are returned in
+``X-DB-*`` response headers. With ``SQL_LOG_REQUESTS`` (on in production)
+every request logs one JSON line; requests with N+1 suspects always do, at
+WARNING. Tests can use ``query_budget`` to fail when an endpoint runs more
+queries than expected::
+
+    with query_budget(6):
+        client.get('/courses/courses')
+"""
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r'\bIN\s*\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)',
+                      re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+_local = threading.local()
+
+
+# Collapse literals, IN lists and whitespace so the same query with different
+# values has the same shape
+def statement_shape(statement):
+    shape = _LITERAL.sub('?', statement)
+    shape = _IN_LIST.sub('IN (?)', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self._statements = {}
+
+    # Statements are counted verbatim and only shaped when reported
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self._statements[statement] = self._statements.get(statement, 0) + 1
+
+    def shapes(self):
+        shapes = {}
+        for statement, count in self._statements.items():
+            shape = statement_shape(statement)
+            shapes[shape] = shapes.get(shape, 0) + count
+        return shapes
+
+    # (shape, count) for shapes run more than once, most repeated first
+    def duplicates(self):
+        repeated = [(shape, count) for shape, count in self.shapes().items() if count > 1]
+        return sorted(repeated, key=lambda item: -item[1])
+
+    # Repeated SELECTs that look like one query per row of an earlier result
+    def n_plus_one(self, threshold):
+        return [(shape, count) for shape, count in self.duplicates()
+                if count >= threshold and shape.upper().startswith('SELECT')]
+
+    def as_dict(self, threshold):
+        duplicates = self.duplicates()
+        return {
+            'queries': self.count,
+            'db_ms': round(self.duration * 1000, 2),
+            'duplicate_queries': sum(count - 1 for _, count in duplicates),
+            'n_plus_one': [{'count': count, 'statement': shape}
+                           for shape, count in self.n_plus_one(threshold)],
+        }
+
+
+# Stats objects the current statement counts against: the request's and any
+# query_budget blocks open in this thread
+def _collectors():
+    collectors = list(getattr(_local, 'budgets', ()))
+    if has_request_context():
+        stats = g.get('sql_stats')
+        if stats is not None:
+            collectors.append(stats)
+    return collectors
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    for stats in _collectors():
+        stats.record(statement, duration)
+
+
+def init_app(app):
+    if not app.config['SQL_INSTRUMENTATION']:
+        return
+    from app import db
+    with app.app_context():
+        engines = [db.engine]
+    replicas = app.extensions.get('db_replicas')
+    if replicas is not None:
+        engines.extend(replica.engine for replica in replicas.replicas)
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def _start_sql_stats():
+        g.sql_stats = QueryStats()
+
+    @app.after_request
+    def _report_sql_stats(response):
+        stats = g.get('sql_stats')
+        if stats is None:
+            return response
+        threshold = app.config['SQL_N_PLUS_ONE_THRESHOLD']
+        summary = stats.as_dict(threshold)
+
+        if app.config['SQL_STATS_HEADERS']:
+            response.headers['X-DB-Query-Count'] = str(summary['queries'])
+            response.headers['X-DB-Time-Ms'] = str(summary['db_ms'])
+            response.headers['X-DB-Duplicate-Queries'] = str(summary['duplicate_queries'])
+            if summary['n_plus_one']:
+                response.headers['X-DB-N-Plus-One'] = str(len(summary['n_plus_one']))
+
+        if summary['n_plus_one'] or app.config['SQL_LOG_REQUESTS']:
+            record = {'event': 'sql', 'method': request.method, 'path': request.path,
+                      'endpoint': request.endpoint, 'status': response.status_code}
+            record.update(summary)
+            log = app.logger.warning if summary['n_plus_one'] else app.logger.info
+            log(json.dumps(record))
+        return response
+
+
+# Test helper: fail if the block runs more than `max_queries` statements.
+# Yields the QueryStats collected so far.
+@contextmanager
+def query_budget(max_queries, threshold=None):
+    stats = QueryStats()
+    budgets = _local.__dict__.setdefault('budgets', [])
+    budgets.append(stats)
+    try:
+        yield stats
+    finally:
+        budgets.remove(stats)
+    if stats.count > max_queries:
+        lines = [f'{stats.count} queries run, budget is {max_queries}']
+        lines.extend(f'  {count}x {shape}' for shape, count in stats.duplicates())
+        raise AssertionError('\n'.join(lines))
+    if threshold is not None and stats.n_plus_one(threshold):
+        shape, count = stats.n_plus_one(threshold)[0]
+        raise AssertionError(f'Possible N+1 query ({count}x): {shape}')
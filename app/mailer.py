@@ -0,0 +1,202 @@
+"""Bounded worker pool for outgoing mail.
+
+Messages go onto a fixed-size queue; when the queue is full ``submit`` blocks
+for up to ``MAIL_QUEUE_TIMEOUT`` seconds (backpressure) before giving up. A
+fixed number of worker threads drain the queue in batches. Each worker keeps
+one SMTP connection open across batches and closes it after
+``MAIL_CONNECTION_IDLE`` idle seconds. Transient SMTP failures are retried
+with exponential backoff on a fresh connection.
+
+Workers start lazily in the process that first submits mail, so they are
+created after gunicorn forks its workers.
+"""
+import atexit
+import os
+import queue
+import smtplib
+import threading
+import time
+from flask import current_app
+from app import mail
+
+
+class MailQueueFullError(Exception):
+    pass
+
+
+# SMTP replies in the 4xx range and dropped connections are worth retrying
+def is_transient_error(error):
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    return isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError))
+
+
+class MailStats:
+    FIELDS = ('submitted', 'sent', 'failed', 'retried', 'dropped', 'batches', 'connections')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def incr(self, field, amount=1):
+        with self._lock:
+            self._counts[field] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+# A reusable SMTP connection for one worker thread
+class PooledConnection:
+    def __init__(self, stats):
+        self.stats = stats
+        self._connection = None
+
+    def send(self, msg):
+        if self._connection is None:
+            self._connection = mail.connect().__enter__()
+            self.stats.incr('connections')
+        self._connection.send(msg)
+
+    def close(self):
+        if self._connection is None:
+            return
+        try:
+            self._connection.__exit__(None, None, None)
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._connection = None
+
+    @property
+    def is_open(self):
+        return self._connection is not None
+
+
+class MailDispatcher:
+    def __init__(self, app=None):
+        self.stats = MailStats()
+        self._queue = None
+        self._workers = []
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['mail_dispatcher'] = self
+        self.app = app
+        self.workers = app.config.get('MAIL_WORKERS', 2)
+        self.queue_size = app.config.get('MAIL_QUEUE_SIZE', 1000)
+        self.queue_timeout = app.config.get('MAIL_QUEUE_TIMEOUT', 5)
+        self.batch_size = app.config.get('MAIL_BATCH_SIZE', 20)
+        self.max_retries = app.config.get('MAIL_MAX_RETRIES', 3)
+        self.retry_backoff = app.config.get('MAIL_RETRY_BACKOFF', 1.0)
+        self.connection_idle = app.config.get('MAIL_CONNECTION_IDLE', 30)
+
+    # Start the worker threads once per process
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._workers = []
+            for number in range(self.workers):
+                worker = threading.Thread(target=self._run, name=f'mail-worker-{number}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            self._pid = os.getpid()
+            # Deliver whatever is still queued before the process exits
+            atexit.register(self.shutdown)
+
+    # With `wait=True` the caller blocks until there is room (used by bulk mailings)
+    def submit(self, msg, wait=False):
+        self._ensure_started()
+        try:
+            self._queue.put(msg, timeout=None if wait else self.queue_timeout)
+        except queue.Full:
+            self.stats.incr('dropped')
+            raise MailQueueFullError(f'Mail queue is full ({self.queue_size} messages)') from None
+        self.stats.incr('submitted')
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats_snapshot(self):
+        stats = self.stats.snapshot()
+        stats['queued'] = self.queue_depth
+        stats['workers'] = len(self._workers)
+        return stats
+
+    # Block until every submitted message has been handled (mainly for tests)
+    def join(self):
+        if self._queue is not None:
+            self._queue.join()
+
+    def shutdown(self):
+        if self._queue is None or self._pid != os.getpid():
+            return
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        self._pid = None
+
+    def _next_batch(self, connection):
+        try:
+            first = self._queue.get(timeout=self.connection_idle if connection.is_open else None)
+        except queue.Empty:
+            connection.close()
+            return []
+        batch = [first]
+        while first is not None and len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        connection = PooledConnection(self.stats)
+        with self.app.app_context():
+            while True:
+                batch = self._next_batch(connection)
+                if not batch:
+                    continue
+                stop = False
+                for msg in batch:
+                    if msg is None:
+                        stop = True
+                    else:
+                        self._deliver(connection, msg)
+                    self._queue.task_done()
+                self.stats.incr('batches')
+                if stop:
+                    connection.close()
+                    return
+
+    def _deliver(self, connection, msg):
+        for attempt in range(self.max_retries + 1):
+            try:
+                connection.send(msg)
+                self.stats.incr('sent')
+                return True
+            except Exception as error:
+                # A rejected message leaves the SMTP session usable; anything else gets a fresh connection
+                if not isinstance(error, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+                    connection.close()
+                if attempt >= self.max_retries or not is_transient_error(error):
+                    self.stats.incr('failed')
+                    current_app.logger.error('Failed to send mail to %s: %s', msg.recipients, error)
+                    return False
+                self.stats.incr('retried')
+                time.sleep(self.retry_backoff * 2 ** attempt)
+
+
+mail_dispatcher = MailDispatcher()
@@ -0,0 +1,315 @@
+"""Request metrics shared across worker processes, exposed at ``/metrics``.
+
+Every thread of every worker process writes its own memory-mapped file in
+``METRICS_DIR`` (``<pid>_<n>.db``, handed on to a new thread once its thread
+exits), so recording a request takes no locks at all. ``/metrics`` reads and
+sums all the files, whichever worker serves it, and renders them in the
+Prometheus text format. Scrapes must present ``METRICS_TOKEN`` as a bearer
+token; an app without one only serves ``/metrics`` in debug or testing mode:
+
+* ``scrumjet_http_requests_total{endpoint, method, status}``
+* ``scrumjet_http_request_duration_seconds{endpoint}`` (histogram)
+* ``scrumjet_http_request_db_seconds{endpoint}`` (histogram, see ``app.instrumentation``)
+* ``scrumjet_http_request_db_queries_total{endpoint}``
+* ``scrumjet_http_requests_in_flight``
+
+``METRICS_DIR`` must be emptied when the server starts and the in-flight
+gauge of a worker that exits must be dropped; ``gunicorn.conf.py`` does both
+through ``clear`` and ``mark_process_dead``.
+
+File layout: an 8-byte header holding the number of bytes used, then records
+of ``<4-byte key length><utf-8 JSON key, padded to 8 bytes><8-byte double>``.
+The header is updated after a record is complete, so readers never see a
+partial one.
+"""
+import glob
+import hmac
+import itertools
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+from flask import Response, abort, current_app, g, request
+
+PREFIX = 'scrumjet_'
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DB_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+# name -> (type, help)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests handled, by endpoint, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'Time spent handling a request.'),
+    'http_request_db_seconds': ('histogram', 'Time spent in SQL statements per request.'),
+    'http_request_db_queries_total': ('counter', 'SQL statements run by requests.'),
+    'http_requests_in_flight': ('gauge', 'Requests currently being handled.'),
+}
+# Gauges that describe a live process and are dropped when it exits
+LIVE_GAUGES = ('http_requests_in_flight',)
+
+_HEADER = struct.Struct('q')
+_LENGTH = struct.Struct('i')
+_VALUE = struct.Struct('d')
+_INITIAL_SIZE = 64 * 1024
+
+_local = threading.local()
+_free_stores = []
+_store_ids = itertools.count()
+# Stores left over from the parent process belong to it
+os.register_at_fork(after_in_child=_free_stores.clear)
+
+
+def _encode_key(name, labels):
+    return json.dumps([name, sorted(labels.items())], separators=(',', ':'))
+
+
+class MmapStore:
+    def __init__(self, path):
+        self.path = path
+        exists = os.path.exists(path)
+        self._file = open(path, 'r+b' if exists else 'w+b')
+        if not exists or os.path.getsize(path) < _INITIAL_SIZE:
+            self._file.truncate(_INITIAL_SIZE)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._offsets = {}
+        self._used = _HEADER.unpack_from(self._map, 0)[0] or _HEADER.size
+        for key, _, offset in _read_records(self._map):
+            self._offsets[key] = offset
+
+    def _grow(self, needed):
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+        self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def _append(self, key):
+        encoded = key.encode('utf-8')
+        padded = len(encoded) + (-(_LENGTH.size + len(encoded)) % 8)
+        record_size = _LENGTH.size + padded + _VALUE.size
+        if self._used + record_size > len(self._map):
+            self._grow(self._used + record_size)
+        _LENGTH.pack_into(self._map, self._used, len(encoded))
+        start = self._used + _LENGTH.size
+        self._map[start:start + len(encoded)] = encoded
+        offset = start + padded
+        _VALUE.pack_into(self._map, offset, 0.0)
+        self._used += record_size
+        _HEADER.pack_into(self._map, 0, self._used)
+        self._offsets[key] = offset
+        return offset
+
+    def add(self, key, amount):
+        offset = self._offsets.get(key)
+        if offset is None:
+            offset = self._append(key)
+        _VALUE.pack_into(self._map, offset, _VALUE.unpack_from(self._map, offset)[0] + amount)
+
+    def set(self, key, value):
+        offset = self._offsets.get(key)
+        if offset is None:
+            offset = self._append(key)
+        _VALUE.pack_into(self._map, offset, value)
+
+    def keys(self):
+        return list(self._offsets)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+# (key, value, offset) for every complete record in a store's buffer
+def _read_records(buffer):
+    used = _HEADER.unpack_from(buffer, 0)[0]
+    position = _HEADER.size
+    while position < used:
+        length = _LENGTH.unpack_from(buffer, position)[0]
+        start = position + _LENGTH.size
+        key = bytes(buffer[start:start + length]).decode('utf-8')
+        offset = start + length + (-(_LENGTH.size + length) % 8)
+        yield key, _VALUE.unpack_from(buffer, offset)[0], offset
+        position = offset + _VALUE.size
+
+
+class _Slot:
+    def __init__(self, store):
+        self.store = store
+        self.pid = os.getpid()
+
+    # Thread-local values are dropped when their thread exits: hand the store
+    # to the next new thread instead of opening a file per thread
+    def __del__(self):
+        if self.pid == os.getpid():
+            _free_stores.append(self.store)
+
+
+# This thread's store. Each store is only ever written by one thread at a time.
+def _store():
+    slot = getattr(_local, 'slot', None)
+    if slot is None or slot.pid != os.getpid():
+        try:
+            store = _free_stores.pop()
+        except IndexError:
+            directory = current_app.config['METRICS_DIR']
+            os.makedirs(directory, exist_ok=True)
+            store = MmapStore(os.path.join(directory, f'{os.getpid()}_{next(_store_ids)}.db'))
+        slot = _local.slot = _Slot(store)
+    return slot.store
+
+
+def _observe(store, name, labels, value, buckets):
+    for bound in buckets:
+        if value <= bound:
+            break
+    else:
+        bound = '+Inf'
+    store.add(_encode_key(f'{name}_bucket', dict(labels, le=str(bound))), 1)
+    store.add(_encode_key(f'{name}_sum', labels), value)
+    store.add(_encode_key(f'{name}_count', labels), 1)
+
+
+def _endpoint():
+    # Unmatched URLs share one label so scanners cannot blow up the series count
+    return request.endpoint or 'unmatched'
+
+
+def init_app(app):
+    if not app.config['METRICS_ENABLED']:
+        return
+    in_flight = _encode_key('http_requests_in_flight', {})
+
+    @app.before_request
+    def _start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        _store().add(in_flight, 1)
+
+    @app.after_request
+    def _record_request_metrics(response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+        store = _store()
+        endpoint = _endpoint()
+        store.add(_encode_key('http_requests_total', {
+            'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code),
+        }), 1)
+        _observe(store, 'http_request_duration_seconds', {'endpoint': endpoint},
+                 time.perf_counter() - started, DURATION_BUCKETS)
+        sql_stats = g.get('sql_stats')
+        if sql_stats is not None:
+            _observe(store, 'http_request_db_seconds', {'endpoint': endpoint},
+                     sql_stats.duration, DB_BUCKETS)
+            store.add(_encode_key('http_request_db_queries_total', {'endpoint': endpoint}),
+                      sql_stats.count)
+        return response
+
+    @app.teardown_request
+    def _finish_request_metrics(exc):
+        if g.pop('metrics_started', None) is not None:
+            _store().add(in_flight, -1)
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+# Without METRICS_TOKEN the endpoint is only served by debug and testing apps
+def metrics_view():
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        if not (current_app.debug or current_app.testing):
+            abort(403)
+    elif not hmac.compare_digest(request.headers.get('Authorization', '').encode(),
+                                 f'Bearer {token}'.encode()):
+        abort(403)
+    return Response(render(collect(current_app.config['METRICS_DIR'])),
+                    mimetype='text/plain; version=0.0.4')
+
+
+# Sum every process's values: {key: value}
+def collect(directory):
+    totals = {}
+    for path in glob.glob(os.path.join(directory, '*.db')):
+        try:
+            with open(path, 'rb') as f:
+                buffer = f.read()
+        except OSError:
+            continue
+        if len(buffer) < _HEADER.size:
+            continue
+        for key, value, _ in _read_records(buffer):
+            totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+                     for name, value in labels)
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def _bucket_order(bound):
+    return float('inf') if bound == '+Inf' else float(bound)
+
+
+# Prometheus text exposition of collected values
+def render(totals):
+    samples = {}
+    for key, value in totals.items():
+        name, labels = json.loads(key)
+        samples.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for metric, (metric_type, help_text) in METRICS.items():
+        lines.append(f'# HELP {PREFIX}{metric} {help_text}')
+        lines.append(f'# TYPE {PREFIX}{metric} {metric_type}')
+        if metric_type != 'histogram':
+            for labels, value in sorted(samples.get(metric, ())):
+                lines.append(f'{PREFIX}{metric}{_format_labels(labels)} {_format_value(value)}')
+            continue
+
+        # Buckets are stored per interval; Prometheus wants them cumulative
+        buckets = {}
+        for labels, value in samples.get(f'{metric}_bucket', ()):
+            series = tuple((name, v) for name, v in labels if name != 'le')
+            bound = dict(labels)['le']
+            buckets.setdefault(series, {})[bound] = value
+        bounds = [str(b) for b in (DURATION_BUCKETS if metric == 'http_request_duration_seconds'
+                                   else DB_BUCKETS)] + ['+Inf']
+        for series in sorted(buckets):
+            cumulative = 0
+            for bound in sorted(bounds, key=_bucket_order):
+                cumulative += buckets[series].get(bound, 0)
+                labels = list(series) + [('le', bound)]
+                lines.append(f'{PREFIX}{metric}_bucket{_format_labels(labels)} {_format_value(cumulative)}')
+        for suffix in ('_sum', '_count'):
+            for labels, value in sorted(samples.get(metric + suffix, ())):
+                lines.append(f'{PREFIX}{metric}{suffix}{_format_labels(labels)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+# Called by the gunicorn master at startup: forget the previous run's values
+def clear(directory):
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+
+# Called by the gunicorn master when a worker exits. Its counters stay (they
+# remain part of the totals); its live gauges are zeroed.
+def mark_process_dead(pid, directory):
+    for path in glob.glob(os.path.join(directory, f'{pid}_*.db')):
+        store = MmapStore(path)
+        try:
+            for key in store.keys():
+                if json.loads(key)[0] in LIVE_GAUGES:
+                    store.set(key, 0)
+        finally:
+            store.close()
@@ -2,11 +2,13 @@ import jwt
 import os
 from time import time
 from app import db, login
+from app.passwords import hash_password, password_needs_rehash, verify_password
 from datetime import datetime
-from flask import current_app
+from flask import current_app, g, has_app_context
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, inspect
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm.util import identity_key
 
 
 # Timestamp mixin for automatic `created_at` and `updated_at` fields
@@ -17,7 +19,8 @@ class TimestampMixin(object):
 
 @login.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    from app.user_cache import load_user as load_cached_user
+    return load_cached_user(int(user_id))
 
 
 # Association table for user course enrollments
@@ -25,12 +28,22 @@ enrollments = db.Table('enrollments',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
     db.Column('course_id', db.Integer, db.ForeignKey('course.id'), primary_key=True),
     db.Column('enrolled_at', db.DateTime, default=datetime.utcnow),
-    db.Column('completed', db.Boolean, default=False)
+    db.Column('completed', db.Boolean, default=False),
+    db.Column('completed_at', db.DateTime),
+    # The primary key serves user -> courses lookups; this serves course -> users
+    db.Index('ix_enrollments_course_id_user_id', 'course_id', 'user_id'),
+    # Time scans of the analytics rollup job (see app.analytics)
+    db.Index('ix_enrollments_enrolled_at', 'enrolled_at'),
+    db.Index('ix_enrollments_completed_at', 'completed_at')
 )
 
 
 # User class with roles for access control
 class User(db.Model, TimestampMixin, UserMixin):
+    __table_args__ = (
+        db.Index('ix_user_created_at', 'created_at'),
+    )
+
     ROLE_USER = 0
     ROLE_ADMIN = 1
     ROLE_TRAINER = 2
@@ -39,7 +52,7 @@ class User(db.Model, TimestampMixin, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), nullable=False, unique=True)
     email = db.Column(db.String(80), nullable=False, unique=True)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(255))
     first_name = db.Column(db.String(20), nullable=False)
     last_name = db.Column(db.String(20), nullable=False)
     role = db.Column(db.SmallInteger, default=ROLE_USER)  # User roles for access control
@@ -50,7 +63,7 @@ class User(db.Model, TimestampMixin, UserMixin):
     email_confirmed_at = db.Column(db.DateTime)
     
     # Profile fields
-    avatar = db.Column(db.String(100))  # Path to avatar image
+    avatar = db.column_property(db.Column(db.String(100)), active_history=True)  # Blob key (see app.storage)
     bio = db.Column(db.Text)  # User biography
     location = db.Column(db.String(100))  # User location
     website = db.Column(db.String(100))  # User website
@@ -86,12 +99,19 @@ class User(db.Model, TimestampMixin, UserMixin):
     def __repr__(self):
         return f'<User {self.username}>'
 
-    # Password hashing and verification
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+    # Password hashing and verification (see app.passwords). `method` overrides
+    # PASSWORD_HASH_METHOD, e.g. for cheap seed data.
+    def set_password(self, password, method=None):
+        self.password_hash = hash_password(password, method)
 
+    # A correct password stored with outdated hash parameters is rehashed;
+    # the caller commits. Raises HasherBusyError when verification is overloaded.
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if not verify_password(self.password_hash, password):
+            return False
+        if password_needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
 
     # Generate a password reset token
     def get_reset_password_token(self, expires_in=600):
@@ -108,7 +128,7 @@ class User(db.Model, TimestampMixin, UserMixin):
             user_id = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])['reset_password']
         except:
             return None
-        return User.query.get(user_id)
+        return db.session.get(User, user_id)
     
     # Generate an email confirmation token
     def get_confirmation_token(self, expires_in=86400):  # 24 hours
@@ -125,7 +145,7 @@ class User(db.Model, TimestampMixin, UserMixin):
             user_id = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])['confirm_email']
         except:
             return None
-        return User.query.get(user_id)
+        return db.session.get(User, user_id)
     
     # Confirm email
     def confirm_email(self):
@@ -138,12 +158,37 @@ class User(db.Model, TimestampMixin, UserMixin):
         if not self.is_enrolled_in(course):
             self.enrolled_courses.append(course)
             db.session.add(self)
+            cached = self._request_enrollments()
+            if cached is not None:
+                cached.add(course.id)
             return True
         return False
     
-    # Check if enrolled in a course
+    # Check if enrolled in a course, reusing the per-request id set when loaded
     def is_enrolled_in(self, course):
-        return self.enrolled_courses.filter(enrollments.c.course_id == course.id).count() > 0
+        cached = self._request_enrollments()
+        if cached is not None:
+            return course.id in cached
+        return db.session.scalar(db.select(db.exists().where(
+            enrollments.c.user_id == self.id,
+            enrollments.c.course_id == course.id,
+        )))
+    
+    # Ids of all courses the user is enrolled in (one query, cached per request)
+    def enrolled_course_ids(self):
+        cached = self._request_enrollments()
+        if cached is None:
+            cached = set(db.session.scalars(
+                db.select(enrollments.c.course_id).where(enrollments.c.user_id == self.id)
+            ))
+            if has_app_context():
+                g.setdefault('enrolled_course_ids', {})[self.id] = cached
+        return cached
+    
+    def _request_enrollments(self):
+        if not has_app_context():
+            return None
+        return g.get('enrolled_course_ids', {}).get(self.id)
     
     # Get full name
     @hybrid_property
@@ -184,17 +229,34 @@ class Category(db.Model):
 
 # Course model
 class Course(TimestampMixin, db.Model):
+    __table_args__ = (
+        db.Index('ix_course_created_at_id', 'created_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False, unique=True)
     summary = db.Column(db.Text)
     description = db.Column(db.Text)
-    image = db.Column(db.String(100))
+    image = db.column_property(db.Column(db.String(100)), active_history=True)
     price = db.Column(db.Float, default=99.99)
     duration = db.Column(db.Integer)  # Duration in hours
     level = db.Column(db.String(20))  # Beginner, Intermediate, Advanced
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     
+    # Denormalised rating summary, kept current by the Review mapper events below
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    rating_1_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_2_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_3_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_4_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_5_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    # Syllabus totals, kept current by the CourseLesson and CourseModule mapper events below
+    lesson_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    lesson_minutes = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     # Relationships
     reviews = db.relationship('Review', backref='course', lazy='dynamic', cascade="all, delete-orphan")
     modules = db.relationship('CourseModule', backref='course', lazy='dynamic', cascade="all, delete-orphan")
@@ -203,20 +265,86 @@ class Course(TimestampMixin, db.Model):
     def __repr__(self):
         return f'<Course {self.title}>'
     
-    # Calculate average rating
+    # Average rating from the stored summary (no review rows are loaded)
     @hybrid_property
     def average_rating(self):
-        if self.reviews.count() == 0:
+        if not self.rating_count:
             return 0
-        return sum(review.rating for review in self.reviews) / self.reviews.count()
-    
-    # Get total number of lessons
+        return self.rating_sum / self.rating_count
+    
+    # SQL form so listings can sort and filter by rating in the database
+    @average_rating.expression
+    def average_rating(cls):
+        return db.case((cls.rating_count == 0, 0.0), else_=cls.rating_sum / cls.rating_count)
+    
+    # Number of reviews per star, e.g. {1: 0, 2: 1, 3: 4, 4: 10, 5: 7}
+    @property
+    def rating_histogram(self):
+        return {star: getattr(self, f'rating_{star}_count') or 0 for star in Review.STARS}
+    
+    # Recompute the stored rating summary from the review table
+    @classmethod
+    def rebuild_rating_summary(cls, course_ids=None):
+        def review_aggregate(column, *criteria):
+            return db.select(column).where(Review.course_id == cls.id, *criteria).scalar_subquery()
+
+        values = {
+            cls.rating_count: review_aggregate(db.func.count(Review.id)),
+            cls.rating_sum: review_aggregate(db.func.coalesce(db.func.sum(Review.rating), 0.0)),
+        }
+        for star in Review.STARS:
+            values[getattr(cls, f'rating_{star}_count')] = review_aggregate(
+                db.func.count(Review.id), *Review.star_criteria(star))
+
+        stmt = db.update(cls).values(values)
+        if course_ids is not None:
+            stmt = stmt.where(cls.id.in_(course_ids))
+        db.session.execute(stmt.execution_options(synchronize_session=False))
+        db.session.expire_all()
+    
+    # Number of lessons from the stored counter, e.g. Course.total_lessons >= 20
     @hybrid_property
     def total_lessons(self):
-        total = 0
-        for module in self.modules:
-            total += module.lessons.count()
-        return total
+        return self.lesson_count or 0
+    
+    @total_lessons.expression
+    def total_lessons(cls):
+        return cls.lesson_count
+    
+    # Total lesson time in hours, e.g. Course.lesson_hours < 5
+    @hybrid_property
+    def lesson_hours(self):
+        return (self.lesson_minutes or 0) / 60
+    
+    @lesson_hours.expression
+    def lesson_hours(cls):
+        return cls.lesson_minutes / 60.0
+    
+    # Recompute the stored syllabus totals of courses and their modules from the lesson table
+    @classmethod
+    def rebuild_lesson_counters(cls, course_ids=None):
+        module = CourseModule
+        module_values = {
+            module.lesson_count: db.select(db.func.count(CourseLesson.id))
+            .where(CourseLesson.module_id == module.id).scalar_subquery(),
+            module.lesson_minutes: db.select(db.func.coalesce(db.func.sum(CourseLesson.duration), 0))
+            .where(CourseLesson.module_id == module.id).scalar_subquery(),
+        }
+        course_values = {
+            cls.lesson_count: db.select(db.func.coalesce(db.func.sum(module.lesson_count), 0))
+            .where(module.course_id == cls.id).scalar_subquery(),
+            cls.lesson_minutes: db.select(db.func.coalesce(db.func.sum(module.lesson_minutes), 0))
+            .where(module.course_id == cls.id).scalar_subquery(),
+        }
+
+        module_stmt = db.update(module).values(module_values)
+        course_stmt = db.update(cls).values(course_values)
+        if course_ids is not None:
+            module_stmt = module_stmt.where(module.course_id.in_(course_ids))
+            course_stmt = course_stmt.where(cls.id.in_(course_ids))
+        db.session.execute(module_stmt.execution_options(synchronize_session=False))
+        db.session.execute(course_stmt.execution_options(synchronize_session=False))
+        db.session.expire_all()
 
 
 # Course Module model
@@ -225,7 +353,14 @@ class CourseModule(TimestampMixin, db.Model):
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     order = db.Column(db.Integer, nullable=False)  # Order within the course
-    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    
+    # Old value is loaded on change so the totals can be moved between courses
+    course_id = db.column_property(db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False),
+                                   active_history=True)
+    
+    # Totals of the module's lessons, kept current by the CourseLesson mapper events below
+    lesson_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    lesson_minutes = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Relationships
     lessons = db.relationship('CourseLesson', backref='module', lazy='dynamic', cascade="all, delete-orphan")
@@ -233,6 +368,14 @@ class CourseModule(TimestampMixin, db.Model):
     
     def __repr__(self):
         return f'<Module {self.title} for Course {self.course_id}>'
+    
+    @hybrid_property
+    def total_lessons(self):
+        return self.lesson_count or 0
+    
+    @total_lessons.expression
+    def total_lessons(cls):
+        return cls.lesson_count
 
 
 # Course Lesson model
@@ -241,8 +384,11 @@ class CourseLesson(TimestampMixin, db.Model):
     title = db.Column(db.String(100), nullable=False)
     content = db.Column(db.Text)
     order = db.Column(db.Integer, nullable=False)  # Order within the module
-    duration = db.Column(db.Integer)  # Duration in minutes
-    module_id = db.Column(db.Integer, db.ForeignKey('course_module.id'), nullable=False)
+    
+    # Old values are loaded on change so the module and course totals can be adjusted
+    duration = db.column_property(db.Column(db.Integer), active_history=True)  # Duration in minutes
+    module_id = db.column_property(db.Column(db.Integer, db.ForeignKey('course_module.id'), nullable=False),
+                                   active_history=True)
     
     # Relationships
     progress = db.relationship('LessonProgress', backref='lesson', lazy='dynamic')
@@ -251,8 +397,77 @@ class CourseLesson(TimestampMixin, db.Model):
         return f'<Lesson {self.title} for Module {self.module_id}>'
 
 
+# Apply a lesson's contribution (sign=1) or its removal (sign=-1) to its module and course
+def _apply_lesson_delta(connection, session, module_id, duration, sign):
+    if module_id is None:
+        return
+    module = CourseModule.__table__
+    minutes = sign * (duration or 0)
+    connection.execute(
+        module.update()
+        .where(module.c.id == module_id)
+        .values(lesson_count=module.c.lesson_count + sign, lesson_minutes=module.c.lesson_minutes + minutes)
+    )
+    course_id = connection.execute(db.select(module.c.course_id).where(module.c.id == module_id)).scalar()
+    _apply_course_delta(connection, session, course_id, sign, minutes)
+    session.info.setdefault('stale_lesson_modules', set()).add(module_id)
+
+
+def _apply_course_delta(connection, session, course_id, lessons, minutes):
+    if course_id is None:
+        return
+    course = Course.__table__
+    connection.execute(
+        course.update()
+        .where(course.c.id == course_id)
+        .values(lesson_count=course.c.lesson_count + lessons, lesson_minutes=course.c.lesson_minutes + minutes)
+    )
+    session.info.setdefault('stale_lesson_courses', set()).add(course_id)
+
+
+@event.listens_for(CourseLesson, 'after_insert')
+def _lesson_inserted(mapper, connection, target):
+    _apply_lesson_delta(connection, inspect(target).session, target.module_id, target.duration, 1)
+
+
+@event.listens_for(CourseLesson, 'after_update')
+def _lesson_updated(mapper, connection, target):
+    state = inspect(target)
+    old_module_id = _previous_value(state, 'module_id', target.module_id)
+    old_duration = _previous_value(state, 'duration', target.duration)
+    if old_module_id == target.module_id and old_duration == target.duration:
+        return
+    _apply_lesson_delta(connection, state.session, old_module_id, old_duration, -1)
+    _apply_lesson_delta(connection, state.session, target.module_id, target.duration, 1)
+
+
+# Runs before the row disappears so that expired attributes can still be loaded
+@event.listens_for(CourseLesson, 'before_delete')
+def _lesson_deleted(mapper, connection, target):
+    _apply_lesson_delta(connection, inspect(target).session, target.module_id, target.duration, -1)
+
+
+# A module moved to another course takes its lesson totals with it
+@event.listens_for(CourseModule, 'after_update')
+def _module_updated(mapper, connection, target):
+    state = inspect(target)
+    old_course_id = _previous_value(state, 'course_id', target.course_id)
+    if old_course_id == target.course_id:
+        return
+    module = CourseModule.__table__
+    lessons, minutes = connection.execute(
+        db.select(module.c.lesson_count, module.c.lesson_minutes).where(module.c.id == target.id)
+    ).one()
+    _apply_course_delta(connection, state.session, old_course_id, -lessons, -minutes)
+    _apply_course_delta(connection, state.session, target.course_id, lessons, minutes)
+
+
 # Module Progress model
 class ModuleProgress(TimestampMixin, db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'module_id', name='uq_module_progress_user_id_module_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     module_id = db.Column(db.Integer, db.ForeignKey('course_module.id'), nullable=False)
@@ -265,6 +480,10 @@ class ModuleProgress(TimestampMixin, db.Model):
 
 # Lesson Progress model
 class LessonProgress(TimestampMixin, db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'lesson_id', name='uq_lesson_progress_user_id_lesson_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     lesson_id = db.Column(db.Integer, db.ForeignKey('course_lesson.id'), nullable=False)
@@ -277,6 +496,13 @@ class LessonProgress(TimestampMixin, db.Model):
 
 # Payment model
 class Payment(TimestampMixin, db.Model):
+    __table_args__ = (
+        db.Index('ix_payment_created_at', 'created_at'),
+        db.Index('ix_payment_updated_at', 'updated_at'),
+    )
+
+    STATUS_COMPLETED = 'completed'
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
@@ -293,26 +519,52 @@ class Payment(TimestampMixin, db.Model):
         return f'<Payment {self.id} for Course {self.course_id} by User {self.user_id}>'
 
 
-# Certificate model
+# Certificate model (issued by app.certificates)
 class Certificate(TimestampMixin, db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'course_id', name='uq_certificate_user_id_course_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
     issued_date = db.Column(db.DateTime, default=datetime.utcnow)
     certificate_number = db.Column(db.String(50), unique=True)
     verification_code = db.Column(db.String(50), unique=True)
+    # Blob key of the rendered PDF; the PNG preview is stored next to it as `<key>-preview.png`
+    document = db.column_property(db.Column(db.String(100)), active_history=True)
     
     def __repr__(self):
         return f'<Certificate {self.certificate_number} for User {self.user_id}>'
 
 
+# Last certificate serial handed out per year (see app.certificates.allocate_numbers)
+class CertificateCounter(db.Model):
+    __tablename__ = 'certificate_counter'
+
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    last_serial = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CertificateCounter {self.year}: {self.last_serial}>'
+
+
 # Review model
 class Review(TimestampMixin, db.Model):
+    __table_args__ = (
+        db.Index('ix_review_course_id_created_at_id', 'course_id', 'created_at', 'id'),
+        db.Index('ix_review_created_at', 'created_at'),
+    )
+
+    STARS = (1, 2, 3, 4, 5)
+
     id = db.Column(db.Integer, primary_key=True)
     text = db.Column(db.Text)
-    rating = db.Column(db.Float, default=0.0)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    course_id = db.Column(db.Integer, db.ForeignKey('course.id'))
+    
+    # Old values are loaded on change so the course rating summary can be adjusted
+    rating = db.column_property(db.Column(db.Float, default=0.0), active_history=True)
+    course_id = db.column_property(db.Column(db.Integer, db.ForeignKey('course.id')), active_history=True)
 
     def __repr__(self):
         return f'<Review {self.id} for course {self.course_id}>'
@@ -321,9 +573,98 @@ class Review(TimestampMixin, db.Model):
         if not (0.0 <= self.rating <= 5.0):
             raise ValueError('Rating must be between 0 and 5.')
 
+    # Histogram bucket for a rating, rounding half up and clamping to 1-5 stars
+    @staticmethod
+    def star_bucket(rating):
+        return min(5, max(1, int(rating + 0.5)))
+
+    # SQL criteria matching the ratings that fall into a star bucket
+    @classmethod
+    def star_criteria(cls, star):
+        criteria = []
+        if star > 1:
+            criteria.append(cls.rating >= star - 0.5)
+        if star < 5:
+            criteria.append(cls.rating < star + 0.5)
+        return criteria
+
+
+# Apply a review's contribution (sign=1) or its removal (sign=-1) to the course summary
+def _apply_rating_delta(connection, session, course_id, rating, sign):
+    if course_id is None or rating is None:
+        return
+    course = Course.__table__
+    star_count = course.c[f'rating_{Review.star_bucket(rating)}_count']
+    connection.execute(
+        course.update()
+        .where(course.c.id == course_id)
+        .values({
+            course.c.rating_count: course.c.rating_count + sign,
+            course.c.rating_sum: course.c.rating_sum + sign * rating,
+            star_count: star_count + sign,
+        })
+    )
+    session.info.setdefault('stale_rating_courses', set()).add(course_id)
+
+
+# Previous value of a review attribute changed in the current flush
+def _previous_value(state, key, current):
+    history = state.attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    return current
+
+
+@event.listens_for(Review, 'after_insert')
+def _review_inserted(mapper, connection, target):
+    _apply_rating_delta(connection, inspect(target).session, target.course_id, target.rating, 1)
+
+
+@event.listens_for(Review, 'after_update')
+def _review_updated(mapper, connection, target):
+    state = inspect(target)
+    old_course_id = _previous_value(state, 'course_id', target.course_id)
+    old_rating = _previous_value(state, 'rating', target.rating)
+    if old_course_id == target.course_id and old_rating == target.rating:
+        return
+    _apply_rating_delta(connection, state.session, old_course_id, old_rating, -1)
+    _apply_rating_delta(connection, state.session, target.course_id, target.rating, 1)
+
+
+# Runs before the row disappears so that expired attributes can still be loaded
+@event.listens_for(Review, 'before_delete')
+def _review_deleted(mapper, connection, target):
+    _apply_rating_delta(connection, inspect(target).session, target.course_id, target.rating, -1)
+
+
+# Expire in-memory courses whose summary was changed behind the ORM's back
+@event.listens_for(db.session, 'after_flush_postexec')
+def _expire_stale_rating_summaries(session, flush_context):
+    for course_id in session.info.pop('stale_rating_courses', ()):
+        course = session.identity_map.get(identity_key(Course, course_id))
+        if course is not None:
+            session.expire(course, [
+                'rating_count', 'rating_sum',
+                *(f'rating_{star}_count' for star in Review.STARS),
+            ])
+
+
+# Expire in-memory modules and courses whose lesson totals were changed behind the ORM's back
+@event.listens_for(db.session, 'after_flush_postexec')
+def _expire_stale_lesson_counters(session, flush_context):
+    for model, key in ((CourseModule, 'stale_lesson_modules'), (Course, 'stale_lesson_courses')):
+        for obj_id in session.info.pop(key, ()):
+            obj = session.identity_map.get(identity_key(model, obj_id))
+            if obj is not None:
+                session.expire(obj, ['lesson_count', 'lesson_minutes'])
+
 
 # Event model
 class Event(TimestampMixin, db.Model):
+    __table_args__ = (
+        db.Index('ix_event_start_date_id', 'start_date', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
@@ -369,11 +710,15 @@ class ArticleCategory(db.Model):
 
 # Article model
 class Article(TimestampMixin, db.Model):
+    __table_args__ = (
+        db.Index('ix_article_created_at_id', 'created_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
     body = db.Column(db.Text, nullable=False)
     summary = db.Column(db.String(500))
-    image = db.Column(db.String(100))
+    image = db.column_property(db.Column(db.String(100)), active_history=True)
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'))  # User as author
     category_id = db.Column(db.Integer, db.ForeignKey('article_category.id'))
     published = db.Column(db.Boolean, default=False)
@@ -417,7 +762,7 @@ class FAQ(TimestampMixin, db.Model):
 class Sponsor(TimestampMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    logo = db.Column(db.String(100))  # Path to sponsor logo image
+    logo = db.column_property(db.Column(db.String(100)), active_history=True)  # Blob key of the logo
     website = db.Column(db.String(255))
 
     def __repr__(self):
@@ -437,3 +782,129 @@ class TrainerRating(TimestampMixin, db.Model):
 
     def __repr__(self):
         return f'<Rating for Trainer {self.trainer_id}>'
+
+
+
+# Search document: denormalised text of a searchable Article or Course.
+# Maintained by app.search; on PostgreSQL the table also carries a generated
+# tsvector column with a GIN index (see app.search and its migration).
+class SearchDocument(db.Model):
+    __tablename__ = 'search_document'
+    __table_args__ = (
+        db.UniqueConstraint('doc_type', 'doc_id', name='uq_search_document_doc'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    doc_type = db.Column(db.String(20), nullable=False)  # article, course
+    doc_id = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SearchDocument {self.doc_type} {self.doc_id}>'
+
+
+# A stored file, keyed by the SHA-256 of its content. `ref_count` counts the
+# model columns currently holding the key; unreferenced blobs are removed by
+# `flask storage gc` (see app.storage).
+class StoredBlob(db.Model):
+    __tablename__ = 'stored_blob'
+    __table_args__ = (
+        db.Index('ix_stored_blob_ref_count_touched_at', 'ref_count', 'touched_at'),
+    )
+
+    key = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    content_type = db.Column(db.String(100))
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Last upload or reference change; garbage collection waits for a grace period after it
+    touched_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<StoredBlob {self.key[:12]} refs={self.ref_count}>'
+
+
+# Outbox row for an email queued by a request and delivered by `flask mail drain`.
+# The message is rendered at delivery time from `template` (see app.email).
+class OutboundEmail(TimestampMixin, db.Model):
+    __tablename__ = 'outbound_email'
+    __table_args__ = (
+        db.Index('ix_outbound_email_status_available_at', 'status', 'available_at', 'id'),
+    )
+
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    template = db.Column(db.String(50), nullable=False)
+    recipient = db.Column(db.String(120), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
+    params = db.Column(db.JSON)
+    status = db.Column(db.String(20), nullable=False, default=STATUS_PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claim_token = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    sent_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    user = db.relationship('User')
+
+    def __repr__(self):
+        return f'<OutboundEmail {self.id} {self.template} {self.status}>'
+
+
+# Hourly and daily payment totals per course, currency and status, kept by
+# `flask analytics rollup` (see app.analytics)
+class RevenueRollup(db.Model):
+    __tablename__ = 'revenue_rollup'
+    __table_args__ = (
+        db.Index('ix_revenue_rollup_period_bucket', 'period', 'bucket'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(4), nullable=False)  # hour or day
+    bucket = db.Column(db.DateTime, nullable=False)  # Start of the hour or day (UTC)
+    course_id = db.Column(db.Integer)
+    currency = db.Column(db.String(3))
+    status = db.Column(db.String(20))
+    payments = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f'<RevenueRollup {self.period} {self.bucket} course {self.course_id} {self.currency} {self.status}>'
+
+
+# Hourly and daily event counts (signups, enrollments, completions, reviews),
+# per course where the event has one, kept by `flask analytics rollup`
+class ActivityRollup(db.Model):
+    __tablename__ = 'activity_rollup'
+    __table_args__ = (
+        db.Index('ix_activity_rollup_period_metric_bucket', 'period', 'metric', 'bucket'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(4), nullable=False)
+    bucket = db.Column(db.DateTime, nullable=False)
+    metric = db.Column(db.String(20), nullable=False)
+    course_id = db.Column(db.Integer)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ActivityRollup {self.metric} {self.period} {self.bucket} course {self.course_id}>'
+
+
+# How far each rollup source has been processed: rows changed since
+# `processed_until` are aggregated on the next run
+class RollupWatermark(db.Model):
+    __tablename__ = 'rollup_watermark'
+
+    source = db.Column(db.String(30), primary_key=True)
+    processed_until = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<RollupWatermark {self.source} {self.processed_until}>'
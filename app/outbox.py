@@ -0,0 +1,157 @@
+"""Delivery of the database-backed email outbox.
+
+Requests only insert ``OutboundEmail`` rows (see ``app.email.queue_email``).
+``flask mail drain`` runs this module in its own process: it claims a batch of
+due rows with ``FOR UPDATE SKIP LOCKED`` (so several drainers never share a
+row), renders and sends them over one SMTP connection, and marks each row sent
+with an UPDATE conditional on its claim token. A row whose drainer died is
+reclaimed once its lease (``OUTBOX_LEASE`` seconds) runs out, unless it has
+already been claimed ``OUTBOX_MAX_ATTEMPTS`` times: an email that keeps
+crashing or hanging its drainer is marked failed instead.
+"""
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.orm import joinedload
+from app import db
+from app.email import OUTBOX_TEMPLATES, build_message, mail_request_context
+from app.mailer import MailStats, PooledConnection, is_transient_error
+from app.models import OutboundEmail
+
+
+# Claim up to `batch_size` due emails for this drainer and commit the claim
+def claim_batch(batch_size):
+    now = datetime.utcnow()
+    lease_expired = now - timedelta(seconds=current_app.config['OUTBOX_LEASE'])
+    max_attempts = current_app.config['OUTBOX_MAX_ATTEMPTS']
+    db.session.execute(
+        db.update(OutboundEmail)
+        .where(OutboundEmail.status == OutboundEmail.STATUS_SENDING,
+               OutboundEmail.claimed_at < lease_expired,
+               OutboundEmail.attempts >= max_attempts)
+        .values(status=OutboundEmail.STATUS_FAILED, claim_token=None,
+                last_error=f'Lease expired after {max_attempts} attempts')
+    )
+    ids = db.session.execute(
+        db.select(OutboundEmail.id)
+        .where(db.or_(
+            db.and_(OutboundEmail.status == OutboundEmail.STATUS_PENDING,
+                    OutboundEmail.available_at <= now),
+            db.and_(OutboundEmail.status == OutboundEmail.STATUS_SENDING,
+                    OutboundEmail.claimed_at < lease_expired,
+                    OutboundEmail.attempts < max_attempts),
+        ))
+        .order_by(OutboundEmail.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not ids:
+        db.session.commit()
+        return None, []
+
+    token = uuid.uuid4().hex
+    db.session.execute(
+        db.update(OutboundEmail)
+        .where(OutboundEmail.id.in_(ids))
+        .values(status=OutboundEmail.STATUS_SENDING, claim_token=token, claimed_at=now,
+                attempts=OutboundEmail.attempts + 1)
+    )
+    db.session.commit()
+    emails = db.session.execute(
+        db.select(OutboundEmail)
+        .options(joinedload(OutboundEmail.user))
+        .where(OutboundEmail.id.in_(ids), OutboundEmail.claim_token == token)
+        .order_by(OutboundEmail.id)
+    ).scalars().all()
+    return token, emails
+
+
+# Update a claimed row only if this drainer still holds the claim
+def _finish(email_id, token, **values):
+    result = db.session.execute(
+        db.update(OutboundEmail)
+        .where(OutboundEmail.id == email_id, OutboundEmail.claim_token == token,
+               OutboundEmail.status == OutboundEmail.STATUS_SENDING)
+        .values(claim_token=None, **values)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _fail(email_id, attempts, token, error):
+    if is_transient_error(error) and attempts < current_app.config['OUTBOX_MAX_ATTEMPTS']:
+        delay = current_app.config['OUTBOX_RETRY_BACKOFF'] * 2 ** (attempts - 1)
+        _finish(email_id, token, status=OutboundEmail.STATUS_PENDING, last_error=str(error),
+                available_at=datetime.utcnow() + timedelta(seconds=delay))
+        return 'retried'
+    _finish(email_id, token, status=OutboundEmail.STATUS_FAILED, last_error=str(error))
+    return 'failed'
+
+
+def _render(email):
+    render = OUTBOX_TEMPLATES.get(email.template)
+    if render is None:
+        raise LookupError(f'Unknown outbox template {email.template!r}')
+    if email.user_id is not None and email.user is None:
+        raise LookupError(f'User {email.user_id} no longer exists')
+    subject, text_body, html_body = render(email)
+    return build_message(subject, [email.recipient], text_body, html_body)
+
+
+# Render a claimed batch up front (the per-row commits below expire the
+# instances), then send it through a single SMTP connection
+def deliver_batch(token, emails, connection):
+    counts = {'sent': 0, 'retried': 0, 'failed': 0}
+    rendered = []
+    with mail_request_context():
+        for email in emails:
+            try:
+                rendered.append((email.id, email.attempts, _render(email)))
+            except Exception as error:
+                current_app.logger.exception('Could not render outbound email %s', email.id)
+                rendered.append((email.id, email.attempts, error))
+
+    for email_id, attempts, msg in rendered:
+        if isinstance(msg, Exception):
+            _finish(email_id, token, status=OutboundEmail.STATUS_FAILED, last_error=str(msg))
+            counts['failed'] += 1
+            continue
+        try:
+            connection.send(msg)
+        except Exception as error:
+            connection.close()
+            current_app.logger.warning('Sending outbound email %s failed: %s', email_id, error)
+            counts[_fail(email_id, attempts, token, error)] += 1
+            continue
+        if _finish(email_id, token, status=OutboundEmail.STATUS_SENT, sent_at=datetime.utcnow(),
+                   last_error=None):
+            counts['sent'] += 1
+        else:
+            current_app.logger.warning('Outbound email %s was reclaimed while being sent', email_id)
+    return counts
+
+
+# Deliver due emails until none are left (or forever with `once=False`)
+def drain(batch_size=None, interval=None, once=True, report=None):
+    batch_size = batch_size or current_app.config['OUTBOX_BATCH_SIZE']
+    interval = current_app.config['OUTBOX_POLL_INTERVAL'] if interval is None else interval
+    connection = PooledConnection(MailStats())
+    totals = {'sent': 0, 'retried': 0, 'failed': 0}
+    try:
+        while True:
+            token, emails = claim_batch(batch_size)
+            if emails:
+                counts = deliver_batch(token, emails, connection)
+                for key, value in counts.items():
+                    totals[key] += value
+                if report:
+                    report(counts)
+                continue
+            if once:
+                return totals
+            # Nothing due: release the SMTP connection while idle
+            connection.close()
+            time.sleep(interval)
+    finally:
+        connection.close()
@@ -0,0 +1,118 @@
+"""Keyset (cursor) pagination shared by the listing blueprints.
+
+Pages are selected with a row comparison on the ordering columns instead of
+OFFSET, so with a matching composite index every page costs the same as the
+first one. Cursors are opaque URL-safe tokens holding the sort key of the
+boundary row and the direction to move in.
+"""
+import base64
+import json
+from datetime import date, datetime
+from flask import abort
+from app import db
+
+
+class KeysetPage:
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    # Same page with its items transformed, e.g. into template view objects
+    def map(self, func):
+        return KeysetPage([func(item) for item in self.items], self.per_page,
+                          self.next_cursor, self.prev_cursor)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if isinstance(value.get('dt'), str):
+            return datetime.fromisoformat(value['dt'])
+        if isinstance(value.get('d'), str):
+            return date.fromisoformat(value['d'])
+        raise ValueError('Unknown cursor value')
+    if value is not None and not isinstance(value, (str, int, float)):
+        raise ValueError('Unknown cursor value')
+    return value
+
+
+def encode_cursor(values, direction='next'):
+    payload = json.dumps({'k': [_encode_value(v) for v in values], 'd': direction},
+                         separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).rstrip(b'=').decode()
+
+
+# Raises ValueError for anything encode_cursor could not have produced
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    if not isinstance(payload, dict) or not isinstance(payload.get('k'), list):
+        raise ValueError('Malformed cursor')
+    if payload.get('d') not in ('next', 'prev'):
+        raise ValueError('Unknown cursor direction')
+    return [_decode_value(v) for v in payload['k']], payload['d']
+
+
+# Fetch one page of `query` ordered by `columns` (ending with a unique column such
+# as the primary key). Pass the cursor taken from a previous page to move on.
+def paginate_keyset(query, columns, cursor=None, per_page=10, descending=False):
+    columns = list(columns)
+    direction = 'next'
+    if cursor:
+        try:
+            values, direction = decode_cursor(cursor)
+        except ValueError:
+            abort(400)
+        if len(values) != len(columns):
+            abort(400)
+        # Walking backwards flips the comparison and the ordering
+        before = descending == (direction == 'next')
+        boundary = db.tuple_(*columns)
+        keys = db.tuple_(*values)
+        query = query.filter(boundary < keys if before else boundary > keys)
+
+    reverse = descending != (direction == 'prev')
+    query = query.order_by(*[column.desc() if reverse else column.asc() for column in columns])
+    rows = query.limit(per_page + 1).all()
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+
+    def cursor_for(row, towards):
+        return encode_cursor([getattr(row, column.key) for column in columns], towards)
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if more or direction == 'prev':
+            next_cursor = cursor_for(rows[-1], 'next')
+        if cursor and (more or direction == 'next'):
+            prev_cursor = cursor_for(rows[0], 'prev')
+    return KeysetPage(rows, per_page, next_cursor, prev_cursor)
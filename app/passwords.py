@@ -0,0 +1,120 @@
+"""Password hashing with per-environment cost and rehash on login.
+
+``PASSWORD_HASH_METHOD`` is any method understood by werkzeug
+(``scrypt:32768:8:1``, ``pbkdf2:sha256:600000``...). TestingConfig uses a
+single PBKDF2 iteration so tests and benchmarks of other code are not
+dominated by the KDF.
+
+Hashing and verification run in a small thread pool per process
+(``PASSWORD_HASH_WORKERS``; hashlib releases the GIL), so a burst of logins
+cannot tie up every request thread of a worker. At most
+``PASSWORD_HASH_MAX_PENDING`` verifications may wait for the pool; beyond
+that ``verify`` raises ``HasherBusyError`` after ``PASSWORD_HASH_QUEUE_TIMEOUT``
+seconds instead of queueing without bound.
+
+Stored hashes made with other parameters still verify, and
+``User.check_password`` replaces them with a hash made with the current
+parameters when the password is correct.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, has_app_context
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HasherBusyError(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, app=None):
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._methods = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['password_hasher'] = self
+
+    @property
+    def config(self):
+        return current_app.config
+
+    # One pool per process, created on first use (after gunicorn has forked)
+    def _pool(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    workers = self.config['PASSWORD_HASH_WORKERS']
+                    self._executor = ThreadPoolExecutor(max_workers=workers,
+                                                        thread_name_prefix='password-hash')
+                    self._slots = threading.BoundedSemaphore(
+                        workers + self.config['PASSWORD_HASH_MAX_PENDING'])
+                    self._pid = os.getpid()
+        return self._executor, self._slots
+
+    def _run(self, timeout, fn, *args, **kwargs):
+        executor, slots = self._pool()
+        if not slots.acquire(timeout=timeout):
+            raise HasherBusyError('Too many password checks in progress')
+        try:
+            future = executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(lambda f: slots.release())
+        return future.result()
+
+    # New hashes wait for the pool however long it takes: they follow a
+    # registration or password change, not an anonymous login attempt
+    def hash(self, password, method=None):
+        return self._run(None, generate_password_hash, password,
+                         method=method or self.config['PASSWORD_HASH_METHOD'],
+                         salt_length=self.config['PASSWORD_SALT_LENGTH'])
+
+    # Raises HasherBusyError if the pool stays saturated for PASSWORD_HASH_QUEUE_TIMEOUT
+    def verify(self, pwhash, password):
+        if not pwhash:
+            return False
+        return self._run(self.config['PASSWORD_HASH_QUEUE_TIMEOUT'],
+                         check_password_hash, pwhash, password)
+
+    # The method as werkzeug writes it into hashes, e.g. 'scrypt' -> 'scrypt:32768:8:1'
+    def _full_method(self, method):
+        if method not in self._methods:
+            sample = generate_password_hash('', method=method, salt_length=1)
+            self._methods[method] = sample.split('$', 1)[0]
+        return self._methods[method]
+
+    # Whether `pwhash` was made with other parameters than the configured ones
+    def needs_rehash(self, pwhash):
+        method, _, rest = pwhash.partition('$')
+        salt = rest.partition('$')[0]
+        return method != self._full_method(self.config['PASSWORD_HASH_METHOD']) or \
+            len(salt) != self.config['PASSWORD_SALT_LENGTH']
+
+
+hasher = PasswordHasher()
+
+
+# Outside an app (e.g. ad-hoc scripts) hashing falls back to werkzeug's defaults
+def hash_password(password, method=None):
+    if has_app_context() and 'password_hasher' in current_app.extensions:
+        return hasher.hash(password, method)
+    return generate_password_hash(password, method=method or 'scrypt')
+
+
+def verify_password(pwhash, password):
+    if has_app_context() and 'password_hasher' in current_app.extensions:
+        return hasher.verify(pwhash, password)
+    return bool(pwhash) and check_password_hash(pwhash, password)
+
+
+def password_needs_rehash(pwhash):
+    if has_app_context() and 'password_hasher' in current_app.extensions:
+        return hasher.needs_rehash(pwhash)
+    return False
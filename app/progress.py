@@ -0,0 +1,281 @@
+"""Course progress: completion percentages, lesson completion and heartbeats.
+
+Percent complete is computed in SQL for any number of (user, course)
+enrollments at once: one grouped query counts each user's completed
+lessons against the course's stored lesson count, whatever the number of
+users, courses, modules or lessons involved.
+
+Completing a lesson rolls up incrementally. The lesson's module is marked
+complete once all of its lessons are, and the enrollment once all of the
+course's modules are. Only the counts for that one module and course are
+checked, never the whole syllabus.
+
+Heartbeats (a user is looking at a lesson) only move ``last_accessed``.
+They are coalesced in memory per (user, lesson) and written by a background
+thread every ``PROGRESS_FLUSH_INTERVAL`` seconds, or sooner once
+``PROGRESS_BUFFER_SIZE`` distinct pairs are waiting, as one bulk upsert
+instead of an UPDATE per page view. Heartbeats still buffered when a
+process dies are lost; they are only access times. So are beats for
+lessons or users deleted before the flush, and a batch that fails for any
+reason other than a database outage (``OperationalError``).
+"""
+import atexit
+import logging
+import os
+import threading
+from datetime import datetime
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.models import Course, CourseLesson, CourseModule, LessonProgress, ModuleProgress, User, enrollments
+
+logger = logging.getLogger(__name__)
+
+
+class CourseProgress:
+    def __init__(self, user_id, course_id, total_lessons, completed_lessons):
+        self.user_id = user_id
+        self.course_id = course_id
+        self.total_lessons = total_lessons
+        self.completed_lessons = completed_lessons
+
+    @property
+    def percent(self):
+        if not self.total_lessons:
+            return 0
+        return round(100 * self.completed_lessons / self.total_lessons)
+
+    @property
+    def is_complete(self):
+        return bool(self.total_lessons) and self.completed_lessons >= self.total_lessons
+
+    def __repr__(self):
+        return f'<CourseProgress user {self.user_id} course {self.course_id} {self.percent}%>'
+
+
+# Progress of every enrollment matching the filters, in one grouped query
+def _progress_rows(user_ids=None, course_ids=None):
+    completed = (
+        db.select(LessonProgress.user_id, CourseModule.course_id,
+                  db.func.count(LessonProgress.id).label('done'))
+        .join(CourseLesson, CourseLesson.id == LessonProgress.lesson_id)
+        .join(CourseModule, CourseModule.id == CourseLesson.module_id)
+        .where(LessonProgress.completed.is_(True))
+        .group_by(LessonProgress.user_id, CourseModule.course_id)
+    )
+    if user_ids is not None:
+        completed = completed.where(LessonProgress.user_id.in_(user_ids))
+    if course_ids is not None:
+        completed = completed.where(CourseModule.course_id.in_(course_ids))
+    completed = completed.subquery()
+
+    query = (
+        db.select(enrollments.c.user_id, enrollments.c.course_id, Course.lesson_count,
+                  db.func.coalesce(completed.c.done, 0))
+        .join(Course, Course.id == enrollments.c.course_id)
+        .outerjoin(completed, db.and_(completed.c.user_id == enrollments.c.user_id,
+                                      completed.c.course_id == enrollments.c.course_id))
+    )
+    if user_ids is not None:
+        query = query.where(enrollments.c.user_id.in_(user_ids))
+    if course_ids is not None:
+        query = query.where(enrollments.c.course_id.in_(course_ids))
+    return [CourseProgress(*row) for row in db.session.execute(query)]
+
+
+# {course_id: CourseProgress} for one user's enrollments (optionally only `course_ids`)
+def course_progress(user_id, course_ids=None):
+    return {progress.course_id: progress
+            for progress in _progress_rows(user_ids=[user_id], course_ids=course_ids)}
+
+
+# {user_id: CourseProgress} for everyone enrolled in a course (optionally only `user_ids`)
+def course_progress_for_users(course_id, user_ids=None):
+    return {progress.user_id: progress
+            for progress in _progress_rows(user_ids=user_ids, course_ids=[course_id])}
+
+
+# Ids of the lessons of a course the user has completed
+def completed_lesson_ids(user_id, course_id):
+    return set(db.session.scalars(
+        db.select(LessonProgress.lesson_id)
+        .join(CourseLesson, CourseLesson.id == LessonProgress.lesson_id)
+        .join(CourseModule, CourseModule.id == CourseLesson.module_id)
+        .where(LessonProgress.user_id == user_id, CourseModule.course_id == course_id,
+               LessonProgress.completed.is_(True))
+    ))
+
+
+# INSERT ... ON CONFLICT (keys) DO UPDATE SET `update` (column -> value or
+# 'excluded' to take the inserted value), on PostgreSQL and SQLite
+def _upsert(model, rows, keys, update):
+    if not rows:
+        return
+    dialect = db.session.get_bind(mapper=db.inspect(model)).dialect.name
+    if dialect not in ('postgresql', 'sqlite'):
+        raise NotImplementedError(f'No upsert for {dialect}')
+    insert = (postgresql if dialect == 'postgresql' else sqlite).insert(model.__table__).values(rows)
+    values = {column: insert.excluded[column] if value == 'excluded' else value
+              for column, value in update.items()}
+    db.session.execute(insert.on_conflict_do_update(index_elements=keys, set_=values))
+
+
+# Mark a lesson complete for a user and roll the completion up to its module
+# and course. Returns the user's CourseProgress for that course. The caller commits.
+def complete_lesson(user_id, lesson_id):
+    now = datetime.utcnow()
+    module_id, course_id = db.session.execute(
+        db.select(CourseLesson.module_id, CourseModule.course_id)
+        .join(CourseModule, CourseModule.id == CourseLesson.module_id)
+        .where(CourseLesson.id == lesson_id)
+    ).one()
+
+    _upsert(LessonProgress, [{'user_id': user_id, 'lesson_id': lesson_id, 'completed': True,
+                              'last_accessed': now, 'created_at': now}],
+            ['user_id', 'lesson_id'], {'completed': True, 'last_accessed': now, 'updated_at': now})
+
+    # Module: are all of its lessons done?
+    lessons_total, lessons_done = db.session.execute(
+        db.select(db.func.count(CourseLesson.id), db.func.count(LessonProgress.id))
+        .outerjoin(LessonProgress, db.and_(LessonProgress.lesson_id == CourseLesson.id,
+                                           LessonProgress.user_id == user_id,
+                                           LessonProgress.completed.is_(True)))
+        .where(CourseLesson.module_id == module_id)
+    ).one()
+    module_done = lessons_done >= lessons_total
+    _upsert(ModuleProgress, [{'user_id': user_id, 'module_id': module_id, 'completed': module_done,
+                              'last_accessed': now, 'created_at': now}],
+            ['user_id', 'module_id'], {'completed': module_done, 'last_accessed': now, 'updated_at': now})
+
+    # Course: are all of its modules done?
+    if module_done:
+        modules_total, modules_done = db.session.execute(
+            db.select(db.func.count(CourseModule.id), db.func.count(ModuleProgress.id))
+            .outerjoin(ModuleProgress, db.and_(ModuleProgress.module_id == CourseModule.id,
+                                               ModuleProgress.user_id == user_id,
+                                               ModuleProgress.completed.is_(True)))
+            .where(CourseModule.course_id == course_id)
+        ).one()
+        if modules_done >= modules_total:
+            db.session.execute(
+                enrollments.update()
+                .where(enrollments.c.user_id == user_id, enrollments.c.course_id == course_id,
+                       enrollments.c.completed_at.is_(None))
+                .values(completed=True, completed_at=now)
+            )
+
+    return course_progress(user_id, [course_id]).get(course_id)
+
+
+class HeartbeatBuffer:
+    def __init__(self, app=None):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['progress_heartbeats'] = self
+        self.app = app
+        self.flush_interval = app.config.get('PROGRESS_FLUSH_INTERVAL', 10)
+        self.buffer_size = app.config.get('PROGRESS_BUFFER_SIZE', 5000)
+
+    # Flusher thread per process, started on first use (after gunicorn has forked)
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Heartbeats copied from a parent process are the parent's to write
+            self._pending = {}
+            threading.Thread(target=self._run, name='progress-flusher', daemon=True).start()
+            self._pid = os.getpid()
+            atexit.register(self.flush)
+
+    # Note that `user_id` is looking at `lesson_id`. Later beats for the same
+    # pair replace earlier ones until the next flush.
+    def record(self, user_id, lesson_id, at=None):
+        self._ensure_started()
+        with self._lock:
+            self._pending[(user_id, lesson_id)] = at or datetime.utcnow()
+            full = len(self._pending) >= self.buffer_size
+        if full:
+            self._wakeup.set()
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing progress heartbeats failed')
+
+    # Write all buffered heartbeats in one transaction. Returns the number written.
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        with self.app.app_context():
+            try:
+                written = self._write(pending)
+                db.session.commit()
+            except OperationalError:
+                db.session.rollback()
+                # The database is unavailable: keep them for the next attempt,
+                # unless newer beats arrived meanwhile
+                with self._lock:
+                    for key, at in pending.items():
+                        self._pending.setdefault(key, at)
+                raise
+            except Exception:
+                # Anything else would fail again on every retry
+                db.session.rollback()
+                raise
+            finally:
+                db.session.remove()
+        return written
+
+    # Upsert the beats of lessons and users that still exist; returns their number
+    def _write(self, pending):
+        lesson_ids = {lesson_id for _, lesson_id in pending}
+        module_of = dict(db.session.execute(
+            db.select(CourseLesson.id, CourseLesson.module_id).where(CourseLesson.id.in_(lesson_ids))
+        ).all())
+        user_ids = set(db.session.scalars(
+            db.select(User.id).where(User.id.in_({user_id for user_id, _ in pending}))
+        ))
+        pending = {(user_id, lesson_id): at for (user_id, lesson_id), at in pending.items()
+                   if lesson_id in module_of and user_id in user_ids}
+        if not pending:
+            return 0
+
+        now = datetime.utcnow()
+        _upsert(LessonProgress, [
+            {'user_id': user_id, 'lesson_id': lesson_id, 'completed': False,
+             'last_accessed': at, 'created_at': now}
+            for (user_id, lesson_id), at in pending.items()
+        ], ['user_id', 'lesson_id'], {'last_accessed': 'excluded'})
+
+        # Modules were accessed when their latest lesson was
+        modules = {}
+        for (user_id, lesson_id), at in pending.items():
+            key = (user_id, module_of[lesson_id])
+            modules[key] = max(at, modules.get(key, at))
+        _upsert(ModuleProgress, [
+            {'user_id': user_id, 'module_id': module_id, 'completed': False,
+             'last_accessed': at, 'created_at': now}
+            for (user_id, module_id), at in modules.items()
+        ], ['user_id', 'module_id'], {'last_accessed': 'excluded'})
+        return len(pending)
+
+
+heartbeats = HeartbeatBuffer()
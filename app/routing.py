@@ -0,0 +1,192 @@
+"""Read replica routing for the shared ``db.session``.
+
+Queries are sent to a replica (one of ``SQLALCHEMY_REPLICA_URIS``, picked per
+request) when the request is a GET/HEAD to one of ``REPLICA_BLUEPRINTS`` or the
+view is decorated with ``@read_only``. Everything else goes to the primary:
+flushes, DML and ``FOR UPDATE`` statements, every query after the request has
+written, and every request from a browser that wrote within the last
+``DB_REPLICA_STICKY_SECONDS`` (read-your-writes, tracked in the session
+cookie).
+
+A replica that fails to connect is skipped for ``DB_REPLICA_RETRY_AFTER``
+seconds and its requests fall back to the primary. A query that fails on a
+replica mid-request (lost connection, conflict with recovery, schema behind) is
+rolled back and run again on the primary, as is the rest of the request, unless
+the session holds unflushed changes that a rollback would discard.
+"""
+import os
+import random
+import threading
+import time
+import weakref
+from functools import wraps
+from flask import current_app, g, has_request_context, request, session as http_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+REPLICA_BLUEPRINTS = frozenset(('main', 'courses', 'articles', 'events'))
+PRIMARY_UNTIL = '_db_primary_until'
+
+# Replica sets of every app in this process
+_replica_sets = weakref.WeakSet()
+
+
+# Mark a view as safe to serve from a replica whatever its method or blueprint
+def read_only(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class Replica:
+    def __init__(self, engine):
+        self.engine = engine
+        self.down_until = 0
+        self.checked_at = 0
+        self._lock = threading.Lock()
+
+    def mark_down(self, retry_after):
+        self.down_until = time.monotonic() + retry_after
+
+    # Up unless marked down; probed with a checkout at most every `check_interval` seconds
+    def is_available(self, check_interval, retry_after):
+        now = time.monotonic()
+        if now < self.down_until:
+            return False
+        with self._lock:
+            if now - self.checked_at < check_interval:
+                return True
+            self.checked_at = now
+        try:
+            with self.engine.connect():
+                pass
+        except DBAPIError:
+            self.mark_down(retry_after)
+            return False
+        return True
+
+
+class ReplicaSet:
+    def __init__(self, uris, engine_options, check_interval=5, retry_after=30):
+        self.replicas = [Replica(create_engine(uri, **engine_options)) for uri in uris]
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        for replica in self.replicas:
+            event.listen(replica.engine, 'handle_error', self._error_handler(replica))
+
+    # Lost or refused connections take the replica out of rotation; any
+    # failure sends the rest of the request to the primary
+    def _error_handler(self, replica):
+        def handle_error(context):
+            if context.is_disconnect or context.connection is None:
+                replica.mark_down(self.retry_after)
+            if has_request_context():
+                g.db_replica_failed = True
+        return handle_error
+
+    # A random available replica's engine, or None to use the primary
+    def choose(self):
+        candidates = list(self.replicas)
+        random.shuffle(candidates)
+        for replica in candidates:
+            if replica.is_available(self.check_interval, self.retry_after):
+                return replica.engine
+        return None
+
+    def dispose(self, close=True):
+        for replica in self.replicas:
+            replica.engine.dispose(close=close)
+
+
+def _request_allows_replica():
+    if not has_request_context() or g.get('db_primary'):
+        return False
+    if not g.get('db_read_only') and (request.method not in ('GET', 'HEAD')
+                                      or request.blueprint not in REPLICA_BLUEPRINTS):
+        return False
+    return http_session.get(PRIMARY_UNTIL, 0) < time.time()
+
+
+def _writes(clause):
+    return clause is not None and (
+        getattr(clause, 'is_dml', False) or getattr(clause, '_for_update_arg', None) is not None
+    )
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not _writes(clause) and _request_allows_replica():
+            if 'db_replica' not in g:
+                replicas = current_app.extensions.get('db_replicas')
+                g.db_replica = replicas.choose() if replicas else None
+            if g.db_replica is not None:
+                return g.db_replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _with_primary_fallback(self, method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except OperationalError:
+            if not has_request_context() or not g.pop('db_replica_failed', False) \
+                    or self.new or self.dirty or self.deleted:
+                raise
+        self.rollback()
+        g.db_primary = True
+        return method(*args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        return self._with_primary_fallback(super().execute, *args, **kwargs)
+
+    def scalars(self, *args, **kwargs):
+        return self._with_primary_fallback(super().scalars, *args, **kwargs)
+
+    def scalar(self, *args, **kwargs):
+        return self._with_primary_fallback(super().scalar, *args, **kwargs)
+
+
+# Once this request has written, the rest of it reads from the primary too
+def _stick_to_primary(session, flush_context):
+    session.info['db_wrote'] = True
+    if has_request_context():
+        g.db_primary = True
+
+
+# ...and so do this browser's requests for the next few seconds
+def _remember_write(session):
+    if session.info.pop('db_wrote', False) and has_request_context() \
+            and 'db_replicas' in current_app.extensions:
+        http_session[PRIMARY_UNTIL] = time.time() + current_app.config['DB_REPLICA_STICKY_SECONDS']
+
+
+def _forget_write(session):
+    session.info.pop('db_wrote', None)
+
+
+# Replica connections inherited across a fork are dropped, as for the primary
+def _reset_after_fork():
+    for replicas in list(_replica_sets):
+        replicas.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def init_app(app):
+    from app import db
+    uris = app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+    if not uris:
+        return
+    replicas = ReplicaSet(uris, app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+                          check_interval=app.config['DB_REPLICA_CHECK_INTERVAL'],
+                          retry_after=app.config['DB_REPLICA_RETRY_AFTER'])
+    app.extensions['db_replicas'] = replicas
+    _replica_sets.add(replicas)
+
+    # The session events are shared by every app using `db`
+    if not event.contains(db.session, 'after_flush', _stick_to_primary):
+        event.listen(db.session, 'after_flush', _stick_to_primary)
+        event.listen(db.session, 'after_commit', _remember_write)
+        event.listen(db.session, 'after_rollback', _forget_write)
@@ -0,0 +1,366 @@
+"""Full-text search over articles and courses.
+
+Searchable rows are copied into the ``search_document`` table by mapper
+events, in the same transaction that writes them. On PostgreSQL that table
+has a generated, weighted tsvector column with a GIN index and queries run in
+the database. Other engines (SQLite in tests) use an in-process inverted index
+that is built from the table on first use and kept current on commit.
+"""
+import math
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime
+from threading import Lock
+from flask import current_app, has_app_context
+from sqlalchemy import DDL, event, inspect
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import Article, Course, SearchDocument
+
+
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is',
+    'it', 'of', 'on', 'or', 'that', 'the', 'to', 'with',
+))
+
+# PostgreSQL keeps a weighted tsvector (title = A, body = B) next to the text
+event.listen(SearchDocument.__table__, 'after_create', DDL(
+    "ALTER TABLE search_document ADD COLUMN tsv tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(body, '')), 'B')) STORED"
+).execute_if(dialect='postgresql'))
+event.listen(SearchDocument.__table__, 'after_create', DDL(
+    "CREATE INDEX ix_search_document_tsv ON search_document USING gin (tsv)"
+).execute_if(dialect='postgresql'))
+
+
+def tokenize(text):
+    return [token for token in re.findall(r'\w+', (text or '').lower()) if token not in STOP_WORDS]
+
+
+# Document builders return (title, body), or None when the row must not be searchable
+def _article_document(article):
+    if not article.published:
+        return None
+    return article.title, '\n'.join(filter(None, (article.summary, article.body)))
+
+
+def _course_document(course):
+    return course.title, '\n'.join(filter(None, (course.summary, course.description)))
+
+
+SEARCHABLE = {
+    Article: ('article', _article_document, ('title', 'summary', 'body', 'published')),
+    Course: ('course', _course_document, ('title', 'summary', 'description')),
+}
+MODELS = {doc_type: model for model, (doc_type, _, _) in SEARCHABLE.items()}
+
+# Relationships the result templates use, loaded together with the hits
+EAGER_LOADS = {
+    Article: 'author',
+    Course: 'category',
+}
+
+
+# Replace the search document of `target` using the flush connection
+def _sync_document(connection, target, deleted=False):
+    doc_type, build, _ = SEARCHABLE[type(target)]
+    document = None if deleted else build(target)
+    table = SearchDocument.__table__
+    connection.execute(
+        table.delete().where(table.c.doc_type == doc_type, table.c.doc_id == target.id)
+    )
+    if document is not None:
+        title, body = document
+        connection.execute(table.insert().values(
+            doc_type=doc_type, doc_id=target.id, title=title[:255], body=body,
+            updated_at=datetime.utcnow(),
+        ))
+    session = inspect(target).session
+    if session is not None:
+        session.info.setdefault('search_changes', []).append((doc_type, target.id, document))
+
+
+def _document_inserted(mapper, connection, target):
+    _sync_document(connection, target)
+
+
+def _document_updated(mapper, connection, target):
+    fields = SEARCHABLE[type(target)][2]
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in fields):
+        _sync_document(connection, target)
+
+
+def _document_deleted(mapper, connection, target):
+    _sync_document(connection, target, deleted=True)
+
+
+for _model in SEARCHABLE:
+    event.listen(_model, 'after_insert', _document_inserted)
+    event.listen(_model, 'after_update', _document_updated)
+    event.listen(_model, 'after_delete', _document_deleted)
+
+
+# Committed changes are applied to this process's in-memory index, if built
+@event.listens_for(db.session, 'after_commit')
+def _apply_committed_changes(session):
+    changes = session.info.pop('search_changes', None)
+    if not changes or not has_app_context():
+        return
+    index = current_app.extensions.get('search_index')
+    if index is None:
+        return
+    for doc_type, doc_id, document in changes:
+        if document is None:
+            index.remove(doc_type, doc_id)
+        else:
+            index.add(doc_type, doc_id, *document)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('search_changes', None)
+
+
+# In-process inverted index used when PostgreSQL full-text search is unavailable
+class MemoryIndex:
+    FIELD_WEIGHTS = (1.0, 0.4)  # title, body (mirrors tsvector weights A and B)
+    PREFIX_FACTOR = 0.8  # score factor for terms matched only by prefix
+
+    def __init__(self):
+        self._lock = Lock()
+        self._postings = defaultdict(dict)  # term -> {doc key: weighted frequency}
+        self._doc_terms = {}  # doc key -> set of terms
+        self._doc_lengths = {}
+        self._sorted_terms = None
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def add(self, doc_type, doc_id, title, body):
+        key = (doc_type, doc_id)
+        weights = defaultdict(float)
+        length = 0
+        for text, weight in zip((title, body), self.FIELD_WEIGHTS):
+            tokens = tokenize(text)
+            length += len(tokens)
+            for token in tokens:
+                weights[token] += weight
+        with self._lock:
+            self._remove(key)
+            for term, weight in weights.items():
+                self._postings[term][key] = weight
+            self._doc_terms[key] = set(weights)
+            self._doc_lengths[key] = length
+            self._sorted_terms = None
+
+    def remove(self, doc_type, doc_id):
+        with self._lock:
+            self._remove((doc_type, doc_id))
+
+    def _remove(self, key):
+        for term in self._doc_terms.pop(key, ()):
+            postings = self._postings[term]
+            postings.pop(key, None)
+            if not postings:
+                del self._postings[term]
+                self._sorted_terms = None
+        self._doc_lengths.pop(key, None)
+
+    # Index terms equal to or starting with `term`, with their score factor
+    def _expand(self, term):
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self._postings)
+        expansions = []
+        position = bisect_left(self._sorted_terms, term)
+        while position < len(self._sorted_terms) and self._sorted_terms[position].startswith(term):
+            candidate = self._sorted_terms[position]
+            expansions.append((candidate, 1.0 if candidate == term else self.PREFIX_FACTOR))
+            position += 1
+        return expansions
+
+    # Ranked (score, (doc_type, doc_id)) pairs of documents matching every term
+    def search(self, terms, doc_types=None):
+        with self._lock:
+            total_docs = len(self._doc_terms) or 1
+            scores = None
+            for term in terms:
+                term_scores = defaultdict(float)
+                for candidate, factor in self._expand(term):
+                    postings = self._postings[candidate]
+                    idf = math.log(1 + total_docs / len(postings))
+                    for key, weight in postings.items():
+                        term_scores[key] += factor * weight * idf
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {key: score + term_scores[key] for key, score in scores.items() if key in term_scores}
+                if not scores:
+                    return []
+            ranked = [
+                (score / (1 + math.log(1 + self._doc_lengths[key])), key)
+                for key, score in scores.items()
+                if doc_types is None or key[0] in doc_types
+            ]
+        ranked.sort(key=lambda item: (-item[0], item[1][0], -item[1][1]))
+        return ranked
+
+
+class SearchHit:
+    def __init__(self, doc_type, doc_id, title, score):
+        self.doc_type = doc_type
+        self.doc_id = doc_id
+        self.title = title
+        self.score = score
+        self.obj = None
+
+    def __repr__(self):
+        return f'<SearchHit {self.doc_type} {self.doc_id} {self.score:.3f}>'
+
+
+class SearchResults:
+    def __init__(self, query, hits, total, page, per_page):
+        self.query = query
+        self.hits = hits
+        self.total = total
+        self.page = page
+        self.per_page = per_page
+
+    @property
+    def pages(self):
+        return max(1, math.ceil(self.total / self.per_page))
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def has_next(self):
+        return self.page < self.pages
+
+    @property
+    def prev_num(self):
+        return self.page - 1 if self.has_prev else None
+
+    @property
+    def next_num(self):
+        return self.page + 1 if self.has_next else None
+
+    # Loaded model instances of the hits, in rank order
+    @property
+    def objects(self):
+        return [hit.obj for hit in self.hits if hit.obj is not None]
+
+    def __iter__(self):
+        return iter(self.hits)
+
+    def __len__(self):
+        return len(self.hits)
+
+
+def _backend():
+    backend = current_app.config.get('SEARCH_BACKEND') or 'auto'
+    if backend == 'auto':
+        return 'postgresql' if db.engine.dialect.name == 'postgresql' else 'memory'
+    return backend
+
+
+# The process-wide memory index, built from search_document on first use
+def get_memory_index():
+    index = current_app.extensions.get('search_index')
+    if index is None:
+        index = MemoryIndex()
+        rows = db.session.execute(
+            db.select(SearchDocument.doc_type, SearchDocument.doc_id, SearchDocument.title, SearchDocument.body)
+            .execution_options(yield_per=1000)
+        )
+        for doc_type, doc_id, title, body in rows:
+            index.add(doc_type, doc_id, title, body)
+        current_app.extensions['search_index'] = index
+    return index
+
+
+def _search_postgresql(terms, doc_types, offset, limit):
+    tsv = db.literal_column('search_document.tsv')
+    tsquery = db.func.to_tsquery('english', ' & '.join(f'{term}:*' for term in terms))
+    rank = db.func.ts_rank_cd(tsv, tsquery)
+    stmt = db.select(SearchDocument.doc_type, SearchDocument.doc_id, SearchDocument.title, rank.label('rank')) \
+        .where(tsv.op('@@')(tsquery))
+    if doc_types:
+        stmt = stmt.where(SearchDocument.doc_type.in_(doc_types))
+    total = db.session.scalar(db.select(db.func.count()).select_from(stmt.subquery()))
+    rows = db.session.execute(
+        stmt.order_by(rank.desc(), SearchDocument.doc_id.desc()).offset(offset).limit(limit)
+    )
+    return [SearchHit(*row) for row in rows], total
+
+
+def _search_memory(terms, doc_types, offset, limit):
+    ranked = get_memory_index().search(terms, doc_types)
+    page = ranked[offset:offset + limit]
+    titles = {}
+    if page:
+        rows = db.session.execute(
+            db.select(SearchDocument.doc_type, SearchDocument.doc_id, SearchDocument.title)
+            .where(db.tuple_(SearchDocument.doc_type, SearchDocument.doc_id).in_([key for _, key in page]))
+        )
+        titles = {(doc_type, doc_id): title for doc_type, doc_id, title in rows}
+    return [SearchHit(key[0], key[1], titles.get(key), score) for score, key in page], len(ranked)
+
+
+# Load the model instance behind every hit with one query per document type
+def _attach_objects(hits):
+    by_type = defaultdict(list)
+    for hit in hits:
+        by_type[hit.doc_type].append(hit)
+    for doc_type, typed_hits in by_type.items():
+        model = MODELS[doc_type]
+        query = model.query.options(joinedload(getattr(model, EAGER_LOADS[model]))) \
+            .filter(model.id.in_([hit.doc_id for hit in typed_hits]))
+        objects = {obj.id: obj for obj in query}
+        for hit in typed_hits:
+            hit.obj = objects.get(hit.doc_id)
+
+
+# Ranked, paged search. Every query word must match, either exactly or as a prefix.
+def search(query, doc_types=None, page=1, per_page=10):
+    page = max(1, page)
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return SearchResults(query, [], 0, page, per_page)
+    doc_types = tuple(doc_types) if doc_types else None
+    offset = (page - 1) * per_page
+    if _backend() == 'postgresql':
+        hits, total = _search_postgresql(terms, doc_types, offset, per_page)
+    else:
+        hits, total = _search_memory(terms, doc_types, offset, per_page)
+    _attach_objects(hits)
+    return SearchResults(query, hits, total, page, per_page)
+
+
+# Rebuild search_document from the source tables, e.g. after a bulk import
+def reindex(batch_size=500):
+    table = SearchDocument.__table__
+    db.session.execute(table.delete())
+    indexed = 0
+    for model, (doc_type, build, _) in SEARCHABLE.items():
+        batch = []
+        for obj in model.query.order_by(model.id).yield_per(batch_size):
+            document = build(obj)
+            if document is None:
+                continue
+            title, body = document
+            batch.append({'doc_type': doc_type, 'doc_id': obj.id, 'title': title[:255],
+                          'body': body, 'updated_at': datetime.utcnow()})
+            if len(batch) >= batch_size:
+                db.session.execute(table.insert(), batch)
+                indexed += len(batch)
+                batch = []
+        if batch:
+            db.session.execute(table.insert(), batch)
+            indexed += len(batch)
+    db.session.commit()
+    current_app.extensions.pop('search_index', None)
+    return indexed
@@ -0,0 +1,330 @@
+"""Content-addressed storage for uploaded files.
+
+Every stored file is a blob keyed by the SHA-256 of its content, so uploading
+the same bytes twice stores them once. Models keep the key in an ordinary
+string column (see ``BLOB_REFERENCES``). Each ``StoredBlob`` row counts the
+references to it, and the count is kept up to date as those columns change.
+``flask storage gc`` deletes blobs nobody references any more, together with
+files derived from them (``<key>-<suffix>``, e.g. avatar variants).
+
+Backends are selected with ``STORAGE_BACKEND``:
+
+* ``local`` - files under ``UPLOAD_FOLDER/blobs``, served by ``main.uploaded_file``
+* ``s3`` - an S3-compatible bucket such as MinIO (requires ``boto3``)
+"""
+import glob
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from flask import current_app, url_for
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Article, Certificate, Course, Sponsor, StoredBlob, User
+
+CHUNK_SIZE = 64 * 1024
+BLOB_KEY = re.compile(r'^[0-9a-f]{64}$')
+
+# Columns holding blob keys. Other values (legacy static paths) are left alone.
+BLOB_REFERENCES = {
+    User: ('avatar',),
+    Course: ('image',),
+    Certificate: ('document',),
+    Article: ('image',),
+    Sponsor: ('logo',),
+}
+
+
+def is_blob_key(value):
+    return isinstance(value, str) and BLOB_KEY.match(value) is not None
+
+
+# Copy `stream` to a temporary file chunk by chunk, hashing as it goes.
+# Returns (hex digest, size, temporary path); the caller removes the file.
+def spool(stream, directory=None):
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.upload')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return digest.hexdigest(), size, tmp_path
+
+
+class LocalStorage:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, key, source_path, content_type=None):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp{os.getpid()}'
+        shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, path)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    # Local path of the blob's content; `fetch` for S3 downloads to a temporary file
+    def fetch(self, key):
+        return self.path(key), False
+
+    # Delete a blob and every file derived from it
+    def delete(self, key):
+        for path in glob.glob(self.path(key) + '*'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def url(self, key):
+        return url_for('main.uploaded_file', filename=f'blobs/{key[:2]}/{key}')
+
+
+class S3Storage:
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None,
+                 access_key=None, secret_key=None, public_url=None, url_expiry=3600):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.public_url = public_url
+        self.url_expiry = url_expiry
+        self._client = None
+
+    # The boto3 client is created lazily so the backend can be pickled into pool workers
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_client'] = None
+        return state
+
+    @property
+    def client(self):
+        if self._client is None:
+            try:
+                import boto3
+            except ImportError as err:
+                raise RuntimeError('STORAGE_BACKEND=s3 requires the boto3 package') from err
+            self._client = boto3.client(
+                's3', endpoint_url=self.endpoint_url, region_name=self.region,
+                aws_access_key_id=self.access_key, aws_secret_access_key=self.secret_key,
+            )
+        return self._client
+
+    def _object_key(self, key):
+        return f'{self.prefix}{key}'
+
+    def put(self, key, source_path, content_type=None):
+        extra = {'CacheControl': 'public, max-age=31536000, immutable'}
+        if content_type:
+            extra['ContentType'] = content_type
+        self.client.upload_file(source_path, self.bucket, self._object_key(key), ExtraArgs=extra)
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError:
+            return False
+        return True
+
+    def fetch(self, key):
+        fd, tmp_path = tempfile.mkstemp(prefix='.blob')
+        os.close(fd)
+        self.client.download_file(self.bucket, self._object_key(key), tmp_path)
+        return tmp_path, True
+
+    def delete(self, key):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._object_key(key)):
+            objects = [{'Key': item['Key']} for item in page.get('Contents', ())]
+            if objects:
+                self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': objects})
+
+    def url(self, key):
+        if self.public_url:
+            return f'{self.public_url.rstrip("/")}/{self._object_key(key)}'
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self._object_key(key)},
+            ExpiresIn=self.url_expiry,
+        )
+
+
+class Storage:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend_name = app.config.get('STORAGE_BACKEND', 'local')
+        if backend_name == 'local':
+            backend = LocalStorage(os.path.join(app.config['UPLOAD_FOLDER'], 'blobs'))
+        elif backend_name == 's3':
+            backend = S3Storage(
+                app.config['STORAGE_S3_BUCKET'],
+                prefix=app.config.get('STORAGE_S3_PREFIX', ''),
+                endpoint_url=app.config.get('STORAGE_S3_ENDPOINT_URL'),
+                region=app.config.get('STORAGE_S3_REGION'),
+                access_key=app.config.get('STORAGE_S3_ACCESS_KEY'),
+                secret_key=app.config.get('STORAGE_S3_SECRET_KEY'),
+                public_url=app.config.get('STORAGE_S3_PUBLIC_URL'),
+            )
+        else:
+            raise ValueError(f'Unknown STORAGE_BACKEND {backend_name!r}')
+        app.extensions['storage'] = backend
+        app.jinja_env.globals['file_url'] = file_url
+
+    @property
+    def backend(self):
+        return current_app.extensions['storage']
+
+    # Store the content of `stream` and return its key. `validate`, if given, is
+    # called with the spooled file's path before anything is stored; it may raise
+    # to reject the file or return the content type to record.
+    # The blob starts unreferenced; assigning its key to a column in
+    # BLOB_REFERENCES counts the reference when the session flushes.
+    def store(self, stream, content_type=None, validate=None):
+        key, size, tmp_path = spool(stream)
+        try:
+            if validate is not None:
+                content_type = validate(tmp_path) or content_type
+            blob = db.session.get(StoredBlob, key)
+            if blob is not None and self.backend.exists(key):
+                # Already stored: keep it out of the GC grace window
+                blob.touched_at = datetime.utcnow()
+                return key
+            self.backend.put(key, tmp_path, content_type)
+        finally:
+            os.remove(tmp_path)
+
+        if blob is None:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(StoredBlob(key=key, size=size, content_type=content_type))
+            except IntegrityError:
+                # Stored concurrently by another request
+                pass
+        return key
+
+    def url(self, key, suffix=None):
+        return self.backend.url(f'{key}-{suffix}' if suffix else key)
+
+
+storage = Storage()
+
+BLOB_PATH = re.compile(r'^blobs/[0-9a-f]{2}/([0-9a-f]{64})(-[\w.]+)?$')
+
+
+# Resolve a path under UPLOAD_FOLDER requested from main.uploaded_file to
+# (path, mimetype, immutable). Blob files never change once written. A derived
+# file that is not there yet (e.g. an avatar variant still being rendered)
+# falls back to the original blob, which must not be cached under that URL.
+def resolve_upload(filename):
+    match = BLOB_PATH.match(filename)
+    if match is None:
+        return filename, None, False
+    key, suffix = match.groups()
+    if suffix and os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], filename)):
+        return filename, None, True
+    blob = db.session.get(StoredBlob, key)
+    return f'blobs/{key[:2]}/{key}', blob.content_type if blob else None, not suffix
+
+
+# URL for a file column: a blob key, or a legacy path under the static folder
+def file_url(value, suffix=None):
+    if is_blob_key(value):
+        return storage.url(value, suffix)
+    return url_for('static', filename=value)
+
+
+# Load the referencing columns of objects about to be deleted, so their old
+# values are known when the flush has run
+@event.listens_for(db.session, 'before_flush')
+def _load_deleted_references(session, flush_context, instances):
+    for obj in session.deleted:
+        for attr in BLOB_REFERENCES.get(type(obj), ()):
+            getattr(obj, attr)
+
+
+def _column_changes(obj, attrs):
+    state = inspect(obj)
+    for attr in attrs:
+        history = state.attrs[attr].history
+        for value in history.added:
+            yield value, 1
+        for value in history.deleted:
+            yield value, -1
+
+
+# Adjust reference counts for blob keys written to or removed from
+# BLOB_REFERENCES columns in this flush
+@event.listens_for(db.session, 'after_flush')
+def _count_blob_references(session, flush_context):
+    deltas = {}
+    for obj in (*session.new, *session.dirty):
+        attrs = BLOB_REFERENCES.get(type(obj))
+        if attrs:
+            for value, delta in _column_changes(obj, attrs):
+                if is_blob_key(value):
+                    deltas[value] = deltas.get(value, 0) + delta
+    for obj in session.deleted:
+        for attr in BLOB_REFERENCES.get(type(obj), ()):
+            value = inspect(obj).attrs[attr].loaded_value
+            if is_blob_key(value):
+                deltas[value] = deltas.get(value, 0) - 1
+
+    connection = session.connection()
+    table = StoredBlob.__table__
+    for key, delta in deltas.items():
+        if delta:
+            connection.execute(
+                table.update()
+                .where(table.c.key == key)
+                .values(ref_count=table.c.ref_count + delta, touched_at=datetime.utcnow())
+            )
+
+
+# Delete blobs that have been unreferenced for longer than `grace` seconds.
+# Returns the number of blobs removed.
+def collect_garbage(grace=None, batch_size=500):
+    grace = current_app.config['STORAGE_GC_GRACE'] if grace is None else grace
+    cutoff = datetime.utcnow() - timedelta(seconds=grace)
+    removed = 0
+    while True:
+        keys = db.session.execute(
+            db.select(StoredBlob.key)
+            .where(StoredBlob.ref_count <= 0, StoredBlob.touched_at < cutoff)
+            .limit(batch_size)
+        ).scalars().all()
+        if not keys:
+            return removed
+        for key in keys:
+            # Only delete the files if the row was still unreferenced when deleted
+            result = db.session.execute(
+                db.delete(StoredBlob)
+                .where(StoredBlob.key == key, StoredBlob.ref_count <= 0,
+                       StoredBlob.touched_at < cutoff)
+            )
+            db.session.commit()
+            if result.rowcount:
+                storage.backend.delete(key)
+                removed += 1
+        if len(keys) < batch_size:
+            return removed
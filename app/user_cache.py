@@ -0,0 +1,55 @@
+"""Short-lived per-worker cache of logged-in users for Flask-Login.
+
+``load_user`` runs on every authenticated request. Instead of a primary key
+query each time, the user's column values are kept for ``USER_CACHE_TTL``
+seconds and rebuilt into a detached instance that is merged into the session
+without touching the database. Routes that change a user call
+``invalidate_user`` after committing; other workers see the change once their
+copy expires.
+"""
+from flask import current_app
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from app import db
+from app.cache import LRUCache
+from app.models import User
+
+
+def init_app(app):
+    app.extensions['user_cache'] = LRUCache(threshold=app.config.get('USER_CACHE_SIZE', 1000),
+                                            default_timeout=app.config.get('USER_CACHE_TTL', 30))
+
+
+def _store():
+    if not current_app.config.get('USER_CACHE_TTL'):
+        return None
+    return current_app.extensions.get('user_cache')
+
+
+def _column_keys():
+    return [prop.key for prop in inspect(User).column_attrs]
+
+
+def load_user(user_id):
+    store = _store()
+    if store is None:
+        return db.session.get(User, user_id)
+
+    values = store.get(user_id)
+    if values is None:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            store.set(user_id, {key: getattr(user, key) for key in _column_keys()})
+        return user
+
+    user = User()
+    for key, value in values.items():
+        setattr(user, key, value)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def invalidate_user(user_id):
+    store = _store()
+    if store is not None:
+        store.delete(user_id)
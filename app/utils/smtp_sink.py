@@ -0,0 +1,161 @@
+"""Local SMTP server that accepts and records mail without delivering it.
+
+Used as a stand-in mail server in tests and development::
+
+    with SMTPSink() as sink:
+        app.config.update(MAIL_SERVER=sink.host, MAIL_PORT=sink.port, MAIL_USE_TLS=False)
+        ...
+        assert sink.messages[0].recipients == ['user@example.com']
+
+``fail_next`` makes the next N deliveries fail with a temporary 451 reply, to
+exercise retries. Run ``python -m app.utils.smtp_sink [port]`` to print
+incoming mail to the console.
+"""
+import socketserver
+import sys
+import threading
+from email import message_from_bytes
+from email.policy import default as default_policy
+
+
+class SinkMessage:
+    def __init__(self, sender, recipients, data):
+        self.sender = sender
+        self.recipients = recipients
+        self.data = data
+        self.message = message_from_bytes(data, policy=default_policy)
+
+    @property
+    def subject(self):
+        return self.message['Subject']
+
+    def __repr__(self):
+        return f'<SinkMessage {self.subject!r} to {self.recipients}>'
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        sink = self.server.sink
+        sink._record_connection()
+        self.reply('220 scrumjet-sink ready')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, argument = line.decode(errors='replace').strip().partition(' ')
+            command = command.upper()
+            if command in ('HELO', 'EHLO'):
+                self.reply('250 scrumjet-sink')
+            elif command == 'MAIL':
+                sender, recipients = _address(argument), []
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                recipients.append(_address(argument))
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = self._read_data()
+                if sink._take_failure():
+                    self.reply('451 Temporary failure, try again later')
+                else:
+                    sink._record(SinkMessage(sender, recipients, data))
+                    self.reply('250 OK queued')
+                sender, recipients = None, []
+            elif command == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif command == 'NOOP':
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+    def _read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b'.\r\n', b'.\n'):
+                break
+            # Undo dot-stuffing
+            lines.append(line[1:] if line.startswith(b'..') else line)
+        return b''.join(lines)
+
+
+def _address(argument):
+    _, _, address = argument.partition(':')
+    return address.strip().split(' ')[0].strip('<>')
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+    def __init__(self, host='127.0.0.1', port=0, fail_next=0):
+        self.host = host
+        self.messages = []
+        self.connections = 0
+        self.fail_next = fail_next
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _SMTPHandler)
+        self._server.sink = self
+        self.port = self._server.server_address[1]
+        self._thread = None
+
+    def _record_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def _record(self, message):
+        with self._lock:
+            self.messages.append(message)
+
+    def _take_failure(self):
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return True
+            return False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def clear(self):
+        with self._lock:
+            self.messages = []
+            self.connections = 0
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 1025
+
+    class _ConsoleSink(SMTPSink):
+        def _record(self, message):
+            super()._record(message)
+            print(f'{message.sender} -> {", ".join(message.recipients)}: {message.subject}', flush=True)
+
+    sink = _ConsoleSink(port=port)
+    print(f'SMTP sink listening on {sink.host}:{sink.port}', flush=True)
+    try:
+        sink._server.serve_forever()
+    except KeyboardInterrupt:
+        sink.stop()
@@ -0,0 +1,26 @@
+# Gunicorn settings. Each worker process has its own SQLAlchemy pool of
+# DB_POOL_SIZE + DB_MAX_OVERFLOW connections, so keep
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) below the database's max_connections
+# (or enable DB_PGBOUNCER and let PgBouncer do the pooling).
+import os
+import tempfile
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', '2'))
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+# Workers inherit the app from the master; app.database resets the pool in each child
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() in ['true', 'on', '1']
+
+# Request metrics are shared between workers through files in METRICS_DIR (see app.metrics)
+metrics_dir = os.environ.get('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'scrumjet-metrics')
+
+
+def on_starting(server):
+    from app.metrics import clear
+    clear(metrics_dir)
+
+
+def child_exit(server, worker):
+    from app.metrics import mark_process_dead
+    mark_process_dead(worker.pid, metrics_dir)
@@ -0,0 +1,32 @@
+"""Widen user.password_hash for scrypt hashes
+
+Revision ID: 2b8f6d1c4e07
+Revises: e7a4c2b9d813
+Create Date: 2026-10-18 16:41:09.215733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b8f6d1c4e07'
+down_revision = 'e7a4c2b9d813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password_hash',
+               existing_type=sa.String(length=128),
+               type_=sa.String(length=255),
+               existing_nullable=True)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password_hash',
+               existing_type=sa.String(length=255),
+               type_=sa.String(length=128),
+               existing_nullable=True)
@@ -0,0 +1,54 @@
+"""Add denormalised rating summary to course
+
+Revision ID: 3f6b2a9c1e4d
+Revises: 1d4e70c653e9
+Create Date: 2026-10-18 09:12:41.204318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6b2a9c1e4d'
+down_revision = '1d4e70c653e9'
+branch_labels = None
+depends_on = None
+
+
+STAR_CONDITIONS = {
+    1: 'rating < 1.5',
+    2: 'rating >= 1.5 AND rating < 2.5',
+    3: 'rating >= 2.5 AND rating < 3.5',
+    4: 'rating >= 3.5 AND rating < 4.5',
+    5: 'rating >= 4.5',
+}
+
+
+def upgrade():
+    with op.batch_alter_table('course', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('rating_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('rating_sum', sa.Float(), server_default='0', nullable=False))
+        for star in STAR_CONDITIONS:
+            batch_op.add_column(sa.Column(f'rating_{star}_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill the summary from existing reviews
+    star_counts = ', '.join(
+        f'rating_{star}_count = (SELECT count(*) FROM review '
+        f'WHERE review.course_id = course.id AND {condition})'
+        for star, condition in STAR_CONDITIONS.items()
+    )
+    op.execute(
+        'UPDATE course SET '
+        'rating_count = (SELECT count(*) FROM review WHERE review.course_id = course.id), '
+        'rating_sum = (SELECT coalesce(sum(rating), 0) FROM review WHERE review.course_id = course.id), '
+        f'{star_counts}'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('course', schema=None) as batch_op:
+        for star in reversed(list(STAR_CONDITIONS)):
+            batch_op.drop_column(f'rating_{star}_count')
+        batch_op.drop_column('rating_sum')
+        batch_op.drop_column('rating_count')
@@ -0,0 +1,45 @@
+"""Add stored lesson counts and minutes to course and course_module
+
+Revision ID: 5a7c9e1d3f48
+Revises: 9d3e5f7a1b26
+Create Date: 2026-10-18 18:27:05.661942
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a7c9e1d3f48'
+down_revision = '9d3e5f7a1b26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('course_module', 'course'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('lesson_count', sa.Integer(), server_default='0', nullable=False))
+            batch_op.add_column(sa.Column('lesson_minutes', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill from existing lessons
+    op.execute(
+        'UPDATE course_module SET '
+        'lesson_count = (SELECT count(*) FROM course_lesson WHERE course_lesson.module_id = course_module.id), '
+        'lesson_minutes = (SELECT coalesce(sum(duration), 0) FROM course_lesson '
+        'WHERE course_lesson.module_id = course_module.id)'
+    )
+    op.execute(
+        'UPDATE course SET '
+        'lesson_count = (SELECT coalesce(sum(lesson_count), 0) FROM course_module '
+        'WHERE course_module.course_id = course.id), '
+        'lesson_minutes = (SELECT coalesce(sum(lesson_minutes), 0) FROM course_module '
+        'WHERE course_module.course_id = course.id)'
+    )
+
+
+def downgrade():
+    for table in ('course', 'course_module'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('lesson_minutes')
+            batch_op.drop_column('lesson_count')
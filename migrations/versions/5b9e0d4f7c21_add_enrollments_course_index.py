@@ -0,0 +1,26 @@
+"""Add course-first index on enrollments
+
+Revision ID: 5b9e0d4f7c21
+Revises: c41e7b3d2a55
+Create Date: 2026-10-18 12:41:52.306117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b9e0d4f7c21'
+down_revision = 'c41e7b3d2a55'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.create_index('ix_enrollments_course_id_user_id', ['course_id', 'user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.drop_index('ix_enrollments_course_id_user_id')
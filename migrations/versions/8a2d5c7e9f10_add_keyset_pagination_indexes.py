@@ -0,0 +1,44 @@
+"""Add composite indexes for keyset pagination
+
+Revision ID: 8a2d5c7e9f10
+Revises: 3f6b2a9c1e4d
+Create Date: 2026-10-18 10:03:27.518840
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a2d5c7e9f10'
+down_revision = '3f6b2a9c1e4d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('article', schema=None) as batch_op:
+        batch_op.create_index('ix_article_created_at_id', ['created_at', 'id'], unique=False)
+
+    with op.batch_alter_table('course', schema=None) as batch_op:
+        batch_op.create_index('ix_course_created_at_id', ['created_at', 'id'], unique=False)
+
+    with op.batch_alter_table('event', schema=None) as batch_op:
+        batch_op.create_index('ix_event_start_date_id', ['start_date', 'id'], unique=False)
+
+    with op.batch_alter_table('review', schema=None) as batch_op:
+        batch_op.create_index('ix_review_course_id_created_at_id', ['course_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('review', schema=None) as batch_op:
+        batch_op.drop_index('ix_review_course_id_created_at_id')
+
+    with op.batch_alter_table('event', schema=None) as batch_op:
+        batch_op.drop_index('ix_event_start_date_id')
+
+    with op.batch_alter_table('course', schema=None) as batch_op:
+        batch_op.drop_index('ix_course_created_at_id')
+
+    with op.batch_alter_table('article', schema=None) as batch_op:
+        batch_op.drop_index('ix_article_created_at_id')
@@ -0,0 +1,44 @@
+"""One progress row per user and module/lesson
+
+Revision ID: 9d3e5f7a1b26
+Revises: 2b8f6d1c4e07
+Create Date: 2026-10-18 17:52:30.104418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3e5f7a1b26'
+down_revision = '2b8f6d1c4e07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the oldest row of any duplicates, completed if any of them was
+    for table, column in (('lesson_progress', 'lesson_id'), ('module_progress', 'module_id')):
+        op.execute(
+            f"UPDATE {table} SET completed = true WHERE id IN ("
+            f"SELECT MIN(id) FROM {table} GROUP BY user_id, {column} "
+            f"HAVING COUNT(*) > 1 AND MAX(CASE WHEN completed THEN 1 ELSE 0 END) = 1)"
+        )
+        op.execute(
+            f"DELETE FROM {table} WHERE id NOT IN ("
+            f"SELECT MIN(id) FROM {table} GROUP BY user_id, {column})"
+        )
+
+    with op.batch_alter_table('lesson_progress', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_lesson_progress_user_id_lesson_id', ['user_id', 'lesson_id'])
+
+    with op.batch_alter_table('module_progress', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_module_progress_user_id_module_id', ['user_id', 'module_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('module_progress', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_module_progress_user_id_module_id', type_='unique')
+
+    with op.batch_alter_table('lesson_progress', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_lesson_progress_user_id_lesson_id', type_='unique')
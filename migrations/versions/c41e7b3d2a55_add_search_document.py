@@ -0,0 +1,53 @@
+"""Add search_document table for full-text search
+
+Revision ID: c41e7b3d2a55
+Revises: 8a2d5c7e9f10
+Create Date: 2026-10-18 11:20:05.913472
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41e7b3d2a55'
+down_revision = '8a2d5c7e9f10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('search_document',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('doc_type', sa.String(length=20), nullable=False),
+    sa.Column('doc_id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=255), nullable=False),
+    sa.Column('body', sa.Text(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('doc_type', 'doc_id', name='uq_search_document_doc')
+    )
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "ALTER TABLE search_document ADD COLUMN tsv tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(body, '')), 'B')) STORED"
+        )
+        op.execute("CREATE INDEX ix_search_document_tsv ON search_document USING gin (tsv)")
+
+    # Backfill from existing published articles and courses
+    op.execute(
+        "INSERT INTO search_document (doc_type, doc_id, title, body, updated_at) "
+        "SELECT 'article', id, title, coalesce(summary, '') || ' ' || body, CURRENT_TIMESTAMP "
+        "FROM article WHERE published"
+    )
+    op.execute(
+        "INSERT INTO search_document (doc_type, doc_id, title, body, updated_at) "
+        "SELECT 'course', id, title, coalesce(summary, '') || ' ' || coalesce(description, ''), CURRENT_TIMESTAMP "
+        "FROM course"
+    )
+
+
+def downgrade():
+    op.drop_table('search_document')
@@ -0,0 +1,94 @@
+"""Add analytics rollup tables and enrollment completion time
+
+Revision ID: c8e2f4a6b913
+Revises: 5a7c9e1d3f48
+Create Date: 2026-10-18 19:40:12.873016
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8e2f4a6b913'
+down_revision = '5a7c9e1d3f48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('revenue_rollup',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('period', sa.String(length=4), nullable=False),
+    sa.Column('bucket', sa.DateTime(), nullable=False),
+    sa.Column('course_id', sa.Integer(), nullable=True),
+    sa.Column('currency', sa.String(length=3), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    sa.Column('payments', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('revenue_rollup', schema=None) as batch_op:
+        batch_op.create_index('ix_revenue_rollup_period_bucket', ['period', 'bucket'], unique=False)
+
+    op.create_table('activity_rollup',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('period', sa.String(length=4), nullable=False),
+    sa.Column('bucket', sa.DateTime(), nullable=False),
+    sa.Column('metric', sa.String(length=20), nullable=False),
+    sa.Column('course_id', sa.Integer(), nullable=True),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('activity_rollup', schema=None) as batch_op:
+        batch_op.create_index('ix_activity_rollup_period_metric_bucket', ['period', 'metric', 'bucket'], unique=False)
+
+    op.create_table('rollup_watermark',
+    sa.Column('source', sa.String(length=30), nullable=False),
+    sa.Column('processed_until', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('source')
+    )
+
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('completed_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_enrollments_enrolled_at', ['enrolled_at'], unique=False)
+        batch_op.create_index('ix_enrollments_completed_at', ['completed_at'], unique=False)
+
+    with op.batch_alter_table('payment', schema=None) as batch_op:
+        batch_op.create_index('ix_payment_created_at', ['created_at'], unique=False)
+        batch_op.create_index('ix_payment_updated_at', ['updated_at'], unique=False)
+
+    with op.batch_alter_table('review', schema=None) as batch_op:
+        batch_op.create_index('ix_review_created_at', ['created_at'], unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_created_at', ['created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_created_at')
+
+    with op.batch_alter_table('review', schema=None) as batch_op:
+        batch_op.drop_index('ix_review_created_at')
+
+    with op.batch_alter_table('payment', schema=None) as batch_op:
+        batch_op.drop_index('ix_payment_updated_at')
+        batch_op.drop_index('ix_payment_created_at')
+
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.drop_index('ix_enrollments_completed_at')
+        batch_op.drop_index('ix_enrollments_enrolled_at')
+        batch_op.drop_column('completed_at')
+
+    op.drop_table('rollup_watermark')
+
+    with op.batch_alter_table('activity_rollup', schema=None) as batch_op:
+        batch_op.drop_index('ix_activity_rollup_period_metric_bucket')
+
+    op.drop_table('activity_rollup')
+
+    with op.batch_alter_table('revenue_rollup', schema=None) as batch_op:
+        batch_op.drop_index('ix_revenue_rollup_period_bucket')
+
+    op.drop_table('revenue_rollup')
@@ -0,0 +1,37 @@
+"""Add stored_blob table for content-addressed uploads
+
+Revision ID: e7a4c2b9d813
+Revises: 9c3e1f5a7b24
+Create Date: 2026-10-18 14:02:17.841936
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a4c2b9d813'
+down_revision = '9c3e1f5a7b24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stored_blob',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('content_type', sa.String(length=100), nullable=True),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('touched_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    with op.batch_alter_table('stored_blob', schema=None) as batch_op:
+        batch_op.create_index('ix_stored_blob_ref_count_touched_at', ['ref_count', 'touched_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('stored_blob', schema=None) as batch_op:
+        batch_op.drop_index('ix_stored_blob_ref_count_touched_at')
+
+    op.drop_table('stored_blob')
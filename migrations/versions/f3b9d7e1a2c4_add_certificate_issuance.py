@@ -0,0 +1,42 @@
+"""Add certificate documents, one certificate per user and course, and the serial counter
+
+Revision ID: f3b9d7e1a2c4
+Revises: c8e2f4a6b913
+Create Date: 2026-10-18 21:05:37.402119
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b9d7e1a2c4'
+down_revision = 'c8e2f4a6b913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('certificate_counter',
+    sa.Column('year', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('last_serial', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('year')
+    )
+
+    # Keep the oldest certificate of any duplicates
+    op.execute(
+        "DELETE FROM certificate WHERE id NOT IN ("
+        "SELECT MIN(id) FROM certificate GROUP BY user_id, course_id)"
+    )
+
+    with op.batch_alter_table('certificate', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('document', sa.String(length=100), nullable=True))
+        batch_op.create_unique_constraint('uq_certificate_user_id_course_id', ['user_id', 'course_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('certificate', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_certificate_user_id_course_id', type_='unique')
+        batch_op.drop_column('document')
+
+    op.drop_table('certificate_counter')
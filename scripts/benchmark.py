@@ -0,0 +1,400 @@
+"""Load-test the core endpoints against a synthetic database.
+
+    python scripts/benchmark.py                    # seed if needed, run in-process
+    python scripts/benchmark.py --scale 5 --reseed # larger dataset
+    python scripts/benchmark.py --url http://localhost:5000 --database $DATABASE_URL
+    python scripts/benchmark.py --save-baseline    # record the results as the baseline
+
+The database (``--database``, default a SQLite file in the temp directory) is
+seeded through ``app.models`` so that all model events (rating summaries,
+search documents) run as they do in production. Requests are then sent from
+``--concurrency`` threads, either through the WSGI app in this process or
+over HTTP to a running server seeded from the same database.
+
+For every endpoint the report shows throughput, p50/p95/p99 latency and
+queries per request (the ``X-DB-Query-Count`` header, see
+app.instrumentation) next to the stored baseline. The exit status is 1 if an
+endpoint is slower or runs more queries than the baseline allows.
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+DEFAULT_DATABASE = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'scrumjet-benchmark.db')
+DEFAULT_BASELINE = os.path.join(ROOT, 'scripts', 'benchmark_baseline.json')
+PASSWORD = 'benchmark'
+
+# Rows per unit of --scale
+SIZES = {
+    'users': 200,
+    'categories': 6,
+    'courses': 40,
+    'modules_per_course': 5,
+    'lessons_per_module': 6,
+    'reviews': 400,
+    'enrollments': 800,
+    'article_categories': 5,
+    'articles': 150,
+    'events': 30,
+}
+
+WORDS = (
+    'scrum agile sprint backlog product owner team velocity retrospective kanban '
+    'planning estimation story points increment review daily standup coaching '
+    'leadership delivery roadmap refinement impediment framework release quality '
+    'testing metrics flow lean portfolio scaling certification workshop facilitation'
+).split()
+
+ENDPOINTS = ('main.index', 'courses.list_courses', 'courses.course_detail',
+             'articles.search', 'auth.login')
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def seed(app, scale, rng, reseed=False):
+    from app import db
+    from app.models import (Article, ArticleCategory, Category, Course, CourseLesson,
+                            CourseModule, Event, Review, User, enrollments)
+
+    sizes = {name: max(1, int(count * scale)) for name, count in SIZES.items()}
+    with app.app_context():
+        if reseed:
+            db.drop_all()
+        db.create_all()
+        if db.session.execute(db.select(User.id).filter_by(username='bench0')).first():
+            print('Benchmark data already present (use --reseed to rebuild).')
+            return
+        started = time.perf_counter()
+        print('Seeding: ' + ', '.join(f'{name}={count}' for name, count in sizes.items()))
+
+        # One hash for every user: seeding should not be dominated by password hashing
+        template = User(username='template')
+        template.set_password(PASSWORD)
+        users = []
+        for i in range(sizes['users']):
+            users.append(User(
+                username=f'bench{i}', email=f'bench{i}@example.com',
+                first_name='Bench', last_name=f'User{i}', password_hash=template.password_hash,
+                email_confirmed=True, email_confirmed_at=datetime.utcnow(),
+                role=User.ROLE_TRAINER if i % 20 == 0 else User.ROLE_USER,
+            ))
+        db.session.add_all(users)
+        categories = [Category(name=f'Category {i}') for i in range(sizes['categories'])]
+        db.session.add_all(categories)
+        db.session.flush()
+
+        courses = []
+        for i in range(sizes['courses']):
+            course = Course(
+                title=f'{_text(rng, 3).title()} {i}', summary=_text(rng, 20),
+                description=_text(rng, 120), price=rng.choice((49.0, 99.99, 499.0)),
+                duration=rng.randint(4, 40), level=rng.choice(('Beginner', 'Intermediate', 'Advanced')),
+                category=rng.choice(categories), user_id=users[0].id,
+            )
+            for m in range(sizes['modules_per_course']):
+                module = CourseModule(title=f'Module {m + 1}', description=_text(rng, 15),
+                                      order=m + 1, course=course)
+                for n in range(sizes['lessons_per_module']):
+                    CourseLesson(title=f'Lesson {n + 1}', content=_text(rng, 80), order=n + 1,
+                                 duration=rng.randint(5, 30), module=module)
+            courses.append(course)
+        db.session.add_all(courses)
+        db.session.flush()
+
+        db.session.add_all(
+            Review(text=_text(rng, 25), rating=rng.randint(1, 5),
+                   user_id=rng.choice(users).id, course_id=rng.choice(courses).id)
+            for _ in range(sizes['reviews'])
+        )
+        pairs = set()
+        while len(pairs) < min(sizes['enrollments'], len(users) * len(courses)):
+            pairs.add((rng.choice(users).id, rng.choice(courses).id))
+        db.session.execute(enrollments.insert(), [
+            {'user_id': user_id, 'course_id': course_id} for user_id, course_id in sorted(pairs)
+        ])
+
+        article_categories = [ArticleCategory(name=f'Topic {i}')
+                              for i in range(sizes['article_categories'])]
+        db.session.add_all(article_categories)
+        now = datetime.utcnow()
+        db.session.add_all(
+            Article(title=_text(rng, 6).capitalize(), body=_text(rng, 300), summary=_text(rng, 30),
+                    author_id=rng.choice(users).id, article_category=rng.choice(article_categories),
+                    published=True, published_at=now - timedelta(days=i))
+            for i in range(sizes['articles'])
+        )
+        for i in range(sizes['events']):
+            start = now + timedelta(days=rng.randint(-60, 120))
+            db.session.add(Event(name=f'{_text(rng, 2).title()} Meetup {i}', description=_text(rng, 40),
+                                 start_date=start, end_date=start + timedelta(hours=3),
+                                 venue_name='Online', organizer_id=users[0].id))
+        db.session.commit()
+        print(f'Seeded in {time.perf_counter() - started:.1f}s')
+
+
+# Request plan: endpoint -> list of (method, path, form data, expected status)
+def build_plan(app, requests_per_endpoint, rng):
+    from flask import url_for
+    from app import db
+    from app.models import Course, User
+    from app.pagination import encode_cursor
+
+    with app.app_context():
+        listing = db.session.execute(
+            db.select(Course.id, Course.created_at).order_by(Course.created_at.desc(), Course.id.desc())
+        ).all()
+        emails = db.session.execute(
+            db.select(User.email).where(User.username.like('bench%'))
+        ).scalars().all()
+        per_page = app.config['COURSES_PER_PAGE']
+    course_ids = [row.id for row in listing]
+    # Keyset cursors for every page of the course list (None is the first page)
+    cursors = [None] + [encode_cursor([row.created_at, row.id])
+                        for row in listing[per_page - 1:-1:per_page]]
+
+    with app.test_request_context():
+        makers = {
+            'main.index': lambda: ('GET', url_for('main.index'), None, 200),
+            'courses.list_courses': lambda: (
+                'GET', url_for('courses.list_courses', cursor=rng.choice(cursors)), None, 200),
+            'courses.course_detail': lambda: (
+                'GET', url_for('courses.course_detail', id=rng.choice(course_ids)), None, 200),
+            'articles.search': lambda: (
+                'GET', url_for('articles.search', q=' '.join(rng.sample(WORDS, rng.randint(1, 2)))),
+                None, 200),
+            'auth.login': lambda: (
+                'POST', url_for('auth.login'),
+                {'email': rng.choice(emails), 'password': PASSWORD}, 302),
+        }
+        return {name: [makers[name]() for _ in range(requests_per_endpoint)] for name in ENDPOINTS}
+
+
+class InProcessClient:
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, data):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            # No cookies: every login starts anonymous
+            client = self._local.client = self.app.test_client(use_cookies=False)
+        response = client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code, response.headers
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPClient:
+    CSRF_FIELD = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def _open(self, opener, method, path, data):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with opener.open(req, timeout=60) as response:
+                response.read()
+                return response.status, response.headers
+        except urllib.error.HTTPError as error:
+            return error.code, error.headers
+
+    def request(self, method, path, data):
+        opener = urllib.request.build_opener(
+            _NoRedirect, urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        if method == 'POST':
+            # Forms need the CSRF token and session cookie from a GET first (not timed)
+            with opener.open(self.base_url + path, timeout=60) as response:
+                match = self.CSRF_FIELD.search(response.read().decode('utf-8', 'replace'))
+            if match:
+                data = dict(data, csrf_token=match.group(1))
+        return self._open(opener, method, path, data)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+# Send the first `warmup` requests of the plan untimed, then time the rest
+def run_endpoint(client, plan, concurrency, warmup):
+    for method, path, data, _ in plan[:warmup]:
+        client.request(method, path, data)
+    plan = plan[warmup:]
+
+    def timed(item):
+        method, path, data, expected = item
+        started = time.perf_counter()
+        status, headers = client.request(method, path, data)
+        elapsed = time.perf_counter() - started
+        queries = headers.get('X-DB-Query-Count')
+        return elapsed, status == expected, int(queries) if queries is not None else None, \
+            'X-DB-N-Plus-One' in headers
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, plan))
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed for elapsed, ok, queries, n_plus_one in results]
+    query_counts = [queries for elapsed, ok, queries, n_plus_one in results if queries is not None]
+    return {
+        'requests': len(results),
+        'errors': sum(1 for elapsed, ok, queries, n_plus_one in results if not ok),
+        'rps': round(len(results) / wall, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'queries': round(sum(query_counts) / len(query_counts), 1) if query_counts else None,
+        'n_plus_one': sum(1 for elapsed, ok, queries, n_plus_one in results if n_plus_one),
+    }
+
+
+# Regressions of `current` against `baseline` for one endpoint
+def compare(current, baseline, tolerance):
+    problems = []
+    if current['p95_ms'] > baseline['p95_ms'] * (1 + tolerance):
+        problems.append(f"p95 {baseline['p95_ms']} -> {current['p95_ms']} ms")
+    if current['rps'] < baseline['rps'] * (1 - tolerance):
+        problems.append(f"throughput {baseline['rps']} -> {current['rps']} req/s")
+    # Query counts do not depend on the machine, so any increase counts
+    if current['queries'] is not None and baseline.get('queries') is not None \
+            and current['queries'] > baseline['queries']:
+        problems.append(f"queries {baseline['queries']} -> {current['queries']}")
+    if current['errors']:
+        problems.append(f"{current['errors']} failed requests")
+    return problems
+
+
+def _delta(current, baseline, key):
+    if not baseline or not baseline.get(key) or current.get(key) is None:
+        return ''
+    return f' ({(current[key] - baseline[key]) / baseline[key] * 100:+.0f}%)'
+
+
+def report(results, baseline, tolerance):
+    print()
+    print(f"{'endpoint':24} {'req/s':>14} {'p50 ms':>9} {'p95 ms':>16} {'p99 ms':>9} "
+          f"{'queries':>9} {'N+1':>5} {'errors':>6}")
+    regressions = {}
+    for name, result in results.items():
+        base = (baseline or {}).get('endpoints', {}).get(name)
+        queries = '-' if result['queries'] is None else result['queries']
+        print(f"{name:24} {str(result['rps']) + _delta(result, base, 'rps'):>14} "
+              f"{result['p50_ms']:>9} {str(result['p95_ms']) + _delta(result, base, 'p95_ms'):>16} "
+              f"{result['p99_ms']:>9} {queries:>9} {result['n_plus_one']:>5} {result['errors']:>6}")
+        if base:
+            problems = compare(result, base, tolerance)
+            if problems:
+                regressions[name] = problems
+    print()
+    for name, problems in regressions.items():
+        print(f'REGRESSION {name}: ' + '; '.join(problems))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database', default=os.environ.get('BENCHMARK_DATABASE_URL', DEFAULT_DATABASE),
+                        help='database to seed and benchmark (default: %(default)s)')
+    parser.add_argument('--url', help='benchmark a running server instead of the app in-process')
+    parser.add_argument('--scale', type=float, default=1, help='dataset size multiplier')
+    parser.add_argument('--reseed', action='store_true', help='drop and re-create the dataset')
+    parser.add_argument('--seed-only', action='store_true', help='seed the database and exit')
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--endpoint', action='append', choices=ENDPOINTS,
+                        help='only benchmark these endpoints (repeatable)')
+    parser.add_argument('--random-seed', type=int, default=1, help='seed for data and request mix')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline file (default: %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results to --baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed latency/throughput regression as a fraction (default: %(default)s)')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--password-hash-method',
+                        help='hash method for seeded users (default: the production setting)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Read by TestingConfig when app.config is imported
+    os.environ['TEST_DATABASE_URL'] = args.database
+    from app import create_app
+    from app.config import ProductionConfig
+
+    app = create_app('testing')
+    # TestingConfig hashes passwords cheaply; logins should cost what they do in production
+    app.config['PASSWORD_HASH_METHOD'] = args.password_hash_method or ProductionConfig.PASSWORD_HASH_METHOD
+    # Per-request N+1 warnings would drown the report; they are counted in it instead
+    app.logger.setLevel(logging.ERROR)
+    rng = random.Random(args.random_seed)
+
+    seed(app, args.scale, rng, reseed=args.reseed)
+    if args.seed_only:
+        return 0
+
+    plan = build_plan(app, args.requests + args.warmup, rng)
+    client = HTTPClient(args.url) if args.url else InProcessClient(app)
+    results = {}
+    for name in args.endpoint or ENDPOINTS:
+        print(f'Benchmarking {name} ...', flush=True)
+        results[name] = run_endpoint(client, plan[name], args.concurrency, args.warmup)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = report(results, baseline, args.tolerance)
+    if baseline is None and not args.save_baseline:
+        print('No baseline to compare with (run with --save-baseline to record one).')
+
+    document = {
+        'meta': {
+            'created': datetime.utcnow().isoformat(timespec='seconds'),
+            'target': args.url or 'in-process',
+            'database': args.database.split(':', 1)[0],
+            'scale': args.scale,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+        },
+        'endpoints': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(document, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f'Baseline written to {args.baseline}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,6 +11,11 @@ from app.models import (
     Event, Sponsor, CourseModule, CourseLesson
 )
 
+# Demo accounts are hashed cheaply; the first login upgrades them to
+# PASSWORD_HASH_METHOD (see app.passwords)
+SEED_HASH_METHOD = 'pbkdf2:sha256:1000'
+
+
 def create_sample_data():
     """Create sample data for the application."""
     app = create_app('development')
@@ -36,7 +41,7 @@ def create_sample_data():
             email_confirmed=True,
             email_confirmed_at=datetime.utcnow()
         )
-        admin.set_password('adminpass')
+        admin.set_password('adminpass', method=SEED_HASH_METHOD)
         db.session.add(admin)
         
         # Create regular user
@@ -49,7 +54,7 @@ def create_sample_data():
             email_confirmed=True,
             email_confirmed_at=datetime.utcnow()
         )
-        user.set_password('userpass')
+        user.set_password('userpass', method=SEED_HASH_METHOD)
         db.session.add(user)
         
         # Create trainer user
@@ -64,7 +69,7 @@ def create_sample_data():
             email_confirmed=True,
             email_confirmed_at=datetime.utcnow()
         )
-        trainer.set_password('trainerpass')
+        trainer.set_password('trainerpass', method=SEED_HASH_METHOD)
         db.session.add(trainer)
         
         # Create categories
@@ -0,0 +1,420 @@
+"""Bulk synthetic data generator for staging and load tests.
+
+    python scripts/populate_db.py --users 200000 --courses 2000 \\
+        --enrollments 10000000 --reviews 10000000 --workers 8
+
+Unlike scripts/init_db.py, which builds a handful of demo objects through the
+ORM, this writes rows with SQLAlchemy Core: ``COPY ... FROM STDIN`` on
+PostgreSQL and batched ``executemany`` inserts elsewhere. Every table is
+split into fixed-size chunks that worker processes generate and load
+independently, one batch at a time, so memory use does not grow with the
+row count.
+
+Foreign keys stay consistent without lookups: each table's ids are reserved
+up front as a contiguous range after its current maximum (and the
+PostgreSQL sequence is moved past it), so a row can compute the ids it
+references from its own index. Tables are loaded in dependency order.
+Enrollment pairs come from a permutation of the user x course grid, so they
+are unique without remembering which ones were generated.
+
+Data normally maintained by model events is rebuilt afterwards in SQL: the
+course rating summaries and the search documents of new courses and
+articles. Cached pages are invalidated.
+"""
+import argparse
+import csv
+import io
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine, func, literal, select
+from sqlalchemy.pool import NullPool
+from app import create_app, db
+from app.models import (
+    Article, ArticleCategory, Category, Course, CourseLesson, CourseModule, Event,
+    Review, SearchDocument, User, enrollments,
+)
+
+WORDS = (
+    'scrum agile sprint backlog product owner team velocity retrospective kanban '
+    'planning estimation story points increment review daily standup coaching '
+    'leadership delivery roadmap refinement impediment framework release quality '
+    'testing metrics flow lean portfolio scaling certification workshop facilitation'
+).split()
+LEVELS = ('Beginner', 'Intermediate', 'Advanced')
+PASSWORD = 'password'
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def _timestamp(rng, plan, days=730):
+    return plan['now'] - timedelta(seconds=rng.randrange(days * 86400))
+
+
+# Row builders: (rng, index within the generated range, plan) -> tuple in
+# the order of the table's columns in TABLES. `plan` holds the first id and
+# count of every generated table.
+
+def _user_row(rng, i, plan):
+    user_id = plan['user'][0] + i
+    return (user_id, f'gen{user_id}', f'gen{user_id}@example.com', plan['password_hash'],
+            'Gen', f'User{user_id}'[:20], User.ROLE_TRAINER if i % 50 == 0 else User.ROLE_USER,
+            False, True, False, False, _timestamp(rng, plan))
+
+
+def _category_row(rng, i, plan):
+    category_id = plan['category'][0] + i
+    return category_id, f'Category {category_id}', _text(rng, 8)
+
+
+def _course_row(rng, i, plan):
+    course_id = plan['course'][0] + i
+    return (course_id, f'{_text(rng, 3).title()} {course_id}'[:100], _text(rng, 20), _text(rng, 120),
+            rng.choice((49.0, 99.99, 299.0, 499.0)), rng.randint(4, 40), rng.choice(LEVELS),
+            _pick(rng, plan, 'category'), _trainer(rng, plan), _timestamp(rng, plan))
+
+
+def _module_row(rng, i, plan):
+    per_course = plan['modules_per_course']
+    return (plan['course_module'][0] + i, f'Module {i % per_course + 1}', _text(rng, 15),
+            i % per_course + 1, plan['course'][0] + i // per_course, _timestamp(rng, plan))
+
+
+def _lesson_row(rng, i, plan):
+    per_module = plan['lessons_per_module']
+    return (plan['course_lesson'][0] + i, f'Lesson {i % per_module + 1}', _text(rng, 80),
+            i % per_module + 1, rng.randint(5, 30), plan['course_module'][0] + i // per_module,
+            _timestamp(rng, plan))
+
+
+def _enrollment_row(rng, i, plan):
+    # i -> a distinct cell of the user x course grid
+    first_user, users = plan['user']
+    first_course, courses = plan['course']
+    cell = (plan['enrollment_step'] * i + plan['enrollment_offset']) % (users * courses)
+    return first_user + cell // courses, first_course + cell % courses, \
+        _timestamp(rng, plan), rng.random() < 0.3
+
+
+def _review_row(rng, i, plan):
+    return (plan['review'][0] + i, _text(rng, 25), _pick(rng, plan, 'user'),
+            float(rng.choices((1, 2, 3, 4, 5), weights=(1, 1, 3, 6, 9))[0]),
+            _pick(rng, plan, 'course'), _timestamp(rng, plan))
+
+
+def _article_category_row(rng, i, plan):
+    category_id = plan['article_category'][0] + i
+    return category_id, f'Topic {category_id}', _text(rng, 8)
+
+
+def _article_row(rng, i, plan):
+    published_at = _timestamp(rng, plan)
+    return (plan['article'][0] + i, _text(rng, 6).capitalize(), _text(rng, 300), _text(rng, 30),
+            _pick(rng, plan, 'user'), _pick(rng, plan, 'article_category'), True,
+            published_at, published_at)
+
+
+def _event_row(rng, i, plan):
+    start = plan['now'] + timedelta(hours=rng.randint(-24 * 180, 24 * 365))
+    return (plan['event'][0] + i, f'{_text(rng, 2).title()} Meetup {plan["event"][0] + i}',
+            _text(rng, 40), start, start + timedelta(hours=3), 'Online', _trainer(rng, plan),
+            _timestamp(rng, plan))
+
+
+def _pick(rng, plan, name):
+    first, count = plan[name]
+    return first + rng.randrange(count)
+
+
+def _trainer(rng, plan):
+    # Every 50th generated user is a trainer
+    first, count = plan['user']
+    return first + 50 * rng.randrange(max(1, math.ceil(count / 50)))
+
+
+# name -> (table, columns, row builder)
+TABLES = {
+    'user': (User.__table__, ('id', 'username', 'email', 'password_hash', 'first_name', 'last_name',
+                              'role', 'admin', 'email_confirmed', 'is_csp', 'is_cst', 'created_at'),
+             _user_row),
+    'category': (Category.__table__, ('id', 'name', 'description'), _category_row),
+    'course': (Course.__table__, ('id', 'title', 'summary', 'description', 'price', 'duration',
+                                  'level', 'category_id', 'user_id', 'created_at'), _course_row),
+    'course_module': (CourseModule.__table__, ('id', 'title', 'description', 'order', 'course_id',
+                                               'created_at'), _module_row),
+    'course_lesson': (CourseLesson.__table__, ('id', 'title', 'content', 'order', 'duration',
+                                               'module_id', 'created_at'), _lesson_row),
+    'enrollments': (enrollments, ('user_id', 'course_id', 'enrolled_at', 'completed'), _enrollment_row),
+    'review': (Review.__table__, ('id', 'text', 'user_id', 'rating', 'course_id', 'created_at'),
+               _review_row),
+    'article_category': (ArticleCategory.__table__, ('id', 'name', 'description'),
+                         _article_category_row),
+    'article': (Article.__table__, ('id', 'title', 'body', 'summary', 'author_id', 'category_id',
+                                    'published', 'published_at', 'created_at'), _article_row),
+    'event': (Event.__table__, ('id', 'name', 'description', 'start_date', 'end_date', 'venue_name',
+                                'organizer_id', 'created_at'), _event_row),
+}
+
+# Tables in the same phase only reference tables of earlier phases
+PHASES = (
+    ('user', 'category', 'article_category'),
+    ('course',),
+    ('course_module',),
+    ('course_lesson', 'enrollments', 'review', 'article', 'event'),
+)
+
+
+# Reserve `count` ids after the current maximum of each table with an id column
+def reserve_ids(engine, counts):
+    ranges = {}
+    with engine.begin() as connection:
+        for name, count in counts.items():
+            table = TABLES[name][0]
+            if 'id' not in table.c or not count:
+                continue
+            first = (connection.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+            ranges[name] = (first, count)
+            if connection.dialect.name == 'postgresql':
+                # Keep the application's own inserts clear of the reserved range
+                connection.exec_driver_sql(
+                    f"SELECT setval(pg_get_serial_sequence('{_quoted(connection, table)}', 'id'), "
+                    f"{first + count - 1})"
+                )
+    return ranges
+
+
+def _quoted(connection, table):
+    return connection.dialect.identifier_preparer.format_table(table)
+
+
+# A step coprime with the grid size, so i -> (step * i + offset) % size is a permutation
+def _permutation(size, rng):
+    step = rng.randrange(size // 3 + 1, size) | 1 if size > 2 else 1
+    while math.gcd(step, size) != 1:
+        step += 1
+    return step, rng.randrange(size)
+
+
+_engine = None
+
+
+def _init_worker(uri):
+    global _engine
+    _engine = create_engine(uri, poolclass=NullPool)
+
+
+def _batches(name, start, stop, plan, batch_size):
+    table, columns, build = TABLES[name]
+    # Seeded per chunk: the same arguments always produce the same rows
+    rng = random.Random(f'{plan["seed"]}:{name}:{start}')
+    for batch_start in range(start, stop, batch_size):
+        yield [build(rng, i, plan) for i in range(batch_start, min(stop, batch_start + batch_size))]
+
+
+def _copy(connection, table, columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row)
+    buffer.seek(0)
+    preparer = connection.dialect.identifier_preparer
+    column_list = ', '.join(preparer.quote(column) for column in columns)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY {preparer.format_table(table)} ({column_list}) '
+                           'FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+
+# Worker task: generate and load rows [start, stop) of one table
+def load_chunk(task):
+    name, start, stop, plan, batch_size = task
+    table, columns, build = TABLES[name]
+    with _engine.begin() as connection:
+        use_copy = connection.dialect.name == 'postgresql'
+        if use_copy:
+            # Losing the last commits in a crash is fine for generated data
+            connection.exec_driver_sql('SET LOCAL synchronous_commit TO off')
+        for rows in _batches(name, start, stop, plan, batch_size):
+            if use_copy:
+                _copy(connection, table, columns, rows)
+            else:
+                connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+    return name, stop - start
+
+
+# Rating summaries of the generated courses, as the Review events would have kept them
+def refresh_rating_summaries(connection, first, count):
+    course = Course.__table__
+    review = Review.__table__
+
+    def aggregate(expression, *criteria):
+        return select(expression).where(review.c.course_id == course.c.id, *criteria).scalar_subquery()
+
+    values = {
+        'rating_count': aggregate(func.count()),
+        'rating_sum': aggregate(func.coalesce(func.sum(review.c.rating), 0.0)),
+    }
+    for star in Review.STARS:
+        values[f'rating_{star}_count'] = aggregate(
+            func.count(), review.c.rating.isnot(None),
+            *Review.star_criteria(star),
+        )
+    connection.execute(course.update()
+                       .where(course.c.id.between(first, first + count - 1))
+                       .values(values))
+
+
+# Lesson totals of the generated modules and courses, as the CourseLesson events would have kept them
+def refresh_lesson_counters(connection, plan):
+    course = Course.__table__
+    module = CourseModule.__table__
+    lesson = CourseLesson.__table__
+
+    first, count = plan['course_module']
+    connection.execute(module.update()
+                       .where(module.c.id.between(first, first + count - 1))
+                       .values(lesson_count=select(func.count()).where(lesson.c.module_id == module.c.id)
+                               .scalar_subquery(),
+                               lesson_minutes=select(func.coalesce(func.sum(lesson.c.duration), 0))
+                               .where(lesson.c.module_id == module.c.id).scalar_subquery()))
+
+    first, count = plan['course']
+    connection.execute(course.update()
+                       .where(course.c.id.between(first, first + count - 1))
+                       .values(lesson_count=select(func.coalesce(func.sum(module.c.lesson_count), 0))
+                               .where(module.c.course_id == course.c.id).scalar_subquery(),
+                               lesson_minutes=select(func.coalesce(func.sum(module.c.lesson_minutes), 0))
+                               .where(module.c.course_id == course.c.id).scalar_subquery()))
+
+
+# Search documents of generated courses and articles (see app.search)
+def index_documents(connection, plan):
+    documents = SearchDocument.__table__
+    columns = ('doc_type', 'doc_id', 'title', 'body', 'updated_at')
+    now = literal(plan['now'])
+    sources = (
+        ('course', Course.__table__, Course.__table__.c.description, None),
+        ('article', Article.__table__, Article.__table__.c.body, Article.__table__.c.published),
+    )
+    for doc_type, table, text, published in sources:
+        if doc_type not in plan:
+            continue
+        first, count = plan[doc_type]
+        query = select(
+            literal(doc_type), table.c.id, func.substr(table.c.title, 1, 255),
+            table.c.summary + literal('\n') + text, now,
+        ).where(table.c.id.between(first, first + count - 1))
+        if published is not None:
+            query = query.where(published.is_(True))
+        connection.execute(documents.insert().from_select(columns, query))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--config', default=os.environ.get('FLASK_CONFIG', 'development'),
+                        help='app configuration providing the database (default: %(default)s)')
+    parser.add_argument('--database', help='database URI, overriding the configuration')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--courses', type=int, default=200)
+    parser.add_argument('--modules-per-course', type=int, default=5)
+    parser.add_argument('--lessons-per-module', type=int, default=6)
+    parser.add_argument('--enrollments', type=int, default=100000)
+    parser.add_argument('--reviews', type=int, default=100000)
+    parser.add_argument('--article-categories', type=int, default=10)
+    parser.add_argument('--articles', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='loader processes (SQLite always uses one)')
+    parser.add_argument('--batch-size', type=int, default=5000, help='rows per COPY/insert')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='rows per worker task')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parser.add_argument('--create-tables', action='store_true',
+                        help='create missing tables first (instead of running migrations)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    app = create_app(args.config)
+    uri = args.database or app.config['SQLALCHEMY_DATABASE_URI']
+    engine = create_engine(uri, poolclass=NullPool)
+    if args.create_tables:
+        with app.app_context():
+            db.metadata.create_all(engine)
+
+    counts = {
+        'user': args.users, 'category': args.categories, 'course': args.courses,
+        'course_module': args.courses * args.modules_per_course,
+        'course_lesson': args.courses * args.modules_per_course * args.lessons_per_module,
+        'enrollments': args.enrollments, 'review': args.reviews,
+        'article_category': args.article_categories, 'article': args.articles, 'event': args.events,
+    }
+    needs = {'course': ('category', 'user'), 'enrollments': ('user', 'course'),
+             'review': ('user', 'course'), 'article': ('user', 'article_category'),
+             'event': ('user',)}
+    for name, required in needs.items():
+        if counts[name] and not all(counts[other] for other in required):
+            sys.exit(f'Generating {name} requires generating {" and ".join(required)} too.')
+    if args.enrollments > args.users * args.courses:
+        sys.exit(f'At most {args.users * args.courses} distinct enrollments fit --users x --courses.')
+
+    rng = random.Random(args.seed)
+    template = User(username='template')
+    template.set_password(PASSWORD)
+    plan = reserve_ids(engine, counts)
+    plan.update(
+        seed=args.seed, now=datetime.utcnow(), password_hash=template.password_hash,
+        modules_per_course=args.modules_per_course, lessons_per_module=args.lessons_per_module,
+    )
+    if args.enrollments:
+        plan['enrollment_step'], plan['enrollment_offset'] = _permutation(args.users * args.courses, rng)
+
+    workers = 1 if engine.dialect.name == 'sqlite' else max(1, args.workers)
+    print(f'Loading into {engine.url.render_as_string(hide_password=True)} with {workers} worker(s)')
+    started = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(uri,)) as pool:
+        for phase in PHASES:
+            tasks = [(name, start, min(counts[name], start + args.chunk_size), plan, args.batch_size)
+                     for name in phase for start in range(0, counts[name], args.chunk_size)]
+            phase_started = time.perf_counter()
+            loaded = dict.fromkeys(phase, 0)
+            for name, rows in pool.imap_unordered(load_chunk, tasks):
+                loaded[name] += rows
+                elapsed = time.perf_counter() - phase_started
+                print(f'  {name}: {loaded[name]}/{counts[name]} rows '
+                      f'({sum(loaded.values()) / elapsed:,.0f} rows/s in this phase)', flush=True)
+
+    with engine.begin() as connection:
+        if 'course' in plan and args.reviews:
+            print('Refreshing course rating summaries ...')
+            refresh_rating_summaries(connection, *plan['course'])
+        if 'course_module' in plan:
+            print('Refreshing lesson counters ...')
+            refresh_lesson_counters(connection, plan)
+        print('Indexing courses and articles for search ...')
+        index_documents(connection, plan)
+
+    with app.app_context():
+        from app.cache import MODEL_TAGS, cache
+        cache.invalidate(*{tag for tags in MODEL_TAGS.values() if not callable(tags) for tag in tags})
+
+    total = sum(counts.values())
+    elapsed = time.perf_counter() - started
+    print(f'Loaded {total:,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
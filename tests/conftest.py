@@ -0,0 +1,107 @@
+import os
+
+import pytest
+from flask import g
+
+# In-memory SQLite unless a test database (e.g. PostgreSQL) is configured
+os.environ.setdefault('TEST_DATABASE_URL', 'sqlite://')
+
+from app import create_app, db  # noqa: E402
+from app.models import Category, Course, CourseLesson, CourseModule, User  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def trainer(app):
+    user = User(username='trainer', email='trainer@example.com', first_name='Tess',
+                last_name='Trainer', role=User.ROLE_TRAINER)
+    user.set_password('password')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+# make_course('Title', [[30, 45], [20]]) -> a course with one module per list
+# and one lesson of that many minutes per entry, committed
+@pytest.fixture
+def make_course(trainer):
+    category = Category(name='Scrum')
+
+    def make(title, syllabus=()):
+        course = Course(title=title, summary='Summary', description='Description',
+                        category=category, creator=trainer)
+        db.session.add(course)
+        for order, durations in enumerate(syllabus):
+            module = CourseModule(title=f'Module {order + 1}', order=order, course=course)
+            db.session.add(module)
+            for lesson_order, duration in enumerate(durations):
+                db.session.add(CourseLesson(title=f'Lesson {lesson_order + 1}', order=lesson_order,
+                                            duration=duration, module=module))
+        db.session.commit()
+        return course
+
+    return make
+
+
+@pytest.fixture
+def admin(app):
+    user = User(username='admin', email='admin@example.com', first_name='Ada',
+                last_name='Admin', role=User.ROLE_ADMIN)
+    user.set_password('password')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+# login(user): the test client is logged in as `user` from the next request on.
+# Requests share the fixture's app context, so the user Flask-Login keeps on `g`
+# from an earlier request is dropped.
+@pytest.fixture
+def login(client):
+    def login(user):
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+        g.pop('_login_user', None)
+    return login
+
+
+# A local SMTP server that records what the mailer and the outbox send
+@pytest.fixture
+def smtp_sink(app):
+    from app import mail
+    from app.mailer import MailStats, mail_dispatcher
+    from app.utils.smtp_sink import SMTPSink
+
+    with SMTPSink() as sink:
+        app.config.update(MAIL_SERVER=sink.host, MAIL_PORT=sink.port, MAIL_USE_TLS=False,
+                          MAIL_SUPPRESS_SEND=False, MAIL_RETRY_BACKOFF=0)
+        mail.init_app(app)
+        mail_dispatcher.init_app(app)
+        mail_dispatcher.stats = MailStats()
+        yield sink
+        mail_dispatcher.shutdown()
+
+
+# Upload storage under a temporary UPLOAD_FOLDER
+@pytest.fixture
+def local_storage(app, tmp_path):
+    from app.storage import storage
+
+    app.config.update(UPLOAD_FOLDER=str(tmp_path), STORAGE_BACKEND='local')
+    storage.init_app(app)
+    return storage
@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from app import db
+from app.cache import LRUCache, cache
+from app.models import FAQ
+
+
+@pytest.fixture
+def lru_cache(app):
+    app.config['CACHE_TYPE'] = 'lru'
+    cache.init_app(app)
+
+
+def test_second_request_is_served_from_the_cache(client, make_course, lru_cache):
+    make_course('Cached course', [[30]])
+
+    first = client.get('/courses/courses')
+    second = client.get('/courses/courses')
+
+    assert first.headers['X-Cache'] == 'MISS'
+    assert second.headers['X-Cache'] == 'HIT'
+    assert second.data == first.data
+
+
+def test_committed_write_invalidates_its_tags(client, make_course, lru_cache):
+    make_course('First course', [[30]])
+    client.get('/courses/courses')
+
+    make_course('Second course', [[30]])
+    response = client.get('/courses/courses')
+
+    assert response.headers['X-Cache'] == 'MISS'
+    assert b'Second course' in response.data
+
+
+def test_unrelated_write_keeps_the_entry(client, make_course, lru_cache):
+    make_course('Cached course', [[30]])
+    client.get('/courses/courses')
+
+    db.session.add(FAQ(question='Is it cached?', answer='Yes.'))
+    db.session.commit()
+
+    assert client.get('/courses/courses').headers['X-Cache'] == 'HIT'
+
+
+def test_rolled_back_write_keeps_the_entry(client, make_course, lru_cache):
+    course = make_course('Cached course', [[30]])
+    client.get('/courses/courses')
+
+    course.title = 'Renamed course'
+    db.session.flush()
+    db.session.rollback()
+
+    assert client.get('/courses/courses').headers['X-Cache'] == 'HIT'
+
+
+def test_pages_vary_on_login(client, make_course, trainer, login, lru_cache):
+    make_course('Cached course', [[30]])
+    client.get('/courses/courses')
+    login(trainer)
+
+    assert client.get('/courses/courses').headers['X-Cache'] == 'MISS'
+    assert client.get('/courses/courses').headers['X-Cache'] == 'HIT'
+
+
+def test_lru_cache_evicts_least_recently_used():
+    lru = LRUCache(threshold=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    lru.get('a')
+    lru.set('c', 3)
+
+    assert (lru.get('a'), lru.get('b'), lru.get('c')) == (1, None, 3)
+
+
+def test_lru_cache_expires_entries(monkeypatch):
+    lru = LRUCache(default_timeout=10)
+    lru.set('a', 1)
+    lru.set('b', 2, timeout=0)
+    now = time.time()
+    monkeypatch.setattr('app.cache.time.time', lambda: now + 11)
+
+    assert (lru.get('a'), lru.get('b')) == (None, 2)
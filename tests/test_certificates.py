@@ -0,0 +1,109 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+from app import certificates, db
+from app.certificates import allocate_numbers, issue_certificates
+from app.models import Certificate, StoredBlob, User, enrollments
+
+ISSUED_AT = datetime(2026, 10, 18)
+
+
+@pytest.fixture
+def enroll(make_course):
+    course = make_course('Certified ScrumMaster', [[30]])
+
+    def enroll(count, completed=True):
+        start = db.session.scalar(db.select(db.func.count()).select_from(User))
+        users = [User(username=f'student{n}', email=f'student{n}@example.com', first_name='Student',
+                      last_name=f'{n:03d}') for n in range(start, start + count)]
+        db.session.add_all(users)
+        db.session.flush()
+        db.session.execute(enrollments.insert(), [
+            {'user_id': user.id, 'course_id': course.id, 'completed': completed} for user in users
+        ])
+        db.session.commit()
+        return course, users
+    return enroll
+
+
+def _serials(numbers):
+    return [int(number.rsplit('-', 1)[1]) for number in numbers]
+
+
+def test_blocks_continue_the_sequence_of_their_year(app):
+    assert allocate_numbers(3, 2026) == ['SJ-2026-000001', 'SJ-2026-000002', 'SJ-2026-000003']
+    assert allocate_numbers(2, 2026, prefix='CX') == ['CX-2026-000004', 'CX-2026-000005']
+    assert allocate_numbers(1, 2027) == ['SJ-2027-000001']
+
+
+def test_bulk_issuance_numbers_are_gap_free(local_storage, enroll):
+    course, users = enroll(6)
+    enroll(2, completed=False)
+
+    issued = issue_certificates(course, issued_at=ISSUED_AT)
+
+    assert [certificate.user_id for certificate in issued] == [user.id for user in users]
+    assert _serials(certificate.certificate_number for certificate in issued) == list(range(1, 7))
+    assert len({certificate.verification_code for certificate in issued}) == 6
+    for certificate in issued:
+        assert db.session.get(StoredBlob, certificate.document).ref_count == 1
+        assert local_storage.backend.exists(certificate.document)
+        assert local_storage.backend.exists(f'{certificate.document}-{certificates.PREVIEW_SUFFIX}')
+
+
+def test_later_runs_only_certify_new_recipients(local_storage, enroll):
+    course, _ = enroll(2)
+    issue_certificates(course, issued_at=ISSUED_AT)
+    assert issue_certificates(course, issued_at=ISSUED_AT) == []
+
+    _, late = enroll(1)
+    issued = issue_certificates(course, issued_at=ISSUED_AT)
+
+    assert [(certificate.user_id, certificate.certificate_number) for certificate in issued] == \
+        [(late[0].id, 'SJ-2026-000003')]
+
+
+# A failed run burns its block: the numbers are skipped, never handed out twice
+def test_numbers_of_a_failed_run_are_not_reused(local_storage, enroll, monkeypatch):
+    course, _ = enroll(3)
+
+    def fail(count):
+        raise RuntimeError('code lookup failed')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(certificates, 'generate_codes', fail)
+        with pytest.raises(RuntimeError):
+            issue_certificates(course, issued_at=ISSUED_AT)
+    assert db.session.scalar(db.select(db.func.count()).select_from(Certificate)) == 0
+
+    issued = issue_certificates(course, issued_at=ISSUED_AT)
+
+    assert _serials(certificate.certificate_number for certificate in issued) == [4, 5, 6]
+
+
+# Concurrent allocations need row locks on the counter
+def test_concurrent_allocations_are_disjoint(app):
+    if db.engine.dialect.name != 'postgresql':
+        pytest.skip('row locking needs PostgreSQL')
+    blocks = []
+    start = threading.Barrier(4)
+
+    def allocate():
+        with app.app_context():
+            start.wait()
+            for _ in range(10):
+                numbers = allocate_numbers(5, 2026)
+                db.session.commit()
+                blocks.append(numbers)
+            db.session.remove()
+
+    threads = [threading.Thread(target=allocate) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    serials = sorted(serial for numbers in blocks for serial in _serials(numbers))
+    assert serials == list(range(1, 201))
@@ -0,0 +1,20 @@
+def test_filters_narrow_the_course_list(client, make_course):
+    make_course('Short course', [[30, 30]])
+    make_course('Long course', [[60] * 6])
+
+    response = client.get('/courses/courses?max_hours=2')
+
+    assert b'Short course' in response.data
+    assert b'Long course' not in response.data
+
+
+# An empty result keeps the filter form and offers a way back to every course
+def test_filters_matching_nothing_keep_the_form(client, make_course):
+    make_course('Short course', [[30, 30]])
+
+    response = client.get('/courses/courses?min_lessons=50')
+
+    assert response.status_code == 200
+    assert b'No courses match these filters' in response.data
+    assert b'name="min_lessons"' in response.data
+    assert b'Short course' not in response.data
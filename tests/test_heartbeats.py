@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from app import db
+from app.models import CourseLesson, LessonProgress, ModuleProgress
+from app.progress import heartbeats
+
+
+def test_flush_writes_lesson_and_module_access(make_course, trainer):
+    make_course('Course', [[30, 30]])
+    first, second = CourseLesson.query.order_by(CourseLesson.id).all()
+    heartbeats.record(trainer.id, first.id, at=datetime(2026, 1, 1, 10))
+    heartbeats.record(trainer.id, second.id, at=datetime(2026, 1, 1, 11))
+    heartbeats.record(trainer.id, first.id, at=datetime(2026, 1, 1, 12))
+
+    assert heartbeats.flush() == 2
+    assert heartbeats.pending == 0
+    accessed = dict(db.session.execute(db.select(LessonProgress.lesson_id,
+                                                 LessonProgress.last_accessed)).all())
+    assert accessed == {first.id: datetime(2026, 1, 1, 12), second.id: datetime(2026, 1, 1, 11)}
+    assert db.session.scalar(db.select(ModuleProgress.last_accessed)) == datetime(2026, 1, 1, 12)
+
+
+# A beat for a lesson deleted before the flush is dropped; it must not keep
+# the rest of the buffer from being written
+def test_flush_drops_beats_for_deleted_lessons(make_course, trainer):
+    make_course('Course', [[30, 30]])
+    kept, deleted = CourseLesson.query.order_by(CourseLesson.id).all()
+    kept_id, deleted_id = kept.id, deleted.id
+    heartbeats.record(trainer.id, kept_id)
+    heartbeats.record(trainer.id, deleted_id)
+
+    db.session.delete(deleted)
+    db.session.commit()
+
+    assert heartbeats.flush() == 1
+    assert heartbeats.pending == 0
+    assert db.session.scalars(db.select(LessonProgress.lesson_id)).all() == [kept_id]
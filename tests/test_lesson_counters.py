@@ -0,0 +1,111 @@
+from app import db
+from app.models import Course, CourseLesson, CourseModule
+
+
+def _counters():
+    return (
+        db.session.execute(db.select(Course.id, Course.lesson_count, Course.lesson_minutes)
+                           .order_by(Course.id)).all(),
+        db.session.execute(db.select(CourseModule.id, CourseModule.lesson_count,
+                                     CourseModule.lesson_minutes).order_by(CourseModule.id)).all(),
+    )
+
+
+# The totals kept by the CourseLesson and CourseModule mapper events must
+# match a rebuild from the lesson table
+def assert_counters_match_rebuild():
+    stored = _counters()
+    Course.rebuild_lesson_counters()
+    assert stored == _counters()
+
+
+def test_lesson_insert(make_course):
+    course = make_course('Course', [[30, 45], [20]])
+
+    assert (course.lesson_count, course.lesson_minutes) == (3, 95)
+    assert [module.lesson_count for module in course.modules.order_by(CourseModule.order)] == [2, 1]
+
+    module = course.modules.first()
+    db.session.add(CourseLesson(title='Extra', order=5, duration=15, module=module))
+    db.session.commit()
+
+    assert (course.lesson_count, course.lesson_minutes) == (4, 110)
+    assert_counters_match_rebuild()
+
+
+def test_lesson_without_duration(make_course):
+    course = make_course('Course', [[30]])
+    db.session.add(CourseLesson(title='Untimed', order=1, duration=None, module=course.modules.first()))
+    db.session.commit()
+
+    assert (course.lesson_count, course.lesson_minutes) == (2, 30)
+    assert_counters_match_rebuild()
+
+
+def test_lesson_duration_change(make_course):
+    course = make_course('Course', [[30, 30]])
+    lesson = CourseLesson.query.first()
+
+    lesson.duration = 90
+    db.session.commit()
+
+    assert (course.lesson_count, course.lesson_minutes) == (2, 120)
+    assert_counters_match_rebuild()
+
+
+def test_lesson_moved_between_courses(make_course):
+    first, second = make_course('First', [[30, 40]]), make_course('Second', [[10]])
+    lesson = first.modules.first().lessons.filter_by(duration=40).one()
+
+    lesson.module_id = second.modules.first().id
+    lesson.duration = 50
+    db.session.commit()
+
+    assert (first.lesson_count, first.lesson_minutes) == (1, 30)
+    assert (second.lesson_count, second.lesson_minutes) == (2, 60)
+    assert_counters_match_rebuild()
+
+
+def test_lesson_delete(make_course):
+    course = make_course('Course', [[30, 45]])
+
+    db.session.delete(CourseLesson.query.filter_by(duration=45).one())
+    db.session.commit()
+
+    assert (course.lesson_count, course.lesson_minutes) == (1, 30)
+    assert_counters_match_rebuild()
+
+
+def test_module_moved_to_another_course(make_course):
+    first, second = make_course('First', [[30], [20, 25]]), make_course('Second', [[10]])
+    module = first.modules.filter_by(order=1).one()
+
+    module.course_id = second.id
+    db.session.commit()
+
+    assert (first.lesson_count, first.lesson_minutes) == (1, 30)
+    assert (second.lesson_count, second.lesson_minutes) == (3, 55)
+    assert module.lesson_count == 2
+    assert_counters_match_rebuild()
+
+
+def test_module_delete_cascades_to_lessons(make_course):
+    course = make_course('Course', [[30], [20, 25]])
+
+    db.session.delete(course.modules.filter_by(order=1).one())
+    db.session.commit()
+
+    assert CourseLesson.query.count() == 1
+    assert (course.lesson_count, course.lesson_minutes) == (1, 30)
+    assert_counters_match_rebuild()
+
+
+def test_course_delete_cascades(make_course):
+    doomed, kept = make_course('Doomed', [[30, 30]]), make_course('Kept', [[15]])
+
+    db.session.delete(doomed)
+    db.session.commit()
+
+    assert CourseModule.query.count() == 1
+    assert (kept.lesson_count, kept.lesson_minutes) == (1, 15)
+    assert_counters_match_rebuild()
@@ -0,0 +1,47 @@
+from app.email import build_message
+from app.mailer import mail_dispatcher
+
+
+def _message(recipient):
+    return build_message('Hello', [recipient], 'Text body', '<p>HTML body</p>')
+
+
+def test_dispatcher_delivers_over_pooled_connections(app, smtp_sink):
+    for number in range(5):
+        mail_dispatcher.submit(_message(f'user{number}@example.com'))
+    mail_dispatcher.join()
+
+    assert sorted(message.recipients[0] for message in smtp_sink.messages) == \
+        [f'user{number}@example.com' for number in range(5)]
+    stats = mail_dispatcher.stats_snapshot()
+    assert stats['sent'] == 5
+    assert stats['connections'] <= app.config['MAIL_WORKERS']
+
+
+def test_dispatcher_retries_temporary_failures(smtp_sink):
+    smtp_sink.fail_next = 2
+
+    mail_dispatcher.submit(_message('user@example.com'))
+    mail_dispatcher.join()
+
+    assert [message.recipients for message in smtp_sink.messages] == [['user@example.com']]
+    stats = mail_dispatcher.stats_snapshot()
+    assert (stats['sent'], stats['retried'], stats['failed']) == (1, 2, 0)
+
+
+def test_admin_mail_stats(client, admin, login, smtp_sink):
+    mail_dispatcher.submit(_message('user@example.com'))
+    mail_dispatcher.join()
+    login(admin)
+
+    response = client.get('/admin/admin/mail')
+
+    assert response.status_code == 200
+    assert response.json['dispatcher']['sent'] == 1
+    assert response.json['outbox'] == {}
+
+
+def test_admin_mail_stats_requires_admin(client, trainer, login):
+    login(trainer)
+
+    assert client.get('/admin/admin/mail').status_code == 403
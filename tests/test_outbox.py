@@ -0,0 +1,119 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.email import queue_email
+from app.mailer import MailStats, PooledConnection
+from app.models import OutboundEmail
+from app.outbox import claim_batch, deliver_batch, drain
+
+
+@pytest.fixture
+def queued(trainer):
+    def queued(count):
+        emails = [queue_email('confirm_email', trainer) for _ in range(count)]
+        db.session.commit()
+        return [email.id for email in emails]
+    return queued
+
+
+# Let the leases of everything being sent run out, as if its drainer had died
+def _expire_leases(app):
+    db.session.execute(
+        db.update(OutboundEmail)
+        .where(OutboundEmail.status == OutboundEmail.STATUS_SENDING)
+        .values(claimed_at=datetime.utcnow() - timedelta(seconds=app.config['OUTBOX_LEASE'] + 1))
+    )
+    db.session.commit()
+
+
+def test_claims_are_disjoint(queued):
+    ids = queued(5)
+
+    first_token, first = claim_batch(3)
+    second_token, second = claim_batch(3)
+
+    assert [email.id for email in first] == ids[:3]
+    assert [email.id for email in second] == ids[3:]
+    assert first_token != second_token
+    assert claim_batch(3) == (None, [])
+
+
+def test_reclaimed_row_is_finished_only_by_its_new_drainer(app, queued, smtp_sink):
+    queued(1)
+    stale_token, stale = claim_batch(10)
+    _expire_leases(app)
+    token, reclaimed = claim_batch(10)
+
+    connection = PooledConnection(MailStats())
+    stale_counts = deliver_batch(stale_token, stale, connection)
+    counts = deliver_batch(token, reclaimed, connection)
+    connection.close()
+
+    assert stale_counts['sent'] == 0
+    assert counts['sent'] == 1
+    email = db.session.get(OutboundEmail, reclaimed[0].id)
+    assert (email.status, email.attempts, email.claim_token) == (OutboundEmail.STATUS_SENT, 2, None)
+
+
+def test_expired_leases_stop_at_the_attempt_cap(app, queued):
+    app.config['OUTBOX_MAX_ATTEMPTS'] = 2
+    email_id, = queued(1)
+
+    for _ in range(2):
+        assert len(claim_batch(10)[1]) == 1
+        _expire_leases(app)
+
+    assert claim_batch(10) == (None, [])
+    email = db.session.get(OutboundEmail, email_id)
+    assert (email.status, email.attempts) == (OutboundEmail.STATUS_FAILED, 2)
+    assert email.last_error == 'Lease expired after 2 attempts'
+
+
+def test_drain_delivers_through_smtp(queued, smtp_sink, trainer):
+    queued(3)
+
+    assert drain() == {'sent': 3, 'retried': 0, 'failed': 0}
+    assert [message.recipients for message in smtp_sink.messages] == [[trainer.email]] * 3
+    assert smtp_sink.connections == 1
+
+
+def test_transient_failures_are_retried_up_to_the_cap(app, queued, smtp_sink):
+    app.config.update(OUTBOX_MAX_ATTEMPTS=2, OUTBOX_RETRY_BACKOFF=0)
+    smtp_sink.fail_next = 5
+    email_id, = queued(1)
+
+    assert drain() == {'sent': 0, 'retried': 1, 'failed': 1}
+    email = db.session.get(OutboundEmail, email_id)
+    assert (email.status, email.attempts) == (OutboundEmail.STATUS_FAILED, 2)
+    assert smtp_sink.messages == []
+
+
+# SKIP LOCKED needs a database with row locks
+def test_concurrent_drainers_never_share_a_row(app, queued):
+    if db.engine.dialect.name != 'postgresql':
+        pytest.skip('row locking needs PostgreSQL')
+    ids = queued(40)
+    claimed = [[], []]
+    start = threading.Barrier(2)
+
+    def drainer(claims):
+        with app.app_context():
+            start.wait()
+            while True:
+                _, emails = claim_batch(3)
+                if not emails:
+                    break
+                claims.extend(email.id for email in emails)
+            db.session.remove()
+
+    threads = [threading.Thread(target=drainer, args=(claims,)) for claims in claimed]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not set(claimed[0]) & set(claimed[1])
+    assert sorted(claimed[0] + claimed[1]) == ids
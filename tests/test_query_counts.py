@@ -0,0 +1,47 @@
+import pytest
+
+from app import db
+from app.instrumentation import query_budget
+from app.models import Review, enrollments
+
+
+@pytest.fixture
+def catalog(make_course, trainer):
+    courses = [make_course(f'Course {i}', [[30, 30], [15]]) for i in range(12)]
+    db.session.add_all([Review(course_id=course.id, user_id=trainer.id, rating=4, text='Good')
+                        for course in courses for _ in range(3)])
+    db.session.commit()
+    return courses
+
+
+@pytest.fixture
+def enrolled_client(client, catalog, trainer):
+    db.session.execute(enrollments.insert(), [{'user_id': trainer.id, 'course_id': course.id}
+                                              for course in catalog])
+    db.session.commit()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(trainer.id)
+        session['_fresh'] = True
+    return client
+
+
+# Listing and detail pages run a fixed number of queries, however many courses,
+# modules, lessons and reviews there are
+@pytest.mark.parametrize(('path', 'budget'), [
+    ('/courses/courses', 2),
+    ('/courses/courses/1', 4),
+])
+def test_anonymous_course_pages(client, catalog, path, budget):
+    with query_budget(budget, threshold=3):
+        response = client.get(path)
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize(('path', 'budget'), [
+    ('/courses/courses', 3),
+    ('/courses/courses/1', 7),
+])
+def test_enrolled_course_pages(enrolled_client, path, budget):
+    with query_budget(budget, threshold=3):
+        response = enrolled_client.get(path)
+    assert response.status_code == 200
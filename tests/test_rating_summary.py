@@ -0,0 +1,84 @@
+from app import db
+from app.models import Course, Review
+
+
+def _summaries():
+    columns = [Course.id, Course.rating_count, Course.rating_sum,
+               *(getattr(Course, f'rating_{star}_count') for star in Review.STARS)]
+    return db.session.execute(db.select(*columns).order_by(Course.id)).all()
+
+
+# The summaries kept by the Review mapper events must match a rebuild from scratch
+def assert_summaries_match_rebuild():
+    stored = _summaries()
+    Course.rebuild_rating_summary()
+    assert stored == _summaries()
+
+
+def test_review_insert(make_course, trainer):
+    course = make_course('Course')
+    db.session.add_all([Review(course_id=course.id, user_id=trainer.id, rating=rating)
+                        for rating in (5, 4, 4.5, 1)])
+    db.session.commit()
+
+    assert course.rating_count == 4
+    assert course.average_rating == 3.625
+    assert course.rating_histogram == {1: 1, 2: 0, 3: 0, 4: 1, 5: 2}
+    assert_summaries_match_rebuild()
+
+
+def test_review_rating_update(make_course, trainer):
+    course = make_course('Course')
+    review = Review(course_id=course.id, user_id=trainer.id, rating=2)
+    db.session.add(review)
+    db.session.commit()
+
+    review.rating = 5
+    db.session.commit()
+
+    assert course.rating_histogram == {1: 0, 2: 0, 3: 0, 4: 0, 5: 1}
+    assert course.rating_sum == 5
+    assert_summaries_match_rebuild()
+
+
+def test_review_moved_to_another_course(make_course, trainer):
+    first, second = make_course('First'), make_course('Second')
+    review = Review(course_id=first.id, user_id=trainer.id, rating=3)
+    db.session.add(review)
+    db.session.commit()
+
+    review.course_id = second.id
+    review.rating = 4
+    db.session.commit()
+
+    assert (first.rating_count, second.rating_count) == (0, 1)
+    assert second.rating_histogram[4] == 1
+    assert_summaries_match_rebuild()
+
+
+def test_review_delete(make_course, trainer):
+    course = make_course('Course')
+    reviews = [Review(course_id=course.id, user_id=trainer.id, rating=rating) for rating in (3, 5)]
+    db.session.add_all(reviews)
+    db.session.commit()
+
+    db.session.delete(reviews[0])
+    db.session.commit()
+
+    assert course.rating_count == 1
+    assert course.average_rating == 5
+    assert_summaries_match_rebuild()
+
+
+def test_course_delete_cascades_to_reviews(make_course, trainer):
+    doomed, kept = make_course('Doomed'), make_course('Kept')
+    db.session.add_all([Review(course_id=doomed.id, user_id=trainer.id, rating=4),
+                        Review(course_id=kept.id, user_id=trainer.id, rating=2)])
+    db.session.commit()
+
+    db.session.delete(doomed)
+    db.session.commit()
+
+    assert Review.query.count() == 1
+    assert kept.rating_count == 1
+    assert_summaries_match_rebuild()
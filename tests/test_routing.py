@@ -0,0 +1,13 @@
+from app import routing
+
+
+# The replica has no tables, so every read sent to it fails
+def test_failed_replica_read_is_retried_on_the_primary(app, client, make_course, tmp_path):
+    app.config['SQLALCHEMY_REPLICA_URIS'] = [f'sqlite:///{tmp_path / "replica.db"}']
+    routing.init_app(app)
+    make_course('Replicated Scrum', [[30]])
+
+    response = client.get('/courses/courses')
+
+    assert response.status_code == 200
+    assert b'Replicated Scrum' in response.data
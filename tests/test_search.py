@@ -0,0 +1,110 @@
+from datetime import datetime
+
+import pytest
+
+from app import db
+from app.models import Article
+from app.search import search
+
+
+@pytest.fixture
+def make_article(trainer):
+    def make_article(title, body, summary=None, published=True):
+        article = Article(title=title, body=body, summary=summary, author_id=trainer.id,
+                          published=published, published_at=datetime.utcnow() if published else None)
+        db.session.add(article)
+        db.session.commit()
+        return article
+    return make_article
+
+
+def _titles(results):
+    return [hit.title for hit in results]
+
+
+def test_title_matches_outrank_body_matches(make_article, make_course):
+    make_article('Working agreements', 'Teams write down how they run the retrospective.')
+    make_article('Retrospective formats', 'Start, stop, continue and the sailboat.')
+    make_course('Scrum in practice', [[30]])
+
+    results = search('retrospective')
+
+    assert _titles(results) == ['Retrospective formats', 'Working agreements']
+    assert results.total == 2
+    assert [hit.obj.title for hit in results] == _titles(results)
+
+
+def test_every_word_must_match_exactly_or_as_prefix(make_article):
+    make_article('Sprint planning', 'Capacity and the sprint goal.')
+    make_article('Sprint review', 'Demonstrate the increment.')
+
+    assert _titles(search('sprint goal')) == ['Sprint planning']
+    assert _titles(search('plan')) == ['Sprint planning']
+    assert _titles(search('the')) == []
+
+
+def test_doc_types_and_paging(make_article, make_course):
+    make_course('Agile estimation', [[30]])
+    for number in range(3):
+        make_article(f'Estimation {number}', 'Story points.')
+
+    assert [hit.doc_type for hit in search('estimation', doc_types=('course',))] == ['course']
+    second_page = search('estimation', doc_types=('article',), page=2, per_page=2)
+    assert (len(second_page), second_page.total, second_page.has_next) == (1, 3, False)
+
+
+def test_index_follows_committed_changes(make_article):
+    draft = make_article('Kanban flow', 'Limit work in progress.', published=False)
+    assert _titles(search('kanban')) == []
+
+    draft.published = True
+    db.session.commit()
+    assert _titles(search('kanban')) == ['Kanban flow']
+
+    draft.title = 'Flow metrics'
+    db.session.commit()
+    assert _titles(search('kanban')) == []
+    assert _titles(search('metrics')) == ['Flow metrics']
+
+    db.session.delete(draft)
+    db.session.commit()
+    assert _titles(search('metrics')) == []
+
+
+def test_rolled_back_changes_are_not_indexed(make_article):
+    make_article('Daily scrum', 'Fifteen minutes.')
+
+    db.session.add(Article(title='Backlog refinement', body='Ready items.', published=True))
+    db.session.flush()
+    db.session.rollback()
+
+    assert _titles(search('refinement')) == []
+
+
+# Rows written without the ORM (bulk imports) only become searchable on reindex
+def test_reindex_command_indexes_bulk_inserted_rows(app, make_article):
+    make_article('Definition of done', 'Quality criteria.')
+    db.session.execute(Article.__table__.insert(), [
+        {'title': 'Imported article', 'body': 'Bulk loaded.', 'published': True,
+         'created_at': datetime.utcnow()},
+        {'title': 'Imported draft', 'body': 'Bulk loaded.', 'published': False,
+         'created_at': datetime.utcnow()},
+    ])
+    db.session.commit()
+    assert _titles(search('imported')) == []
+
+    result = app.test_cli_runner().invoke(args=['search', 'reindex'])
+
+    assert result.exit_code == 0
+    assert result.output == 'Indexed 2 documents.\n'
+    assert _titles(search('imported')) == ['Imported article']
+    assert _titles(search('done')) == ['Definition of done']
+
+
+def test_search_page(client, make_article):
+    make_article('Velocity', 'Points per sprint.')
+
+    response = client.get('/articles/articles/search?q=velo')
+
+    assert response.status_code == 200
+    assert b'Velocity' in response.data
@@ -0,0 +1,107 @@
+import io
+import os
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import StoredBlob
+from app.storage import collect_garbage
+
+
+def _store(storage, content):
+    key = storage.store(io.BytesIO(content), 'text/plain')
+    db.session.commit()
+    return key
+
+
+def _ref_count(key):
+    db.session.expire_all()
+    return db.session.get(StoredBlob, key).ref_count
+
+
+def _age(key, seconds):
+    db.session.execute(
+        db.update(StoredBlob).where(StoredBlob.key == key)
+        .values(touched_at=datetime.utcnow() - timedelta(seconds=seconds))
+    )
+    db.session.commit()
+
+
+def test_identical_content_is_stored_once(local_storage):
+    first = _store(local_storage, b'same bytes')
+    second = _store(local_storage, b'same bytes')
+
+    assert first == second
+    assert db.session.scalar(db.select(db.func.count()).select_from(StoredBlob)) == 1
+    assert local_storage.backend.exists(first)
+
+
+def test_reference_counts_follow_the_columns(local_storage, make_course):
+    key = _store(local_storage, b'cover image')
+    other = _store(local_storage, b'other image')
+    first = make_course('First course')
+    second = make_course('Second course')
+    assert _ref_count(key) == 0
+
+    first.image = key
+    second.image = key
+    db.session.commit()
+    assert _ref_count(key) == 2
+
+    first.image = other
+    db.session.commit()
+    assert (_ref_count(key), _ref_count(other)) == (1, 1)
+
+    db.session.delete(second)
+    db.session.commit()
+    assert _ref_count(key) == 0
+
+
+def test_rolled_back_references_are_not_counted(local_storage, make_course):
+    key = _store(local_storage, b'cover image')
+    course = make_course('Course')
+
+    course.image = key
+    db.session.flush()
+    db.session.rollback()
+
+    assert _ref_count(key) == 0
+
+
+def test_gc_removes_unreferenced_blobs_after_the_grace_period(local_storage, make_course):
+    kept = _store(local_storage, b'referenced')
+    orphan = _store(local_storage, b'orphan')
+    young = _store(local_storage, b'just uploaded')
+    make_course('Course').image = kept
+    db.session.commit()
+    derived = local_storage.backend.path(orphan) + '-md.webp'
+    with open(derived, 'wb') as f:
+        f.write(b'variant')
+    for key in (kept, orphan):
+        _age(key, 7200)
+
+    assert collect_garbage(grace=3600) == 1
+
+    assert db.session.get(StoredBlob, orphan) is None
+    assert not local_storage.backend.exists(orphan)
+    assert not os.path.exists(derived)
+    assert local_storage.backend.exists(kept) and local_storage.backend.exists(young)
+
+
+# Storing content again while it waits for GC restarts its grace period
+def test_reupload_protects_a_blob_from_gc(local_storage):
+    key = _store(local_storage, b'orphan')
+    _age(key, 7200)
+
+    _store(local_storage, b'orphan')
+
+    assert collect_garbage(grace=3600) == 0
+    assert local_storage.backend.exists(key)
+
+
+def test_gc_command(app, local_storage):
+    _age(_store(local_storage, b'orphan'), 10)
+
+    result = app.test_cli_runner().invoke(args=['storage', 'gc', '--grace', '0'])
+
+    assert result.exit_code == 0
+    assert result.output == 'Removed 1 unreferenced blobs.\n'